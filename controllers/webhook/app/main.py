@@ -13,7 +13,7 @@ def _manage_rules_errors(event):
     if event.get("got_errors", False):
         app.logger.error("error processing {}".format(event["name"]),
                          extra={
-                             "props": {"exc_info": "\n".join(jp.match1("$..[*].exc_info", event))}
+                             "props": {"exc_info": "\n".join(jp.match1("$..[*].exc_info", event.to_dict()))}
                          })
         g.response["allowed"] = False
 
@@ -1,9 +1,9 @@
-import json
 import os
 from datetime import datetime
 
 from flask import Response
 from flask import request
+from krules_core.codec import json_codec
 from krules_core.providers import subject_factory
 
 from krules_core.route.router import DispatchPolicyConst
@@ -24,7 +24,7 @@ def main():
         dispatch_policy = os.environ.get("DISPATCH_POLICY", DispatchPolicyConst.NEVER)
 
         m = marshaller.NewDefaultHTTPMarshaller()
-        event = m.FromRequest(v1.Event(), request.headers, io.BytesIO(request.data), lambda x: json.load(x))
+        event = m.FromRequest(v1.Event(), request.headers, io.BytesIO(request.data), lambda x: json_codec().loads(x.read()))
         event_info = event.Properties()
         event_info.update(event_info.pop("extensions"))
         event_data = event_info.pop("data")
@@ -0,0 +1,102 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Micro-benchmark comparing the available codecs (see krules_core.codec) on the serialization done
+# by a storage storing and loading a subject (one value per property, as the redis storage does)
+# and by the cloudevents dispatcher (a JSON body per event). Codecs whose package is missing are skipped.
+#
+#   PYTHONPATH=. python benchmarks/bench_codec.py [n_iterations]
+
+import inspect
+import sys
+import timeit
+
+from dependency_injector import providers
+
+from krules_core.codec import CODECS, get_codec, encode, decode, json_codec
+from krules_core.providers import codec_factory
+from krules_core.subject import SubjectProperty, SubjectExtProperty
+
+# a device with its configuration, last readings and some bookkeeping
+SUBJECT_PROPS = {
+    "status": "ACTIVE",
+    "temp": 21.7,
+    "humidity": 48,
+    "battery": 0.83,
+    "last_seen": "2020-11-03T10:21:48.123456+00:00",
+    "firmware": {"version": "2.4.1", "build": 20201012, "channel": "stable"},
+    "location": {"lat": 45.4642, "lng": 9.19, "site": "milan-03", "floor": 2},
+    "thresholds": {"temp": {"min": 5.0, "max": 35.0}, "humidity": {"min": 20, "max": 80}},
+    "readings": [{"ts": 1604398908 + i * 60, "temp": 21.0 + i / 10, "humidity": 45 + i % 5} for i in range(24)],
+    "alerts": [],
+    "tags": ["hvac", "north-wing", "critical"],
+    "counter": 18231,
+    "notes": "Replaced sensor housing, calibration pending. Contact facility manager before maintenance.",
+}
+SUBJECT_EXT_PROPS = {"tenant": "acme", "device_class": "thermostat"}
+
+EVENT_PAYLOAD = {
+    "property_name": "temp",
+    "old_value": 21.5,
+    "value": 21.7,
+    "readings": SUBJECT_PROPS["readings"][-6:],
+    "_event_info": {
+        "id": "5b8e6f0a-3f7c-4a43-9e3c-0c2b5e6f2a10",
+        "source": "devices-ruleset",
+        "type": "subject-property-changed",
+        "subject": "device|acme|0001",
+        "time": "2020-11-03T10:21:48.123456+00:00",
+        "originid": "1e8d2c4b-77a1-4d2b-a2e9-2b0d0f5b9c3e",
+    },
+}
+
+
+def _json_default(obj):
+    # as the cloudevents dispatcher does
+    if inspect.isfunction(obj):
+        return obj.__name__
+    return str(type(obj))
+
+
+def _store():
+    return [SubjectProperty(name, value).encoded_value() for name, value in SUBJECT_PROPS.items()] + \
+           [SubjectExtProperty(name, value).encoded_value() for name, value in SUBJECT_EXT_PROPS.items()]
+
+
+def main(n=2000):
+    stored = None
+    print("{} iterations, {} properties per subject".format(n, len(SUBJECT_PROPS) + len(SUBJECT_EXT_PROPS)))
+    print("  {:10} {:>12} {:>12} {:>12} {:>12}".format("codec", "store us", "load us", "dispatch us", "bytes"))
+    for name in CODECS:
+        try:
+            codec = get_codec(name)
+        except ImportError:
+            print("  {:10} not installed".format(name))
+            continue
+        codec_factory.override(providers.Object(codec))
+        try:
+            stored = _store()
+            store = timeit.timeit(_store, number=n) / n * 1e6
+            load = timeit.timeit(lambda: [decode(value) for value in stored], number=n) / n * 1e6
+            dispatch = timeit.timeit(lambda: json_codec().dumps(EVENT_PAYLOAD, default=_json_default),
+                                     number=n) / n * 1e6
+            size = sum(len(value) for value in stored)
+        finally:
+            codec_factory.reset_last_overriding()
+        print("  {:10} {:12.1f} {:12.1f} {:12.1f} {:12d}".format(name, store, load, dispatch, size))
+
+    # values written by the last codec are readable by the default one
+    assert [decode(value) for value in stored] == list(SUBJECT_PROPS.values()) + list(SUBJECT_EXT_PROPS.values())
+    assert decode(encode(EVENT_PAYLOAD)) == EVENT_PAYLOAD
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:2]])
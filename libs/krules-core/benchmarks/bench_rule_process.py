@@ -0,0 +1,94 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Micro-benchmark comparing the per-event work done by Rule._process before and after
+# the introduction of compiled execution plans (procevents disabled).
+#
+#   PYTHONPATH=. python benchmarks/bench_rule_process.py [n_rules] [n_events]
+
+import inspect
+import os
+import sys
+import timeit
+
+os.environ["PUBLISH_PROCEVENTS_LEVEL"] = "0"
+
+from krules_core.base_functions import Filter, SetPayloadProperty, Process
+from krules_core.core import Rule
+from krules_core.providers import event_router_factory, configs_factory, subject_factory
+
+
+class LegacyRule(Rule):
+    """
+    Reproduces the per-event path as it was before execution plans (DISABLED procevents only)
+    """
+
+    def _process(self, event_type, subject, payload):
+        for section in (self._filters, self._processing):
+            for _c in section:
+                if inspect.isclass(_c):
+                    _c = _c()
+                _cinst_name = _c.__class__.__name__
+                _cinst = type(_cinst_name, (_c.__class__,), {})()
+                _cinst.event_type = event_type
+                _cinst.subject = subject
+                _cinst.payload = payload
+                _cinst.rule_name = self.name
+                _cinst.router = event_router_factory()
+                _cinst.configs = configs_factory()
+                processed_args = _c._get_args(_cinst)
+                processed_kwargs = _c._get_kwargs(_cinst)
+                res = _cinst.execute(*processed_args, **processed_kwargs)
+                if section is self._filters and not res:
+                    return
+
+
+def _make_rules(klass, n_rules):
+    rules = []
+    for i in range(n_rules):
+        rule = klass("bench-rule-{}".format(i))
+        rule.set_filters([
+            Filter(lambda payload: payload["value"] >= 0),
+            Filter(True),
+        ])
+        rule.set_processing([
+            SetPayloadProperty("checked", True),
+            Process(lambda payload: payload["value"] + 1),
+        ])
+        rules.append(rule)
+    return rules
+
+
+def _run(rules, subject, n_events):
+    def _events():
+        payload = {"value": 1}
+        for rule in rules:
+            rule._process("bench-event", subject, payload)
+    return min(timeit.repeat(_events, number=n_events, repeat=5))
+
+
+def main(n_rules=30, n_events=1000):
+    subject = subject_factory("bench-subject")
+    legacy = _run(_make_rules(LegacyRule, n_rules), subject, n_events)
+    compiled_rules = _make_rules(Rule, n_rules)
+    for rule in compiled_rules:
+        rule.compile()
+    compiled = _run(compiled_rules, subject, n_events)
+
+    per_event = lambda t: t / n_events * 1e6
+    print("{} rules per event, {} events".format(n_rules, n_events))
+    print("  legacy:   {:8.1f} us/event".format(per_event(legacy)))
+    print("  compiled: {:8.1f} us/event".format(per_event(compiled)))
+    print("  speedup:  {:8.2f}x".format(legacy / compiled))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:3]])
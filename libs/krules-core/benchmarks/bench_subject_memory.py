@@ -0,0 +1,176 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Memory benchmark comparing the bytes taken by a loaded subject (and by property objects)
+# with the former dict based layout and with the current slotted one. The legacy classes reproduce
+# the layout of the baseline release (no deferred events, versioning or partial loading), the slotted
+# subject carries the attributes added since, so the figures are conservative.
+# It also times attribute style property reads, which used to wrap each value in a proxy (the legacy
+# figure needs the wrapt package).
+#
+#   PYTHONPATH=. python benchmarks/bench_subject_memory.py [n_subjects] [n_props]
+
+import gc
+import sys
+import timeit
+import tracemalloc
+
+from dependency_injector import providers
+
+try:
+    import wrapt
+except ImportError:
+    wrapt = None
+
+from krules_core.providers import subject_storage_factory, subject_factory
+from krules_core.subject import PropertyType, SubjectProperty
+
+
+class _MemoryStorage(object):
+    """
+    Returns fresh copies of the same properties, as a storage decoding them would
+    """
+
+    def __init__(self, name, props, ext_props):
+        self._subject = name
+        self._props = props
+        self._ext_props = ext_props
+
+    def load(self):
+        return dict(self._props), dict(self._ext_props)
+
+
+class LegacySubject(object):
+    """
+    Reproduces the attributes and the cache layout of Subject as they were before slots
+    """
+
+    def __init__(self, name, storage):
+        self.name = name
+        self._use_cache = True
+        self._storage = storage
+        self._event_info = {}
+        self._cached = None
+
+    def _load(self):
+        props, ext_props = self._storage.load()
+        self._cached = {
+            PropertyType.DEFAULT: {"values": props, "created": set(), "updated": set(), "deleted": set()},
+            PropertyType.EXTENDED: {"values": ext_props, "created": set(), "updated": set(), "deleted": set()},
+        }
+
+    def __getattribute__(self, item):
+        try:
+            return super().__getattribute__(item)
+        except AttributeError:
+            if self._cached is None:
+                self._load()
+            vals = self._cached[PropertyType.DEFAULT]["values"]
+            if item not in vals:
+                raise
+            return LegacyPropertyProxy(self, item, vals[item])
+
+
+if wrapt is not None:
+
+    class LegacyPropertyProxy(wrapt.ObjectProxy):
+        """
+        The proxy wrapping each value read as an attribute before
+        """
+
+        _subject = None
+        _prop = None
+        _extended = None
+        _muted = None
+        _use_cache = None
+
+        def __init__(self, subject, prop, value):
+            super().__init__(value)
+            self._subject = subject
+            self._prop = prop
+            self._extended = False
+            self._muted = False
+            self._use_cache = True
+
+
+class LegacyProperty(object):
+
+    def __init__(self, name, value=None):
+        self.name = name
+        self.value = value
+        self.type = PropertyType.DEFAULT
+
+
+def _measure(build, n):
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    objects = [build(i) for i in range(n)]
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del objects
+    return used / n
+
+
+def main(n_subjects=20000, n_props=5):
+    props = {"p{}".format(i): i for i in range(n_props)}
+    ext_props = {"e": "ext"}
+
+    def _legacy(i):
+        subject = LegacySubject("subject-{}".format(i), _MemoryStorage("subject-{}".format(i), props, ext_props))
+        subject._load()
+        return subject
+
+    def _slotted(i):
+        subject = subject_factory("subject-{}".format(i))
+        subject.get("p0")
+        return subject
+
+    subject_storage_factory.override(
+        providers.Factory(lambda name, **kwargs: _MemoryStorage(name, props, ext_props))
+    )
+    try:
+        legacy = _measure(_legacy, n_subjects)
+        slotted = _measure(_slotted, n_subjects)
+    finally:
+        subject_storage_factory.reset_last_overriding()
+
+    legacy_prop = _measure(lambda i: LegacyProperty("p", i), n_subjects)
+    slotted_prop = _measure(lambda i: SubjectProperty("p", i), n_subjects)
+
+    print("{} cached subjects, {} properties each".format(n_subjects, n_props))
+    print("  legacy:   {:8.0f} bytes/subject".format(legacy))
+    print("  slotted:  {:8.0f} bytes/subject".format(slotted))
+    print("  saved:    {:8.1f}%".format((1 - slotted / legacy) * 100))
+    print("property objects")
+    print("  legacy:   {:8.0f} bytes/property".format(legacy_prop))
+    print("  slotted:  {:8.0f} bytes/property".format(slotted_prop))
+
+    subject_storage_factory.override(
+        providers.Factory(lambda name, **kwargs: _MemoryStorage(name, props, ext_props))
+    )
+    try:
+        slotted_subject = _slotted(0)
+        slotted_read = timeit.timeit(lambda: slotted_subject.p0, number=n_subjects) / n_subjects * 1e6
+    finally:
+        subject_storage_factory.reset_last_overriding()
+    print("attribute reads (subject.p0)")
+    if wrapt is None:
+        print("  legacy:   wrapt not installed")
+    else:
+        legacy_subject = _legacy(0)
+        legacy_read = timeit.timeit(lambda: legacy_subject.p0, number=n_subjects) / n_subjects * 1e6
+        print("  legacy:   {:8.2f} us/read".format(legacy_read))
+    print("  slotted:  {:8.2f} us/read".format(slotted_read))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:3]])
@@ -21,6 +21,8 @@ class RuleConst(object):
     DESCRIPTION = "description"
     SUBSCRIBE_TO = "subscribe_to"
     RULEDATA = "data"
+    PROCEVENTS_LEVEL = "procevents_level"
+    PREFETCH = "prefetch"
 
     FILTERS = "filters"
     PROCESSING = "processing"
@@ -49,6 +51,8 @@ class RuleConst(object):
 class ConfigKeyConst(object):
 
     TYPE_TOPICS_PREFIX = "TYPE_TOPICS_PREFIX"
+    # property names (glob patterns) whose changes are dispatched when no local rule handles them
+    PUBLISHED_SUBJECT_PROPERTIES = "PUBLISHED_SUBJECT_PROPERTIES"
 
 
 class ProcEventsLevel(object):
@@ -205,6 +205,7 @@ class SetSubjectProperty(RuleFunctionBase):
             property_name: Name of the property to set. It may or may not exist
             value: Value to set. It can be a callable and receives (optionally) the current property value.
                 If the property does not exist yet, it receives None. Note that value setting is an atomic operation.
+                For counters, krules_core.subject.Increment(amount) is applied natively by the storages supporting it.
             extended: If True set an extended property instead a standard one. [default False]
             muted: If True no subject-property-changed will be raised after property setting. Note that extended
                 properties are always muted so, if extended is True, this parameter will be ignored. [default False]
@@ -0,0 +1,130 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Serialization of subject properties and events.
+
+The codec in use is the one returned by codec_factory (see krules_core.providers), krules_env sets it
+from the KRULES_CODEC environment variable: "json" (the default, standard library), "orjson" or "msgpack"
+(the last two need the package of the same name). JSON codecs write plain JSON, so their values stay
+readable whatever the codec in use. Binary codecs prefix the values they encode with a tag identifying
+the codec and its format version, decode() reads values written by any codec.
+
+Storages keeping text (eg: sqlite) and events, which travel as JSON, use json_codec(): the codec in use
+if it writes JSON, the standard library one otherwise.
+"""
+
+import json
+
+# never used by msgpack and not valid at the start of a JSON document,
+# followed by a byte identifying the codec and its format version
+_TAG_MARKER = b"\xc1"
+
+
+class JsonCodec(object):
+
+    name = "json"
+    # prefix of the encoded values, None for plain JSON
+    tag = None
+
+    def dumps(self, obj, default=None):
+        return json.dumps(obj, default=default)
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def dumps(self, obj, default=None):
+        # like the standard library, keys are converted to strings
+        return self._orjson.dumps(obj, default=default, option=self._orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+
+class MsgpackCodec(object):
+
+    name = "msgpack"
+    tag = _TAG_MARKER + b"\x01"
+
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+
+    def dumps(self, obj, default=None):
+        return self._msgpack.packb(obj, default=default, use_bin_type=True)
+
+    def loads(self, data):
+        return self._msgpack.unpackb(data, raw=False)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec, OrjsonCodec, MsgpackCodec)}
+
+_instances = {}
+
+
+def get_codec(name):
+    """
+    Codec instance by name, raises ValueError for unknown codecs and ImportError when its package is missing
+    """
+    codec = _instances.get(name)
+    if codec is None:
+        if name not in CODECS:
+            raise ValueError("unknown codec {}".format(name))
+        codec = _instances[name] = CODECS[name]()
+    return codec
+
+
+def _tagged(tag):
+    for klass in CODECS.values():
+        if klass.tag == tag:
+            return get_codec(klass.name)
+    raise ValueError("unknown codec tag {!r}".format(tag))
+
+
+def current_codec():
+    from krules_core.providers import codec_factory
+
+    return codec_factory()
+
+
+def json_codec():
+    codec = current_codec()
+    if codec.tag is not None:
+        return get_codec(JsonCodec.name)
+    return codec
+
+
+def encode(value):
+    """
+    Value encoded with the codec in use (str for JSON codecs, bytes for binary ones)
+    """
+    codec = current_codec()
+    if codec.tag is None:
+        return codec.dumps(value)
+    return codec.tag + codec.dumps(value)
+
+
+def decode(data):
+    """
+    Value encoded by any codec
+    """
+    if isinstance(data, (bytes, bytearray)) and data[:1] == _TAG_MARKER:
+        return _tagged(bytes(data[:2])).loads(data[2:])
+    return json_codec().loads(data)
@@ -9,128 +9,268 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+
+import asyncio
+import contextvars
 import inspect
-from uuid import uuid4
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
-from .subject import storaged_subject
 from . import RuleConst as Const, ProcEventsLevel
-from .providers import event_router_factory, subject_factory, configs_factory
+from .providers import event_router_factory, subject_factory, configs_factory, metrics_factory
 
 import sys
 import traceback
+from time import perf_counter
 
 
 import logging
 
 from .utils import get_source
+from .tracked_payload import PayloadTracker
+from .procevents import LazyRecord, lazy
+from .guards import compile_guards
+from .metrics import RuleResult
 
 logger = logging.getLogger("__core__")
 
 from .providers import exceptions_dumpers_factory
-import jsonpatch
 import os
 from collections.abc import Mapping
 
 
+def _get_signature_info(func):
+    signature = inspect.signature(func)
+    return "%s(%s)" % (func.__name__, ", ".join(signature.parameters))
+
+
+def _copy_list(ll):
+    dst = []
+    for el in ll:
+        if isinstance(el, Mapping):
+            dst.append(_copy(el))
+        elif isinstance(el, (list, tuple)):
+            dst.append(_copy_list(el))
+        elif inspect.isfunction(el):
+            dst.append(_get_signature_info(el))
+        elif isinstance(el, (bool, int, float, str)) or el is None:
+            dst.append(el)
+        else:
+            dst.append(str(el))
+    return dst
+
+
+def _copy_value(v):
+    if isinstance(v, Mapping):
+        return _copy(v)
+    return _copy_list([v])[0]
+
+
+def _copy(pp):
+    cp = {}
+    for k, v in pp.items():
+        if isinstance(v, Mapping):
+            cp[k] = _copy(v)
+        elif isinstance(v, (list, tuple)):
+            cp[k] = _copy_list(v)
+        elif inspect.isfunction(v):
+            cp[k] = _get_signature_info(v)
+        elif isinstance(v, (bool, int, float, str)) or v is None:
+            cp[k] = v
+        else:
+            cp[k] = str(v)
+    return cp
+
+
+def _step_record(func_plan, processed_args, processed_kwargs, returns):
+    return {
+        Const.FUNC_NAME: func_plan.name,
+        Const.ARGS: lazy(lambda: _copy_list(processed_args)),
+        Const.KWARGS: lazy(lambda: _copy(processed_kwargs)),
+        Const.RETURNS: returns,
+    }
+
+
+def _publish(proc_event):
+    from .providers import proc_events_rx_factory
+
+    proc_events_rx_factory().on_next(LazyRecord(proc_event))  # one event for each processed rule
+
+
+# Everything that does not depend on the processed event is resolved once, when the rule is compiled:
+# the class used to instantiate each function, its bound argument processors and the provided singletons
+_FunctionPlan = namedtuple("_FunctionPlan", ("name", "klass", "func", "args", "kwargs", "is_async"))
+_RulePlan = namedtuple("_RulePlan", ("filters", "processing", "router", "configs", "metrics",
+                                     "procevents_level", "procevents_levels", "is_async", "guards"))
+
+def _run_coroutine(coro):
+    """
+    Runs a coroutine to completion for a caller using the sync API.
+    The running event loop (if any) can not be reentered, so the coroutine is then run in a new one,
+    in a helper thread sharing the caller context (the caller is blocked anyway).
+    Inside a running loop route_async should be preferred
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(context.run, asyncio.run, coro).result()
+
+
+def get_procevents_level():
+    """
+    Default procevents level, from PUBLISH_PROCEVENTS_LEVEL environment variable
+    """
+    return int(os.environ.get("PUBLISH_PROCEVENTS_LEVEL", ProcEventsLevel.DISABLED))
+
+
 class Rule:
 
+    # incremented each time a rule is compiled, the router relies on it to refresh what it takes from plans
+    _plans_generation = 0
+
     def __init__(self, name, description=""):
         self.name = name
         self.description = description,
         self._filters = []
         self._processing = []
         self._finally = []
+        self._procevents_level = None
+        self._plan = None
+        # rules not depending on the outcome of the others subscribed to the same events can be processed concurrently
+        self.independent = False
+        # subject properties read in a single storage access before processing (see Subject.prefetch)
+        self._prefetch = None
+
+    def set_prefetch(self, prefetch):
+        """
+        Names of the subject properties used by the rule, "ext_" prefixed for extended properties
+        """
+        props = tuple(name for name in prefetch if not name.startswith("ext_"))
+        ext_props = tuple(name[4:] for name in prefetch if name.startswith("ext_"))
+        self._prefetch = (props or ext_props) and (props, ext_props) or None
 
     def set_filters(self, filters):
 
         assert(isinstance(filters, type([])))
         self._filters.extend(filters)
+        self._plan = None
 
     def set_processing(self, processing):
         assert(isinstance(processing, type([])))
         self._processing.extend(processing)
+        self._plan = None
 
     def set_finally(self, finally_):
         self._finally.extend(finally_)
 
+    def set_procevents_level(self, procevents_level):
+        """
+        Override the default procevents level for this rule.
+        It can be a single level or a dictionary mapping event types to levels,
+        the "*" key is used for event types not explicitly mapped
+        """
+        self._procevents_level = procevents_level
+        self._plan = None
+
+    @staticmethod
+    def _compile_function(func):
+        if inspect.isclass(func):
+            func = func()
+        name = func.__class__.__name__
+        return _FunctionPlan(
+            name=name,
+            klass=type(name, (func.__class__,), {}),
+            func=func,
+            args=tuple(processor.process for processor in func._args),
+            kwargs=tuple((key, processor.process) for key, processor in func._kwargs.items()),
+            is_async=inspect.iscoroutinefunction(func.execute),
+        )
+
+    def compile(self):
+        """
+        Build the immutable execution plan used by each event processing.
+        It is done by RuleFactory.create, a rule modified afterwards is compiled again on the next event
+        """
+
+        procevents_level = self._procevents_level
+        procevents_levels = {}
+        if isinstance(procevents_level, Mapping):
+            procevents_levels = {k: int(v) for k, v in procevents_level.items() if k != "*"}
+            procevents_level = procevents_level.get("*")
+        if procevents_level is None:
+            procevents_level = get_procevents_level()
+
+        filters = tuple(self._compile_function(f) for f in self._filters)
+        processing = tuple(self._compile_function(f) for f in self._processing)
+        self._plan = _RulePlan(
+            filters=filters,
+            processing=processing,
+            router=event_router_factory(),
+            configs=configs_factory(),
+            metrics=metrics_factory(),
+            procevents_level=int(procevents_level),
+            procevents_levels=procevents_levels,
+            is_async=any(f.is_async for f in filters + processing),
+            guards=compile_guards([f.func for f in filters]),
+        )
+        Rule._plans_generation += 1
+        return self._plan
+
+    @property
+    def is_async(self):
+        """
+        True if some of the rule functions has a coroutine execute method
+        """
+        plan = self._plan
+        if plan is None:
+            plan = self.compile()
+        return plan.is_async
+
     def _process(self, event_type, subject, payload):
+        """
+        Sync entry point.
+        Rules without coroutine functions never suspend so they are driven to completion right away,
+        the others are run in a new event loop (see _run_coroutine)
+        """
+        coro = self._process_async(event_type, subject, payload)
+        if self.is_async:
+            return _run_coroutine(coro)
+        try:
+            coro.send(None)
+        except StopIteration:
+            return
+        coro.close()
+        raise RuntimeError("rule {} suspended without coroutine functions".format(self.name))
 
-        def __get_signature_info(func):
-            signature = inspect.signature(func)
-            return "%s(%s)" % (func.__name__, ", ".join(signature.parameters))
-
-        def __clean(dd):
-            del dd[Const.PROCESS_ID]
-            del dd[Const.TYPE]
-            del dd[Const.SUBJECT]
-            del dd[Const.RULENAME]
-            del dd[Const.SECTION]
-            dd.get(Const.PAYLOAD, {}).pop("_event_info", None)
-            return dd
-
-        def __convert_simple_subject_property_proxy(v):
-            if v is None:
-                return v
-            elif isinstance(v, bool):
-                return bool(v)
-            elif isinstance(v, int):
-                return int(v)
-            elif isinstance(v, float):
-                return float(v)
-            else:
-                return str(v)
-
-        def __copy_list(ll):
-            dst = []
-            for el in ll:
-                if isinstance(el, Mapping):
-                    dst.append(__copy(el))
-                elif isinstance(el, (list, tuple)):
-                    dst.append(__copy_list(el))
-                elif inspect.isfunction(el):
-                    dst.append(__get_signature_info(el))
-                elif isinstance(el, (bool, int, float, str)) or el is None:
-                    if isinstance(el, storaged_subject._SubjectPropertyProxy):
-                        el = __convert_simple_subject_property_proxy(el)
-                    dst.append(el)
-                else:
-                    dst.append(str(el))
-            return dst
-
-        def __copy(pp):
-            cp = {}
-            for k, v in pp.items():
-                if isinstance(v, Mapping):
-                    cp[k] = {}
-                    cp[k] = __copy(v)
-                elif isinstance(v, (list, tuple)):
-                    cp[k] = __copy_list(v)
-                elif inspect.isfunction(v):
-                    cp[k] = __get_signature_info(v)
-                elif isinstance(v, (bool, int, float, str)) or v is None:
-                    if isinstance(v, storaged_subject._SubjectPropertyProxy):
-                        v = __convert_simple_subject_property_proxy(v)
-                    cp[k] = v
-                else:
-                    cp[k] = str(v)
-            return cp
-
-        logger.debug("process {0} for {1}".format(event_type, self.name))
+    async def _process_async(self, event_type, subject, payload):
+
+        logger.debug("process %s for %s", event_type, self.name)
+
+        plan = self._plan
+        if plan is None:
+            plan = self.compile()
 
         if isinstance(subject, str):
             subject = subject_factory(subject)
 
-        from .providers import proc_events_rx_factory
+        if self._prefetch is not None:
+            subject.prefetch(*self._prefetch)
 
-        proc_events_rx = proc_events_rx_factory()  # one event for each processed rule
-
-        process_id = str(uuid4())
-        procevents_level = int(os.environ.get("PUBLISH_PROCEVENTS_LEVEL", ProcEventsLevel.DISABLED))
-        last_payload = {}
+        procevents_level = plan.procevents_levels.get(event_type, plan.procevents_level)
+        proc_event = None
+        payload_tracker = None
         if procevents_level != ProcEventsLevel.DISABLED:
-            payload_copy = __copy(payload)
-            event_info = payload_copy.pop("_event_info", subject.event_info())
-            res_full = {
+            # the payload is copied before functions can change it (nested values included),
+            # the rest of the procevent is only built when some subscriber reads it
+            payload_copy = _copy({k: v for k, v in payload.items() if k != "_event_info"})
+            if "_event_info" in payload:
+                event_info = _copy(payload["_event_info"])
+            else:
+                event_info = subject.event_info()
+            proc_event = {
                 Const.TYPE: event_type,
                 Const.SUBJECT: str(subject.name),
                 Const.RULENAME: self.name,
@@ -139,177 +279,120 @@ class Rule:
                 Const.PROCESSING: [],
                 Const.GOT_ERRORS: False,
                 Const.EVENT_INFO: event_info,
-                Const.SOURCE: get_source()
+                Const.SOURCE: lazy(get_source)
                 # DEPRECATED use event_info.get("source")
             }
             if procevents_level == ProcEventsLevel.FULL:
-                last_payload = __copy(payload)
+                # functions receive a payload recording its own changes
+                payload_tracker = PayloadTracker(payload, _copy_value)
+                payload = payload_tracker.payload
 
-        res_in = {}
-        processed_args = {}
+        metrics = plan.metrics.enabled and plan.metrics or None
+        if metrics is not None:
+            started = perf_counter()
+
+        section = Const.FILTERS
+        _f = None
+        processed_args = ()
         processed_kwargs = {}
+        passed = True
         try:
-            for _c in self._filters:
-                if inspect.isclass(_c):
-                    _c = _c()
-                _cinst_name = _c.__class__.__name__
-                if procevents_level != ProcEventsLevel.DISABLED:
-                    res_in = {
-                        Const.PROCESS_ID: process_id,
-                        Const.TYPE: event_type,
-                        Const.SUBJECT: str(subject.name),
-                        Const.RULENAME: self.name,
-                        Const.SECTION: Const.FILTERS,
-                        Const.FUNC_NAME: _cinst_name,
-                        Const.PAYLOAD: __copy(payload),
-                        Const.ARGS: __copy_list(_c._args),
-                        Const.KWARGS: __copy(_c._kwargs),
-                    }
-                    logger.debug("> processing: {0}".format(res_in))
-                _cinst = type(_cinst_name, (_c.__class__,), {})()
-                _cinst.event_type = event_type
-                _cinst.subject = subject
-                _cinst.payload = payload
-                _cinst.rule_name = self.name
-                _cinst.router = event_router_factory()
-                _cinst.configs = configs_factory()
-                try:
-                    processed_args = _c._get_args(_cinst)
-                    processed_kwargs = _c._get_kwargs(_cinst)
-                    res = _cinst.execute(*processed_args, **processed_kwargs)
-                except TypeError as ex:
-                    msg = "{} in {}: ".format(_cinst_name, self.name)
-                    raise TypeError(msg + str(ex))
-                if procevents_level != ProcEventsLevel.DISABLED:
-                    res_out = {
-                        Const.PROCESS_ID: res_in[Const.PROCESS_ID],
-                        Const.TYPE: res_in[Const.TYPE],
-                        Const.SUBJECT: res_in[Const.SUBJECT],
-                        Const.RULENAME: res_in[Const.RULENAME],
-                        Const.SECTION: res_in[Const.SECTION],
-                        Const.FUNC_NAME: res_in[Const.FUNC_NAME],
-                        Const.ARGS: __copy_list(processed_args),
-                        Const.KWARGS: __copy(processed_kwargs),
-                        Const.RETURNS: res
-                    }
-
-                    if procevents_level == ProcEventsLevel.FULL:
-                        payload_copy = __copy(payload)
-                        payload_patches = jsonpatch.JsonPatch.from_diff(last_payload, payload_copy).patch
-                        last_payload = payload_copy
-                        res_out[Const.PAYLOAD_DIFFS] = payload_patches,
-                        logger.debug("< processed: {0}".format({'payload_diffs': res_out[Const.PAYLOAD_DIFFS], 'returns': res_out[Const.RETURNS]}))
-                    res_full[Const.FILTERS].append(__clean(res_out))
-                if not res:
-                    if procevents_level != ProcEventsLevel.DISABLED:
-                        res_full[Const.PASSED] = False
-                        proc_events_rx.on_next(res_full)
-                    return
-                if procevents_level != ProcEventsLevel.DISABLED:
-                    res_full[Const.PASSED] = True
-
-            for _c in self._processing:
-                if inspect.isclass(_c):
-                    _c = _c()
-                _cinst_name = _c.__class__.__name__
-                if procevents_level != ProcEventsLevel.DISABLED:
-                    res_in = {
-                        Const.PROCESS_ID: process_id,
-                        Const.TYPE: event_type,
-                        Const.SUBJECT: str(subject.name),
-                        Const.RULENAME: self.name,
-                        Const.SECTION: Const.PROCESSING,
-                        Const.FUNC_NAME: _cinst_name,
-                        Const.PAYLOAD: __copy(payload),
-                        Const.ARGS: __copy_list(_c._args),
-                        Const.KWARGS: __copy(_c._kwargs),
-                    }
-                    logger.debug("> processing: {0}".format(res_in))
-                _cinst = type(_cinst_name, (_c.__class__,), {})()
-                _cinst.event_type = event_type
-                _cinst.subject = subject
-                _cinst.payload = payload
-                _cinst.rule_name = self.name
-                _cinst.router = event_router_factory()
-                _cinst.configs = configs_factory()
-                try:
-                    processed_args = _c._get_args(_cinst)
-                    processed_kwargs = _c._get_kwargs(_cinst)
-                    res = _cinst.execute(*processed_args, **processed_kwargs)
-                except TypeError as ex:
-                    msg = "{} in {}: ".format(_cinst_name, self.name)
-                    raise TypeError(msg + str(ex))
-                if procevents_level != ProcEventsLevel.DISABLED:
-                    res_out = {
-                        Const.PROCESS_ID: res_in[Const.PROCESS_ID],
-                        Const.TYPE: res_in[Const.TYPE],
-                        Const.SUBJECT: res_in[Const.SUBJECT],
-                        Const.RULENAME: res_in[Const.RULENAME],
-                        Const.SECTION: res_in[Const.SECTION],
-                        Const.FUNC_NAME: res_in[Const.FUNC_NAME],
-                        Const.ARGS: __copy_list(processed_args),
-                        Const.KWARGS: __copy(processed_kwargs),
-                        Const.RETURNS: res,
-                    }
-                    if procevents_level == ProcEventsLevel.FULL:
-                        payload_copy = __copy(payload)
-                        payload_patches = jsonpatch.JsonPatch.from_diff(last_payload, payload_copy).patch
-                        last_payload = payload_copy
-                        res_out[Const.PAYLOAD_DIFFS] = payload_patches
-                        logger.debug("< processed: {0}".format({'payload_diffs': res_out[Const.PAYLOAD_DIFFS],
-                                                                'returns': res_out[Const.RETURNS]}))
-                    res_full[Const.PROCESSING].append(__clean(res_out))
-
-            if procevents_level != ProcEventsLevel.DISABLED:
-                if Const.PASSED not in res_full:
-                    res_full[Const.PASSED] = True
-                proc_events_rx.on_next(res_full)
+            for section, functions in ((Const.FILTERS, plan.filters), (Const.PROCESSING, plan.processing)):
+                for _f in functions:
+                    if proc_event is not None and logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("> processing: %s", {
+                            Const.RULENAME: self.name,
+                            Const.SECTION: section,
+                            Const.FUNC_NAME: _f.name,
+                            Const.PAYLOAD: _copy(payload),
+                            Const.ARGS: _copy_list(_f.func._args),
+                            Const.KWARGS: _copy(_f.func._kwargs),
+                        })
+                    if metrics is not None:
+                        func_started = perf_counter()
+                    _cinst = _f.klass()
+                    _cinst.event_type = event_type
+                    _cinst.subject = subject
+                    _cinst.payload = payload
+                    _cinst.rule_name = self.name
+                    _cinst.router = plan.router
+                    _cinst.configs = plan.configs
+                    try:
+                        processed_args = tuple([process(_cinst) for process in _f.args])
+                        processed_kwargs = {key: process(_cinst) for key, process in _f.kwargs}
+                        res = _cinst.execute(*processed_args, **processed_kwargs)
+                        if _f.is_async:
+                            res = await res
+                    except TypeError as ex:
+                        msg = "{} in {}: ".format(_f.name, self.name)
+                        raise TypeError(msg + str(ex))
+                    if metrics is not None:
+                        metrics.observe_function(section, _f.name, perf_counter() - func_started)
+                    if proc_event is not None:
+                        step = _step_record(_f, processed_args, processed_kwargs, res)
+                        if payload_tracker is not None:
+                            step[Const.PAYLOAD_DIFFS] = payload_tracker.pop_patches()
+                            logger.debug("< processed: %s", {'payload_diffs': step[Const.PAYLOAD_DIFFS],
+                                                             'returns': res})
+                        proc_event[section].append(LazyRecord(step))
+                    if section == Const.FILTERS and not res:
+                        passed = False
+                        break
+                if not passed:
+                    break
+
+            if proc_event is not None:
+                proc_event[Const.PASSED] = passed
+                _publish(proc_event)
+
+            if metrics is not None:
+                metrics.observe_rule(self.name, perf_counter() - started,
+                                     passed and RuleResult.PASSED or RuleResult.FILTERED)
 
         except Exception as e:
             logger.error("catched exception of type {0} ({1})".format(type(e), getattr(e, 'message', str(e))))
-            if proc_events_rx and procevents_level != ProcEventsLevel.DISABLED:
-
-                type_, value_, traceback_ = sys.exc_info()
-                res_out = {
-                    Const.PROCESS_ID: res_in[Const.PROCESS_ID],
-                    Const.TYPE: res_in[Const.TYPE],
-                    Const.SUBJECT: res_in[Const.SUBJECT],
-                    Const.RULENAME: res_in[Const.RULENAME],
-                    Const.SECTION: res_in[Const.SECTION],
-                    Const.FUNC_NAME: res_in[Const.FUNC_NAME],
-                    Const.ARGS: __copy_list(processed_args),
-                    Const.KWARGS: __copy(processed_kwargs),
-                    Const.RETURNS: None,
+            if metrics is not None:
+                metrics.observe_rule(self.name, perf_counter() - started, RuleResult.ERROR)
+            if proc_event is not None:
+
+                # formatted now, records kept to be replayed must not hold the frames of the failed rule
+                step = _step_record(_f, processed_args, processed_kwargs, None)
+                step.update({
                     Const.EXCEPTION: ".".join([type(e).__module__, type(e).__name__]),
-                    Const.EXC_INFO: traceback.format_exception(type_, value_, traceback_),
+                    Const.EXC_INFO: traceback.format_exception(*sys.exc_info()),
                     Const.EXC_EXTRA_INFO: exceptions_dumpers_factory().dump(e),
-                }
-                if procevents_level == ProcEventsLevel.FULL:
-                    payload_copy = __copy(payload)
-                    payload_patches = jsonpatch.JsonPatch.from_diff(last_payload, payload_copy).patch
-                    res_out[Const.PAYLOAD_DIFFS] = payload_patches
+                })
+                if payload_tracker is not None:
+                    step[Const.PAYLOAD_DIFFS] = payload_tracker.pop_patches()
+                step = LazyRecord(step)
 
-                logger.error(res_out)
-                logger.debug("# unprocessed: {0}".format(res_out))
-                res_full[Const.GOT_ERRORS] = True
-                if Const.PASSED not in res_full:  # this happens when exception is in filters
-                    res_full[Const.PASSED] = False
-                res_full[res_out[Const.SECTION]].append(__clean(res_out))
-                proc_events_rx.on_next(res_full)
+                logger.error(step)
+                proc_event[Const.GOT_ERRORS] = True
+                proc_event[Const.PASSED] = passed and section != Const.FILTERS
+                proc_event[section].append(step)
+                _publish(proc_event)
 
 
 class RuleFactory:
 
     @staticmethod
-    def create(name: object, description: object = "", subscribe_to: object = None, data: object = {}) -> object:
+    def create(name: object, description: object = "", subscribe_to: object = None, data: object = {},
+               procevents_level: object = None, independent: object = False, prefetch: object = ()) -> object:
 
         rule = Rule(name, description)
 
         rule.set_filters(data.get(Const.FILTERS, []))
         rule.set_processing(data.get(Const.PROCESSING, []))
         rule.set_finally(data.get(Const.FINALLY, []))
+        rule.set_procevents_level(procevents_level)
+        rule.independent = independent
+        rule.set_prefetch(prefetch)
+
+        rule.compile()
 
         if isinstance(subscribe_to, str):
             subscribe_to = (subscribe_to,)
         for el in subscribe_to:
             event_router_factory().register(rule, el)
+
+        return rule
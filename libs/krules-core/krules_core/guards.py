@@ -0,0 +1,115 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Static guards extracted from the leading filters of a rule.
+
+A filter whose outcome only depends on constant arguments and the payload can be evaluated by the
+router before invoking the rule, so that rules which cannot match are skipped without building any
+function instance. Only pure filters are guarded: OnSubjectPropertyChanged, PayloadMatch and
+PayloadMatchOne without payload_dest. SubjectNameMatch and SubjectNameDoesNotMatch are not, they write
+the groups of the expression in the payload (even when SubjectNameDoesNotMatch fails) and a following
+filter may depend on them. Only leading filters are considered and extraction stops at the first filter
+which is not understood.
+"""
+
+import inspect
+from collections import namedtuple
+
+import jsonpath_rw_ext as jp
+
+from .arg_processors import BaseArgProcessor, DefaultArgProcessor
+from .base_functions.filters import PayloadMatch, PayloadMatchOne, OnSubjectPropertyChanged
+
+# property_names: names accepted by a leading OnSubjectPropertyChanged (None when there is no such constraint)
+# predicates: callables (subject, payload) -> bool, all of them must be true for the rule to be invoked
+RuleGuards = namedtuple("RuleGuards", ("property_names", "predicates"))
+
+NO_GUARDS = RuleGuards(None, ())
+
+_NOT_CONSTANT = object()
+
+
+def _constant_arguments(func):
+    """
+    Maps execute parameter names to their value when it does not depend on the processed event
+    """
+    try:
+        bound = inspect.signature(func.execute).bind(*func._args, **func._kwargs)
+    except TypeError:
+        return None
+    bound.apply_defaults()
+    parameters = bound.signature.parameters
+    arguments = {}
+    for name, value in bound.arguments.items():
+        if parameters[name].kind in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD):
+            continue
+        if isinstance(value, BaseArgProcessor):
+            value = value.process(None) if type(value) is DefaultArgProcessor else _NOT_CONSTANT
+        arguments[name] = value
+    return arguments
+
+
+def _payload_match(jp_expr, match_value, single_match):
+    parsed = jp.parse(jp_expr)
+
+    def _match(subject, payload):
+        match = [m.value for m in parsed.find(payload)]
+        if single_match:
+            match = match[0] if match else None
+        return match == match_value
+
+    return _match
+
+
+def _guard(func):
+    """
+    Returns a property name, a predicate or None if the filter cannot be evaluated in advance
+    """
+    klass = func.__class__
+    if klass not in (OnSubjectPropertyChanged, PayloadMatch, PayloadMatchOne):
+        return None
+    args = _constant_arguments(func)
+    if args is None:
+        return None
+
+    if klass is OnSubjectPropertyChanged:
+        property_name = args["property_name"]
+        if isinstance(property_name, str):
+            return property_name
+    else:
+        jp_expr, match_value = args["jp_expr"], args["match_value"]
+        single_match = klass is PayloadMatchOne or args["single_match"]
+        # payload_dest is written even when the filter does not match
+        if isinstance(jp_expr, str) and args["payload_dest"] is None and isinstance(single_match, bool) \
+                and match_value is not _NOT_CONSTANT and not inspect.isfunction(match_value):
+            return _payload_match(jp_expr, match_value, single_match)
+    return None
+
+
+def compile_guards(filters):
+    """
+    Build the guards of a rule from its filters (rule functions, already instantiated)
+    """
+    property_names = None
+    predicates = []
+    for func in filters:
+        guard = _guard(func)
+        if guard is None:
+            break
+        if isinstance(guard, str):
+            property_names = frozenset((guard,)) if property_names is None else property_names & {guard}
+        else:
+            predicates.append(guard)
+    if property_names is None and not predicates:
+        return NO_GUARDS
+    return RuleGuards(property_names, tuple(predicates))
+
@@ -0,0 +1,154 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In process rules instrumentation.
+
+Rules record their latency and outcome, rule functions their latency (grouped by section and
+function class). Collection can be switched on and off at any time (enabled attribute, default from
+RULES_METRICS_ENABLED environment variable); while disabled rules do not even read the clock.
+render() produces the Prometheus text exposition format.
+"""
+
+import os
+import threading
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+
+
+class RuleResult:
+    PASSED = "passed"
+    FILTERED = "filtered"
+    ERROR = "error"
+
+
+class Histogram(object):
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """
+        Yields (upper bound, cumulative count) pairs
+        """
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            yield bound, cumulative
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    return ",".join('{}="{}"'.format(k, _escape(v)) for k, v in labels)
+
+
+def _format_bound(bound):
+    return bound == float("inf") and "+Inf" or repr(float(bound))
+
+
+class RulesMetrics(object):
+
+    def __init__(self, enabled=None, buckets=DEFAULT_BUCKETS):
+        if enabled is None:
+            enabled = os.environ.get("RULES_METRICS_ENABLED", "0").lower() in ("1", "true", "yes")
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._rules = {}
+        self._results = {}
+        self._functions = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._rules.clear()
+            self._results.clear()
+            self._functions.clear()
+
+    def observe_rule(self, rule_name, elapsed, result):
+        with self._lock:
+            histogram = self._rules.get(rule_name)
+            if histogram is None:
+                histogram = self._rules[rule_name] = Histogram(self.buckets)
+            histogram.observe(elapsed)
+            key = (rule_name, result)
+            self._results[key] = self._results.get(key, 0) + 1
+
+    def observe_function(self, section, function_name, elapsed):
+        key = (section, function_name)
+        with self._lock:
+            histogram = self._functions.get(key)
+            if histogram is None:
+                histogram = self._functions[key] = Histogram(self.buckets)
+            histogram.observe(elapsed)
+
+    def get_rule_results(self, rule_name):
+        """
+        Returns a dictionary mapping results (see RuleResult) to their count for the given rule
+        """
+        with self._lock:
+            return {result: count for (name, result), count in self._results.items() if name == rule_name}
+
+    def get_function_histogram(self, section, function_name):
+        return self._functions.get((section, function_name))
+
+    def get_rule_histogram(self, rule_name):
+        return self._rules.get(rule_name)
+
+    @staticmethod
+    def _render_histogram(lines, name, labels, histogram):
+        for bound, count in histogram.samples():
+            lines.append("{}_bucket{{{}}} {}".format(name, _labels(labels + (("le", _format_bound(bound)),)), count))
+        lines.append("{}_sum{{{}}} {}".format(name, _labels(labels), repr(histogram.sum)))
+        lines.append("{}_count{{{}}} {}".format(name, _labels(labels), histogram.count))
+
+    def render(self):
+        """
+        Prometheus text exposition format (version 0.0.4)
+        """
+        lines = []
+        with self._lock:
+            lines.append("# HELP krules_rule_duration_seconds Rules processing time")
+            lines.append("# TYPE krules_rule_duration_seconds histogram")
+            for rule_name, histogram in sorted(self._rules.items()):
+                self._render_histogram(lines, "krules_rule_duration_seconds", (("rule", rule_name),), histogram)
+
+            lines.append("# HELP krules_rule_results_total Processed rules by result")
+            lines.append("# TYPE krules_rule_results_total counter")
+            for (rule_name, result), count in sorted(self._results.items()):
+                lines.append("krules_rule_results_total{{{}}} {}".format(
+                    _labels((("rule", rule_name), ("result", result))), count))
+
+            lines.append("# HELP krules_function_duration_seconds Rule functions execution time")
+            lines.append("# TYPE krules_function_duration_seconds histogram")
+            for (section, function_name), histogram in sorted(self._functions.items()):
+                self._render_histogram(lines, "krules_function_duration_seconds",
+                                       (("section", section), ("function", function_name)), histogram)
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,136 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from collections.abc import Mapping
+from datetime import timedelta
+
+from rx.subject import ReplaySubject
+from rx.subject.replaysubject import QueueItem
+
+
+class lazy(object):
+    """
+    Marks a LazyRecord field computed only when it is first accessed
+    """
+
+    __slots__ = ("func",)
+
+    def __init__(self, func):
+        self.func = func
+
+
+def _to_plain(value):
+    if isinstance(value, LazyRecord):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [_to_plain(v) for v in value]
+    return value
+
+
+class LazyRecord(Mapping):
+    """
+    Read only mapping used for procevents.
+    The rule only keeps references to the arguments of the functions it processed, copies and
+    serializations happen when a field is accessed, so that records discarded by subscribers cost
+    almost nothing. The input payload (copied before functions can change it), the event info and
+    the errors (formatted) are resolved when the record is built, not to keep subjects and exception
+    frames alive in the replay buffer.
+    Use to_dict to get a plain (JSON serializable) dictionary.
+    """
+
+    __slots__ = ("_fields",)
+
+    def __init__(self, fields):
+        self._fields = fields
+
+    def __getitem__(self, key):
+        value = self._fields[key]
+        if isinstance(value, lazy):
+            value = self._fields[key] = value.func()
+        return value
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def to_dict(self):
+        return {k: _to_plain(self[k]) for k in self._fields}
+
+
+class DropPolicy(object):
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+
+
+class BoundedReplaySubject(ReplaySubject):
+    """
+    ReplaySubject keeping at most buffer_size records and/or records not older than window (seconds).
+    Live subscribers still receive every record, the bounds apply to what is kept to be replayed
+    to late subscribers. When the buffer is full, drop_oldest evicts the oldest record while
+    drop_newest does not keep the incoming one.
+    Records discarded because the buffer is full are counted in dropped, those leaving the time
+    window in expired.
+    """
+
+    def __init__(self, buffer_size=None, window=None, policy=DropPolicy.DROP_OLDEST, scheduler=None):
+        if policy not in (DropPolicy.DROP_OLDEST, DropPolicy.DROP_NEWEST):
+            raise ValueError("unknown procevents drop policy: {}".format(policy))
+        super().__init__(buffer_size=buffer_size, window=window, scheduler=scheduler)
+        self.policy = policy
+        self.dropped = 0
+        self.expired = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        Configured by PROCEVENTS_BUFFER_SIZE (default 1000, 0 means unbounded),
+        PROCEVENTS_BUFFER_WINDOW (seconds, default unbounded) and PROCEVENTS_DROP_POLICY
+        (drop_oldest or drop_newest) environment variables
+        """
+        buffer_size = int(os.environ.get("PROCEVENTS_BUFFER_SIZE", 1000)) or None
+        window = os.environ.get("PROCEVENTS_BUFFER_WINDOW")
+        return cls(
+            buffer_size=buffer_size,
+            window=window and timedelta(seconds=float(window)) or None,
+            policy=os.environ.get("PROCEVENTS_DROP_POLICY", DropPolicy.DROP_OLDEST),
+        )
+
+    def _trim(self, now):
+        while len(self.queue) > self.buffer_size:
+            self.queue.pop(0)
+            self.dropped += 1
+
+        while self.queue and (now - self.queue[0].interval) > self.window:
+            self.queue.pop(0)
+            self.expired += 1
+
+    def _on_next_core(self, value):
+        with self.lock:
+            observers = self.observers.copy()
+            now = self.scheduler.now
+            self._trim(now)
+            if self.policy == DropPolicy.DROP_NEWEST and len(self.queue) >= self.buffer_size:
+                self.dropped += 1
+            else:
+                self.queue.append(QueueItem(interval=now, value=value))
+                self._trim(now)
+
+        for observer in observers:
+            observer.on_next(value)
+
+        for observer in observers:
+            observer.ensure_active()
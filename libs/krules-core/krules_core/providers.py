@@ -10,15 +10,18 @@
 # limitations under the License.
 
 
-from rx import subject, from_future
-
 from dependency_injector import providers as providers
 from krules_core.subject.empty_storage import EmptySubjectStorage
 
 from .route.dispatcher import BaseDispatcher
 from .route.router import EventRouter
-from .subject.storaged_subject import Subject
+from .subject.scope import scoped_subject
+from .subject.cache import SubjectsCache
+from .subject.write_behind import WriteBehindQueue
+from .codec import JsonCodec
 from .exceptions_dumpers import ExceptionsDumpers
+from .procevents import BoundedReplaySubject
+from .metrics import RulesMetrics
 
 
 configs_factory = providers.Singleton(lambda: {})
@@ -26,9 +29,14 @@ configs_factory = providers.Singleton(lambda: {})
 # for testing/development only
 subject_storage_factory = providers.Factory(lambda *args, **kwargs: EmptySubjectStorage())
 
-subject_factory = providers.Factory(Subject)
-proc_events_rx_factory = providers.Singleton(subject.ReplaySubject)
-# proc_events_rx_factory = subject.ReplaySubject()
+# the same instance for the same name inside a subject scope (see krules_core.subject.scope)
+subject_factory = providers.Factory(scoped_subject)
+subjects_cache_factory = providers.Singleton(SubjectsCache.from_env)
+subjects_write_behind_factory = providers.Singleton(WriteBehindQueue.from_env)
+# serialization of subject properties and events (see krules_core.codec)
+codec_factory = providers.Singleton(JsonCodec)
+proc_events_rx_factory = providers.Singleton(BoundedReplaySubject.from_env)
 event_router_factory = providers.Singleton(EventRouter)
 event_dispatcher_factory = providers.Singleton(BaseDispatcher)
 exceptions_dumpers_factory = providers.Singleton(ExceptionsDumpers)
+metrics_factory = providers.Singleton(RulesMetrics)
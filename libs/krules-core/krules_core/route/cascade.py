@@ -0,0 +1,96 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per request queue of the events generated while routing an event.
+
+Instead of being routed recursively, events produced by rules (property changes, Route, ...) are
+appended to the queue of the request being processed and routed one after the other when the
+current event is done.
+"""
+
+import contextvars
+from collections import deque, Counter
+from collections.abc import Mapping
+
+from krules_core.subject import PayloadConst
+
+# the request being routed in the current context
+current_request = contextvars.ContextVar("krules_route_request", default=None)
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+class CascadeLimitError(RuntimeError):
+    """
+    Raised when queueing an event exceeding the cascade depth limit or repeating too many times
+    (same subject, type, property and value)
+    """
+
+
+class RouteRequest(object):
+    """
+    Events queued while processing a request, with some counters:
+        events: number of routed events (the initial one included)
+        max_depth: deepest cascade level reached
+        event_types: routed events count by type
+    """
+
+    def __init__(self, max_depth, max_repeats):
+        self._queue = deque()
+        self._repeats = Counter()
+        self._max_depth = max_depth
+        self._max_repeats = max_repeats
+        self.depth = 0
+        self.events = 0
+        self.max_depth = 0
+        self.event_types = Counter()
+
+    def _count(self, event_type, subject, payload, depth):
+        property_name = value = None
+        if isinstance(payload, Mapping):
+            property_name = payload.get(PayloadConst.PROPERTY_NAME)
+            value = payload.get(PayloadConst.VALUE)
+        # a property reaching the same value again and again is cycling, a counter chain is not
+        key = (str(subject), event_type, property_name, _hashable(value))
+        self._repeats[key] += 1
+        if self._repeats[key] > self._max_repeats:
+            raise CascadeLimitError(
+                "loop detected: {} for {} (property: {}, value: {}) routed more than {} times".format(
+                    event_type, key[0], property_name, value, self._max_repeats))
+        self.events += 1
+        self.event_types[event_type] += 1
+        self.max_depth = max(self.max_depth, depth)
+
+    def start(self, event_type, subject, payload):
+        self._count(event_type, subject, payload, 0)
+
+    def enqueue(self, router, event_type, subject, payload, dispatch_policy):
+        depth = self.depth + 1
+        if depth > self._max_depth:
+            raise CascadeLimitError("cascade depth limit ({}) exceeded routing {} for {}".format(
+                self._max_depth, event_type, subject))
+        self._count(event_type, subject, payload, depth)
+        self._queue.append((depth, router, (event_type, subject, payload, dispatch_policy)))
+
+    def drain(self):
+        """
+        Yields queued (router, event) pairs (also those queued while draining) in FIFO order
+        """
+        while self._queue:
+            self.depth, router, event = self._queue.popleft()
+            yield router, event
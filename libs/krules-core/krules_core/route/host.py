@@ -0,0 +1,146 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Several rulesets hosted in the same process.
+
+Each ruleset gets its own router (namespace). While a ruleset is loaded or one of its rules is processed,
+its router is the current one, so that event_router_factory (overridden with HostRouter.get_router)
+returns it to the rules and subjects. The host router receives inbound events and hands them to every
+ruleset interested in them, LocalDispatcher delivers the events produced by a ruleset to the co-located
+ones before (or instead of) dispatching them outside.
+"""
+
+import contextvars
+
+from .dispatcher import BaseDispatcher
+from .router import EventRouter, DispatchPolicyConst
+
+# router of the ruleset being loaded or processed, None outside of hosted rulesets
+current_router = contextvars.ContextVar("krules_current_router", default=None)
+
+
+class NamespaceRouter(EventRouter):
+    """
+    Router of a hosted ruleset
+    """
+
+    def __init__(self, name, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+
+    def _route_one(self, event_type, subject, payload, dispatch_policy):
+        token = current_router.set(self)
+        try:
+            return super()._route_one(event_type, subject, payload, dispatch_policy)
+        finally:
+            current_router.reset(token)
+
+    async def _route_one_async(self, event_type, subject, payload, dispatch_policy):
+        token = current_router.set(self)
+        try:
+            return await super()._route_one_async(event_type, subject, payload, dispatch_policy)
+        finally:
+            current_router.reset(token)
+
+
+class HostRouter(EventRouter):
+    """
+    Router receiving the events for all the hosted rulesets.
+    Rules registered outside of any ruleset (eg: by the application env) are processed first
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._router_kwargs = kwargs
+        self.namespaces = {}
+
+    def get_router(self):
+        """
+        The current ruleset router or the host router itself
+        """
+        router = current_router.get()
+        if router is None:
+            return self
+        return router
+
+    def add_ruleset(self, name, rulesdata):
+        """
+        Load rules in a new namespace
+        """
+        from krules_core.utils import load_rules_from_rulesdata
+
+        router = self.namespaces[name] = NamespaceRouter(name, **self._router_kwargs)
+        token = current_router.set(router)
+        try:
+            load_rules_from_rulesdata(rulesdata)
+        finally:
+            current_router.reset(token)
+        return router
+
+    def has_handlers(self, event_type, property_name=None):
+        return super().has_handlers(event_type, property_name) or any(
+            router.has_handlers(event_type, property_name) for router in self.namespaces.values()
+        )
+
+    def _interested(self, event_type, exclude=None):
+        return [router for router in self.namespaces.values()
+                if router is not exclude and router.has_handlers(event_type)]
+
+    def _route_one(self, event_type, subject, payload, dispatch_policy):
+
+        subject = self._get_subject(subject, payload)
+        _callables = self._get_rules(event_type)
+        routers = self._interested(event_type)
+
+        if not dispatch_policy == DispatchPolicyConst.DIRECT:
+            if _callables is not None:
+                self._process_rules(_callables, event_type, subject, payload)
+            for router in routers:
+                router._route_one(event_type, subject, payload, DispatchPolicyConst.NEVER)
+
+        return self._dispatch(event_type, subject, payload, dispatch_policy,
+                              _callables or routers or None)
+
+    async def _route_one_async(self, event_type, subject, payload, dispatch_policy):
+
+        subject = self._get_subject(subject, payload)
+        _callables = self._get_rules(event_type)
+        routers = self._interested(event_type)
+
+        if not dispatch_policy == DispatchPolicyConst.DIRECT:
+            if _callables is not None:
+                await super()._route_one_async(event_type, subject, payload, DispatchPolicyConst.NEVER)
+            for router in routers:
+                await router._route_one_async(event_type, subject, payload, DispatchPolicyConst.NEVER)
+
+        return self._dispatch(event_type, subject, payload, dispatch_policy,
+                              _callables or routers or None)
+
+
+class LocalDispatcher(BaseDispatcher):
+    """
+    Delivers dispatched events to the co-located rulesets interested in them (except the one producing them).
+    Events are also handed to dispatcher when no co-located ruleset handled them or, if forward_delivered,
+    in any case (the co-located rulesets should then not receive them again from the broker)
+    """
+
+    def __init__(self, host, dispatcher=None, forward_delivered=False):
+        self._host = host
+        self._dispatcher = dispatcher
+        self._forward_delivered = forward_delivered
+
+    def dispatch(self, event_type, subject, payload, **extra):
+        routers = self._host._interested(event_type, exclude=current_router.get())
+        for router in routers:
+            router.route(event_type, subject, payload, dispatch_policy=DispatchPolicyConst.NEVER)
+        if self._dispatcher is not None and (self._forward_delivered or not routers):
+            return self._dispatcher.dispatch(event_type, subject, payload, **extra)
@@ -9,8 +9,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import contextvars
+import fnmatch
+import functools
 import logging
+import os
+import re
 import socket
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from krules_core import ProcEventsLevel, ConfigKeyConst
+from krules_core.subject import PayloadConst
+from .table import RoutingTable
+from .cascade import RouteRequest, current_request
+from krules_core.subject.scope import current_scope, subject_scope
 
 logger = logging.getLogger("__router__")
 
@@ -22,24 +37,136 @@ class DispatchPolicyConst:
     DIRECT = "direct"
 
 
+@functools.lru_cache(maxsize=32)
+def _published_matcher(patterns):
+    if not patterns:
+        return lambda property_name: None
+    return re.compile("|".join("(?:{})".format(fnmatch.translate(p)) for p in patterns)).match
+
+
+# set in fan-out worker threads, events routed from there are processed inline
+_fanout_worker = threading.local()
+
+
+def _process_in_worker(rule, event_type, subject, payload):
+    _fanout_worker.active = True
+    try:
+        rule._process(event_type, subject, payload)
+    finally:
+        _fanout_worker.active = False
+
+
+# rules subscribed to an event type along with the guards extracted from their leading static filters,
+# rebuilt when the subscriptions or the rules plans change.
+# by_property maps the property names rules are interested in to the rules to be evaluated for that
+# property (those without a property constraint included), it is None if there are no such rules
+_EventTypeIndex = namedtuple("_EventTypeIndex", ("source", "generation", "entries", "by_property", "unkeyed"))
+
+
+def _build_index(event_type, rules):
+    from krules_core.guards import NO_GUARDS
+
+    entries = []
+    for rule in rules:
+        plan = rule._plan
+        if plan is None:
+            plan = rule.compile()
+        guards = plan.guards
+        # rules publishing procevents must be invoked even if they do not pass their filters
+        if plan.procevents_levels.get(event_type, plan.procevents_level) != ProcEventsLevel.DISABLED:
+            guards = NO_GUARDS
+        entries.append((rule, guards.predicates, guards.property_names))
+
+    by_property = None
+    names = set()
+    for _, _, property_names in entries:
+        if property_names is not None:
+            names.update(property_names)
+    if len(names):
+        by_property = {
+            name: tuple((rule, predicates) for rule, predicates, property_names in entries
+                        if property_names is None or name in property_names)
+            for name in names
+        }
+    return _EventTypeIndex(
+        source=rules,
+        generation=rules[0]._plans_generation,
+        entries=tuple((rule, predicates) for rule, predicates, _ in entries),
+        by_property=by_property,
+        unkeyed=tuple((rule, predicates) for rule, predicates, property_names in entries if property_names is None),
+    )
+
+
+def _guarded(entries, subject, payload):
+    """
+    Yields the rules whose guards are satisfied, each one evaluated just before the rule is processed
+    """
+    for rule, predicates in entries:
+        if predicates:
+            try:
+                if not all(predicate(subject, payload) for predicate in predicates):
+                    continue
+            except Exception:
+                # let the rule deal with it
+                pass
+        yield rule
+
+
 class EventRouter(object):
 
-    def __init__(self):
+    def __init__(self, fanout_workers=None, queued_events=None, max_cascade_depth=None, max_event_repeats=None):
+        """
+        When fanout_workers (default from RULES_FANOUT_WORKERS environment variable) is greater than zero,
+        rules created as independent are processed concurrently on a thread pool of that size.
+        With queued_events (default from ROUTER_QUEUED_EVENTS environment variable) events routed while
+        processing another one are queued and routed afterwards instead of recursively (see route/cascade.py).
+        Queued events deeper than max_cascade_depth (ROUTER_MAX_CASCADE_DEPTH, default 64) or routed more than
+        max_event_repeats times for the same subject, type and property (ROUTER_MAX_EVENT_REPEATS, default 100)
+        raise CascadeLimitError
+        """
+        # subscriptions, the routing table is built from them when needed
         self._callables = {}
+        self._table = None
+        self._lock = threading.Lock()
+        self._index = {}
+        if fanout_workers is None:
+            fanout_workers = int(os.environ.get("RULES_FANOUT_WORKERS", 0))
+        self._executor = None
+        if fanout_workers > 0:
+            self._executor = ThreadPoolExecutor(max_workers=fanout_workers, thread_name_prefix="krules-fanout")
+        if queued_events is None:
+            queued_events = os.environ.get("ROUTER_QUEUED_EVENTS", "0").lower() in ("1", "true", "yes")
+        self._queued_events = queued_events
+        if max_cascade_depth is None:
+            max_cascade_depth = int(os.environ.get("ROUTER_MAX_CASCADE_DEPTH", 64))
+        self._max_cascade_depth = max_cascade_depth
+        if max_event_repeats is None:
+            max_event_repeats = int(os.environ.get("ROUTER_MAX_EVENT_REPEATS", 100))
+        self._max_event_repeats = max_event_repeats
+
+    @property
+    def max_cascade_depth(self):
+        return self._max_cascade_depth
 
     def register(self, rule, event_type):
         logger.debug("register {0} for {1}".format(rule, event_type))
-        if event_type not in self._callables:
-            self._callables[event_type] = []
-        self._callables[event_type].append(rule._process)
+        with self._lock:
+            if event_type not in self._callables:
+                self._callables[event_type] = []
+            self._callables[event_type].append(rule)
+            self._table = None
+            self._index.clear()
 
     def unregister(self, event_type):
         logger.debug("unregister event {}".format(event_type))
         count = 0
-        if event_type in self._callables:
-            for r in self._callables[event_type]:
-                count += 1
-            del self._callables[event_type]
+        with self._lock:
+            if event_type in self._callables:
+                for r in self._callables[event_type]:
+                    count += 1
+                del self._callables[event_type]
+            self._table = None
+            self._index.clear()
         return count
 
     def unregister_all(self):
@@ -49,34 +176,237 @@ class EventRouter(object):
             count += self.unregister(event_type)
         return count
 
-    def route(self, event_type, subject, payload, dispatch_policy=DispatchPolicyConst.DEFAULT):
+    def _get_rules(self, event_type):
+
+        table = self._table
+        if table is None:
+            with self._lock:
+                table = self._table = RoutingTable(self._callables)
+        return table.lookup(event_type)
+
+    def _get_property_entries(self, event_type, rules, property_name):
+        """
+        Rules to be evaluated for the event, with their guards
+        """
+        index = self._index.get(event_type)
+        if index is None or index.source is not rules or index.generation != rules[0]._plans_generation:
+            index = self._index[event_type] = _build_index(event_type, rules)
+        if index.by_property is None or not isinstance(property_name, str):
+            return index.entries
+        return index.by_property.get(property_name, index.unkeyed)
+
+    def _get_entries(self, event_type, rules, payload):
+        try:
+            property_name = payload.get(PayloadConst.PROPERTY_NAME)
+        except AttributeError:
+            property_name = None
+        return self._get_property_entries(event_type, rules, property_name)
+
+    def has_handlers(self, event_type, property_name=None):
+        """
+        Whether some local rule may be interested in the event type
+        (and in the given property, for subject property events)
+        """
+        rules = self._get_rules(event_type)
+        if rules is None:
+            return False
+        if property_name is None:
+            return True
+        return len(self._get_property_entries(event_type, rules, property_name)) > 0
+
+    @staticmethod
+    def is_published(property_name):
+        """
+        Whether changes of the given property are dispatched when there are no local handlers.
+        Set by the PUBLISHED_SUBJECT_PROPERTIES setting (a list of glob patterns),
+        when missing all properties are published
+        """
+        from krules_core.providers import configs_factory
+
+        patterns = configs_factory().get(ConfigKeyConst.PUBLISHED_SUBJECT_PROPERTIES)
+        if patterns is None:
+            return True
+        return _published_matcher(tuple(patterns))(property_name) is not None
+
+    def property_dispatch_policy(self, event_type, property_name):
+        """
+        Dispatch policy of a subject property event, None when it can be dropped (no local rule is
+        interested in it and the property is not published).
+        Properties explicitly published (see is_published) are dispatched even when handled locally
+        """
+        from krules_core.providers import configs_factory
+
+        if configs_factory().get(ConfigKeyConst.PUBLISHED_SUBJECT_PROPERTIES) is None:
+            return DispatchPolicyConst.DEFAULT
+        if self.is_published(property_name):
+            return DispatchPolicyConst.ALWAYS
+        if self.has_handlers(event_type, property_name):
+            return DispatchPolicyConst.DEFAULT
+        return None
+
+    @staticmethod
+    def _get_subject(subject, payload):
 
         if isinstance(subject, str):
             # NOTE: this should have already happened if we want to take care or event info
             from krules_core.providers import subject_factory
             subject = subject_factory(subject, event_data=payload)
+        else:
+            scope = current_scope.get()
+            if scope is not None:
+                scope.add(subject)
+        return subject
+
+    @staticmethod
+    def _dispatch(event_type, subject, payload, dispatch_policy, _callables):
 
         from ..providers import event_dispatcher_factory
 
-        _callables = self._callables.get(event_type, None)
+        # TODO: unit test (policies)
+        if dispatch_policy != DispatchPolicyConst.NEVER and _callables is None \
+                and dispatch_policy == DispatchPolicyConst.DEFAULT \
+                or dispatch_policy == DispatchPolicyConst.ALWAYS \
+                or dispatch_policy == DispatchPolicyConst.DIRECT:
+            logger.debug("dispatch {} to {} with payload {}".format(event_type, subject, payload))
+            return event_dispatcher_factory().dispatch(event_type, subject, payload)
+
+    def _process_rules(self, rules, event_type, subject, payload):
 
-        if _callables is None:
-            _callables = self._callables.get("*", None)
-        else:
-            _callables.extend(self._callables.get("*", []))
+        entries = self._get_entries(event_type, rules, payload)
+
+        if self._executor is None or getattr(_fanout_worker, "active", False):
+            for rule in _guarded(entries, subject, payload):
+                rule._process(event_type, subject, payload)
+            return
+
+        # independent rules run on the pool (each in a copy of the current context),
+        # the others keep their order in the calling thread. All of them complete before returning
+        futures = [
+            self._executor.submit(contextvars.copy_context().run,
+                                  _process_in_worker, rule, event_type, subject, payload)
+            for rule in _guarded([e for e in entries if e[0].independent], subject, payload)
+        ]
+        try:
+            for rule in _guarded([e for e in entries if not e[0].independent], subject, payload):
+                rule._process(event_type, subject, payload)
+        finally:
+            wait(futures)
+        for future in futures:
+            future.result()
+
+    @staticmethod
+    def current_request():
+        """
+        The request being routed (with its counters) when events are queued
+        """
+        return current_request.get()
+
+    def route(self, event_type, subject, payload, dispatch_policy=DispatchPolicyConst.DEFAULT):
+
+        # subjects obtained while routing the event (and its cascade) share the same subject scope
+        with subject_scope():
+            if not self._queued_events:
+                return self._route_one(event_type, subject, payload, dispatch_policy)
+
+            request = current_request.get()
+            if request is not None:
+                request.enqueue(self, event_type, subject, payload, dispatch_policy)
+                return None
+
+            request = RouteRequest(self._max_cascade_depth, self._max_event_repeats)
+            request.start(event_type, subject, payload)
+            token = current_request.set(request)
+            try:
+                result = self._route_one(event_type, subject, payload, dispatch_policy)
+                for router, event in request.drain():
+                    router._route_one(*event)
+            finally:
+                current_request.reset(token)
+        logger.debug("routed {} events (max depth {}) from {}".format(request.events, request.max_depth, event_type))
+        return result
+
+    def _route_one(self, event_type, subject, payload, dispatch_policy):
+
+        subject = self._get_subject(subject, payload)
+        _callables = self._get_rules(event_type)
 
         #        try:
         if not dispatch_policy == DispatchPolicyConst.DIRECT:
             if _callables is not None:
-                for _callable in _callables:
-                    _callable(event_type, subject, payload)
+                self._process_rules(_callables, event_type, subject, payload)
         #        finally:
         #            subject.store()
 
-        # TODO: unit test (policies)
-        if dispatch_policy != DispatchPolicyConst.NEVER and _callables is None \
-                and dispatch_policy == DispatchPolicyConst.DEFAULT \
-                or dispatch_policy == DispatchPolicyConst.ALWAYS \
-                or dispatch_policy == DispatchPolicyConst.DIRECT:
-            logger.debug("dispatch {} to {} with payload {}".format(event_type, subject, payload))
-            return event_dispatcher_factory().dispatch(event_type, subject, payload)
+        return self._dispatch(event_type, subject, payload, dispatch_policy, _callables)
+
+    def route_many(self, events, dispatch_policy=DispatchPolicyConst.DEFAULT):
+        """
+        Route a batch of (event_type, subject, payload) events, in order.
+        Events for the same subject name share the same subject instance, so that it is loaded once,
+        and each subject is stored once at the end of the batch.
+        Returns the list of route results
+        """
+
+        subjects = {}
+        results = []
+        with subject_scope():
+            for event_type, subject, payload in events:
+                name = str(subject)
+                if name not in subjects:
+                    subjects[name] = self._get_subject(subject, payload)
+                results.append(self.route(event_type, subjects[name], payload, dispatch_policy=dispatch_policy))
+
+        for subject in subjects.values():
+            subject.store()
+
+        return results
+
+    async def route_async(self, event_type, subject, payload, dispatch_policy=DispatchPolicyConst.DEFAULT):
+        """
+        Same as route, but rules are awaited so that their coroutine functions do not block the event loop.
+        Rules for the same event are processed one after the other, except for those created as independent
+        that run concurrently with the others. Dispatching remains synchronous
+        """
+
+        with subject_scope():
+            if not self._queued_events:
+                return await self._route_one_async(event_type, subject, payload, dispatch_policy)
+
+            request = current_request.get()
+            if request is not None:
+                request.enqueue(self, event_type, subject, payload, dispatch_policy)
+                return None
+
+            request = RouteRequest(self._max_cascade_depth, self._max_event_repeats)
+            request.start(event_type, subject, payload)
+            token = current_request.set(request)
+            try:
+                result = await self._route_one_async(event_type, subject, payload, dispatch_policy)
+                for router, event in request.drain():
+                    await router._route_one_async(*event)
+            finally:
+                current_request.reset(token)
+        return result
+
+    async def _route_one_async(self, event_type, subject, payload, dispatch_policy):
+
+        subject = self._get_subject(subject, payload)
+        _callables = self._get_rules(event_type)
+
+        if not dispatch_policy == DispatchPolicyConst.DIRECT:
+            if _callables is not None:
+                entries = self._get_entries(event_type, _callables, payload)
+
+                async def _in_order():
+                    for rule in _guarded([e for e in entries if not e[0].independent], subject, payload):
+                        await rule._process_async(event_type, subject, payload)
+
+                independent = list(_guarded([e for e in entries if e[0].independent], subject, payload))
+                if independent:
+                    await asyncio.gather(_in_order(), *[
+                        rule._process_async(event_type, subject, payload) for rule in independent
+                    ])
+                else:
+                    await _in_order()
+
+        return self._dispatch(event_type, subject, payload, dispatch_policy, _callables)
@@ -0,0 +1,94 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fnmatch
+import re
+
+# resolved event types kept by a routing table before starting over
+MAX_RESOLVED = 4096
+
+_GLOB_CHARS = re.compile(r"[*?\[]")
+
+
+def is_glob(event_type):
+    return _GLOB_CHARS.search(event_type) is not None
+
+
+class RoutingTable(object):
+    """
+    Immutable snapshot of the router subscriptions.
+
+    Subscriptions can be plain event types or glob patterns (fnmatch syntax, "*" matches everything).
+    Patterns ending with their only "*" (such as "mutate-*") are kept in a prefix trie, the others
+    are matched one by one. An event type resolves to the rules subscribed to it followed by those
+    subscribed to matching patterns, the more specific first (longer literal prefix, then more literal
+    characters, so that "*" comes last); rules of the same pattern keep their registration order.
+    Resolved event types are memoized.
+    """
+
+    def __init__(self, subscriptions):
+        self._exact = {}
+        self._trie = {}
+        self._patterns = []
+        self._resolved = {}
+
+        for order, (event_type, rules) in enumerate(subscriptions.items()):
+            rules = tuple(rules)
+            if not rules:
+                continue
+            if not is_glob(event_type):
+                self._exact[event_type] = rules
+                continue
+            prefix = _GLOB_CHARS.split(event_type, 1)[0]
+            entry = ((-len(prefix), -len(_GLOB_CHARS.sub("", event_type)), order), rules)
+            if event_type == prefix + "*":
+                node = self._trie
+                for ch in prefix:
+                    node = node.setdefault(ch, {})
+                node[None] = entry
+            else:
+                self._patterns.append((re.compile(fnmatch.translate(event_type)), entry))
+
+    def _resolve(self, event_type):
+        matched = []
+        node = self._trie
+        if None in node:
+            matched.append(node[None])
+        for ch in event_type:
+            node = node.get(ch)
+            if node is None:
+                break
+            if None in node:
+                matched.append(node[None])
+        for regex, entry in self._patterns:
+            if regex.match(event_type):
+                matched.append(entry)
+
+        rules = self._exact.get(event_type, ())
+        if matched:
+            matched.sort(key=lambda entry: entry[0])
+            for _, pattern_rules in matched:
+                rules += pattern_rules
+        return rules or None
+
+    def lookup(self, event_type):
+        """
+        Rules subscribed to event_type (a tuple) or None
+        """
+        try:
+            return self._resolved[event_type]
+        except KeyError:
+            pass
+        rules = self._resolve(event_type)
+        if len(self._resolved) >= MAX_RESOLVED:
+            self._resolved.clear()
+        self._resolved[event_type] = rules
+        return rules
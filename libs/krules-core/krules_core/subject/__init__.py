@@ -9,7 +9,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import inspect
-import json
+
+from krules_core.codec import encode, json_codec
+
 
 class PayloadConst(object):
 
@@ -26,19 +28,29 @@ class PropertyType(object):
 
 class _JsonProperty(object):
 
+    __slots__ = ("name", "value", "_computed")
+
     def __init__(self, name, value=None):
         self.name = name
         self.value = value
 
-    def json_value(self, *args, **kwargs):
-
+    def _compute(self, *args, **kwargs):
         if inspect.isfunction(self.value):
             if len(inspect.signature(self.value).parameters) == 0:
                 self._computed = self.value()
             else:
                 self._computed = self.value(*args, **kwargs)
-            return json.dumps(self._computed)
-        return json.dumps(self.value)
+            return self._computed
+        return self.value
+
+    def json_value(self, *args, **kwargs):
+        return json_codec().dumps(self._compute(*args, **kwargs))
+
+    def encoded_value(self, *args, **kwargs):
+        """
+        Same as json_value, with the codec in use (see krules_core.codec)
+        """
+        return encode(self._compute(*args, **kwargs))
 
     def get_value(self, *args, **kwargs):
         if hasattr(self, '_computed'):
@@ -53,13 +65,32 @@ class _JsonProperty(object):
 
 class SubjectProperty(_JsonProperty):
 
-    def __init__(self, name, value=None):
-        super().__init__(name, value)
-        self.type = PropertyType.DEFAULT
+    __slots__ = ()
+    type = PropertyType.DEFAULT
 
 
 class SubjectExtProperty(_JsonProperty):
 
-    def __init__(self, name, value=None):
-        super().__init__(name, value)
-        self.type = PropertyType.EXTENDED
+    __slots__ = ()
+    type = PropertyType.EXTENDED
+
+
+class Increment(object):
+    """
+    Value adding amount to the current one (a missing property counts as 0).
+    It can be set like a function receiving the current value, but storages supporting it (incr method)
+    apply it natively, without reading the current value and retrying on conflicts
+
+        subject.set("checkup_cnt", Increment(1), use_cache=False)
+    """
+
+    __slots__ = ("amount",)
+
+    def __init__(self, amount=1):
+        self.amount = amount
+
+    def __call__(self, value):
+        return (value or 0) + self.amount
+
+    def __repr__(self):
+        return "Increment({!r})".format(self.amount)
@@ -0,0 +1,118 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Process wide read-through cache of subject snapshots.
+
+Subjects normally load their properties from the storage each time they are used by a new event.
+With the cache enabled (SUBJECTS_CACHE_SIZE environment variable, 0 means disabled) the properties
+loaded are kept in a LRU cache and reused by the following subjects with the same name, provided that
+the storage supports versioning: get_version() returns a value changing on every write to the subject
+(from any process), which is much cheaper to read than the whole subject. A snapshot is reused as is
+for SUBJECTS_CACHE_TRUST seconds (default 0, the version is always checked), and anyway discarded
+after SUBJECTS_CACHE_TTL seconds (default: no limit). Subjects discard their own snapshot when writing.
+"""
+
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def _float_env(name):
+    value = os.environ.get(name)
+    return value and float(value) or None
+
+
+class SubjectsCache(object):
+
+    def __init__(self, max_size=0, ttl=None, trust=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.trust = trust
+        self._clock = clock
+        self._lock = threading.Lock()
+        # name -> [version, loaded at, checked at, props, ext_props]
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_size=int(os.environ.get("SUBJECTS_CACHE_SIZE", 0)),
+            ttl=_float_env("SUBJECTS_CACHE_TTL"),
+            trust=_float_env("SUBJECTS_CACHE_TRUST"),
+        )
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def supports(self, storage):
+        return self.enabled and hasattr(storage, "get_version")
+
+    def _lookup(self, name, storage, now):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            self._entries.move_to_end(name)
+        version, loaded_at, checked_at = entry[:3]
+        if self.ttl is not None and now - loaded_at > self.ttl:
+            return None
+        if self.trust is not None and now - checked_at <= self.trust:
+            return entry
+        if storage.get_version() != version:
+            return None
+        entry[2] = now
+        return entry
+
+    def load(self, name, storage):
+        """
+        Properties and extended properties of the subject, as storage.load() returns them
+        """
+        return self.load_versioned(name, storage)[:2]
+
+    def load_versioned(self, name, storage):
+        """
+        Same as load, along with the version read before the properties (they may be newer, not older)
+        """
+        now = self._clock()
+        entry = self._lookup(name, storage, now)
+        if entry is not None:
+            self.hits += 1
+            return copy.deepcopy((entry[3], entry[4])) + (entry[0],)
+
+        self.misses += 1
+        # read before loading: a concurrent write leaves a stale version, not a stale snapshot
+        version = storage.get_version()
+        props, ext_props = storage.load()
+        entry = [version, now, now] + copy.deepcopy([props, ext_props])
+        with self._lock:
+            self._entries[name] = entry
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return props, ext_props, version
+
+    def discard(self, name):
+        with self._lock:
+            self._entries.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        self.hits = self.misses = 0
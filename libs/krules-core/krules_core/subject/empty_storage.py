@@ -11,6 +11,15 @@ class EmptySubjectStorage:
     def load(self):
         return {}, {}
 
+    def batch_key(self):
+        return ()
+
+    def load_many(self, names):
+        return {str(name): ({}, {}) for name in names}
+
+    def load_props(self, props):
+        return {}, {}
+
     def store(self, inserts=[], updates=[], deletes=[]):
         pass
 
@@ -0,0 +1,126 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Identity map of the subjects used while processing an event or a request.
+
+Inside a subject scope, subject_factory returns the same Subject instance (and so the same cache)
+for the same name, so that the subject is loaded from the storage once. The router opens a scope
+for each event it receives (if none is active yet), the flask env for each request.
+Arguments explicitly given that change the storage or cache behaviour must not conflict with the ones
+the scoped instance was built with, otherwise (eg: a different use_cache_default) the caller gets a new
+instance, not shared. event_info and event_data are per call metadata and are not compared, None values
+stand for the default and match any instance. Of the subjects registered as instances (eg: by the
+router) only the cache and deferred events settings are known.
+"""
+
+import contextvars
+import inspect
+import threading
+from contextlib import contextmanager
+
+from .storaged_subject import Subject
+
+# the scope of the event or request being processed, None outside of any scope
+current_scope = contextvars.ContextVar("krules_subject_scope", default=None)
+
+_SIGNATURE = inspect.signature(Subject.__init__)
+_NOT_COMPARED = ("self", "name", "event_info", "event_data")
+
+
+class SubjectScope(object):
+    """
+    Subjects by name, in order of creation
+    """
+
+    def __init__(self):
+        self._subjects = {}
+        # name -> arguments the subject was built with (defaults included), None when unknown
+        self._arguments = {}
+        # rules fanned out to worker threads share the scope
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._subjects.values()))
+
+    def __len__(self):
+        return len(self._subjects)
+
+    def get(self, name):
+        return self._subjects.get(str(name))
+
+    def add(self, subject, arguments=None):
+        """
+        Registers subject unless another instance with the same name already is.
+        Returns the registered instance
+        """
+        name = str(subject.name)
+        with self._lock:
+            if name not in self._subjects:
+                self._subjects[name] = subject
+                self._arguments[name] = arguments
+            return self._subjects[name]
+
+    def arguments(self, name):
+        return self._arguments.get(str(name))
+
+    def store(self):
+        for subject in self:
+            subject.store()
+
+
+@contextmanager
+def subject_scope():
+    """
+    Enters a new scope, or the current one when already in a scope
+    """
+    scope = current_scope.get()
+    if scope is not None:
+        yield scope
+        return
+    scope = SubjectScope()
+    token = current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        current_scope.reset(token)
+
+
+def _explicit_arguments(name, args, kwargs):
+    bound = _SIGNATURE.bind(None, name, *args, **kwargs)
+    explicit = {k: v for k, v in bound.arguments.items() if k not in _NOT_COMPARED}
+    bound.apply_defaults()
+    return explicit, {k: v for k, v in bound.arguments.items() if k not in _NOT_COMPARED}
+
+
+def _conflicts(scope, subject, explicit):
+    built_with = scope.arguments(subject.name)
+    if built_with is None:
+        built_with = {"use_cache_default": subject._use_cache, "deferred_events": subject._deferred_events}
+    return any(k in built_with and built_with[k] != v for k, v in explicit.items() if v is not None)
+
+
+def scoped_subject(name, *args, **kwargs):
+    """
+    Subject constructor honouring the current scope
+    """
+    scope = current_scope.get()
+    if scope is None:
+        return Subject(name, *args, **kwargs)
+    explicit, arguments = _explicit_arguments(name, args, kwargs)
+    subject = scope.get(name)
+    if subject is None:
+        return scope.add(Subject(name, *args, **kwargs), arguments)
+    if _conflicts(scope, subject, explicit):
+        # not the subject the caller asked for
+        return Subject(name, *args, **kwargs)
+    return subject
@@ -1,8 +1,67 @@
 import inspect
+import os
+import threading
 
-import wrapt
+from krules_core.subject import SubjectProperty, SubjectExtProperty, PayloadConst, PropertyType, Increment
+from krules_core.subject.write_behind import StoreDurability
 
-from krules_core.subject import SubjectProperty, SubjectExtProperty, PayloadConst, PropertyType
+
+# states of the cached properties not stored yet
+_CREATED, _UPDATED, _DELETED = "created", "updated", "deleted"
+
+
+class _PropertiesCache(object):
+    """
+    Cached properties of a subject, by property type, with the state of the changes not stored yet
+    ((property type, name) -> _CREATED, _UPDATED or _DELETED, None while unchanged)
+    """
+
+    __slots__ = ("props", "ext_props", "dirty")
+
+    def __init__(self, props, ext_props):
+        self.props = props
+        self.ext_props = ext_props
+        self.dirty = None
+
+    def values(self, k):
+        return self.ext_props if k == PropertyType.EXTENDED else self.props
+
+    def state(self, k, prop):
+        return self.dirty is not None and self.dirty.get((k, prop)) or None
+
+    def mark(self, k, prop, state):
+        if self.dirty is None:
+            self.dirty = {}
+        self.dirty[(k, prop)] = state
+
+    def clean(self, k, prop):
+        if self.dirty is not None:
+            self.dirty.pop((k, prop), None)
+
+
+class SubjectConflictError(RuntimeError):
+    """
+    A versioned subject could not be stored because of concurrent writes
+    """
+
+
+def _max_store_rounds():
+    from krules_core.providers import event_router_factory
+
+    max_rounds = getattr(event_router_factory(), "max_cascade_depth", None)
+    if max_rounds is None:
+        max_rounds = int(os.environ.get("ROUTER_MAX_CASCADE_DEPTH", 64))
+    return max_rounds
+
+
+def _route_property_event(router, event_type, subject, prop, make_payload):
+    # dropped, without building its payload, when no local rule is interested in it and the property is not
+    # published, dispatched even if handled locally when explicitly published (see EventRouter.property_dispatch_policy)
+    if not hasattr(router, "property_dispatch_policy"):
+        return router.route(event_type, subject, make_payload())
+    dispatch_policy = router.property_dispatch_policy(event_type, prop)
+    if dispatch_policy is not None:
+        router.route(event_type, subject, make_payload(), dispatch_policy=dispatch_policy)
 
 
 class Subject(object):
@@ -12,91 +71,212 @@ class Subject(object):
     Needs a storage strategy implementation
     """
 
-    def __init__(self, name, event_info={}, event_data=None, use_cache_default=True):
-        from krules_core.providers import subject_storage_factory
+    # batch jobs may keep a lot of subjects around
+    __slots__ = ("name", "_use_cache", "_storage", "_snapshots", "_event_info", "_cached", "_partial", "_complete",
+                 "_fetched", "_lock", "_deferred_events", "_pending_events", "_writes", "_version", "_ops")
+
+    def __init__(self, name, event_info={}, event_data=None, use_cache_default=True, deferred_events=None,
+                 partial_load=None, versioned=None):
+        """
+        With deferred_events (default from SUBJECT_DEFERRED_EVENTS environment variable) property
+        changes and deletions are collected and a single net event per property is routed by store().
+        Rules changing the subject again are followed by further rounds, more than the max cascade depth
+        of the router (see EventRouter) raise CascadeLimitError
+
+        With partial_load (default from SUBJECT_PARTIAL_LOAD environment variable) the cache is filled
+        one property at a time, as they are accessed or prefetched, instead of loading the whole subject
+        (only iterating the subject or counting its properties still does). It requires a storage
+        implementing load_props and is ignored when the subject snapshots cache is in use
+
+        Unless the store durability is "sync" store() hands the changes to the write-behind queue
+        (see krules_core.subject.write_behind)
+
+        With versioned (default from SUBJECT_VERSIONED_STORE environment variable) the version of the subject
+        is read along with its properties and store() only writes if it did not change meanwhile. Otherwise
+        the subject is loaded again and the changes made through the cache (including functions of the old
+        value and increments) are applied again, up to SUBJECT_STORE_RETRIES times (default 10), then
+        SubjectConflictError is raised. Events already routed are not affected. It requires a storage
+        implementing get_version and store_versioned, versioned subjects are never stored behind
+        """
+        from krules_core.providers import subject_storage_factory, subjects_cache_factory, \
+            subjects_write_behind_factory
 
         self.name = name
         self._use_cache = use_cache_default
         self._storage = subject_storage_factory(name, event_info=event_info, event_data=event_data)
+        # process wide snapshots, only for versioned storages (see krules_core.subject.cache)
+        self._snapshots = subjects_cache_factory()
+        if not self._snapshots.supports(self._storage):
+            self._snapshots = None
         self._event_info = event_info
         self._cached = None
+        if partial_load is None:
+            partial_load = os.environ.get("SUBJECT_PARTIAL_LOAD", "0").lower() in ("1", "true", "yes")
+        self._partial = partial_load and self._snapshots is None and hasattr(self._storage, "load_props")
+        # whether the cache holds all the properties, otherwise the ones already read from the storage
+        self._complete = False
+        self._fetched = None
+        # rules processed concurrently (see EventRouter fan-out) may change the same subject
+        self._lock = threading.RLock()
+        if deferred_events is None:
+            deferred_events = os.environ.get("SUBJECT_DEFERRED_EVENTS", "0").lower() in ("1", "true", "yes")
+        self._deferred_events = deferred_events
+        # property name -> [first old value, last value, deleted]
+        self._pending_events = {}
+        self._writes = subjects_write_behind_factory()
+        if not self._writes.enabled:
+            self._writes = None
+        if versioned is None:
+            versioned = os.environ.get("SUBJECT_VERSIONED_STORE", "0").lower() in ("1", "true", "yes")
+        self._version = None
+        # changes made through the cache, as (property type, name, deleted, value), when versioned
+        self._ops = None
+        if versioned and hasattr(self._storage, "store_versioned") and hasattr(self._storage, "get_version"):
+            self._ops = []
 
     def __str__(self):
 
         return self.name
 
+    def _wait_writes(self):
+        # reads and direct writes must follow the changes still queued
+        if self._writes is not None:
+            self._writes.wait(str(self.name))
+
     def _load(self):
 
-        props, ext_props = self._storage.load()
-        #if self._cached is None:
-        self._cached = \
-            {
-                PropertyType.DEFAULT: {
-                    "values": {},
-                    "created": set(),
-                    "updated": set(),
-                    "deleted": set(),
-                },
-                PropertyType.EXTENDED: {
-                    "values": {},
-                    "created": set(),
-                    "updated": set(),
-                    "deleted": set(),
-                }
-            }
-        self._cached[PropertyType.DEFAULT]["values"] = props
-        self._cached[PropertyType.EXTENDED]["values"] = ext_props
+        self._wait_writes()
+        if self._snapshots is not None:
+            props, ext_props, version = self._snapshots.load_versioned(str(self.name), self._storage)
+        else:
+            # read before loading: a concurrent write leaves a stale version, not stale properties
+            version = self._storage.get_version() if self._ops is not None else None
+            props, ext_props = self._storage.load()
+        if self._cached is None and self._ops is not None:
+            self._version = version
+        if self._cached is not None and not self._complete:
+            # partially loaded, local changes win over the stored values
+            for (k, prop), state in (self._cached.dirty or {}).items():
+                values = ext_props if k == PropertyType.EXTENDED else props
+                if state == _DELETED:
+                    values.pop(prop, None)
+                else:
+                    values[prop] = self._cached.values(k)[prop]
+            self._cached.props, self._cached.ext_props = props, ext_props
+        else:
+            self._cached = _PropertiesCache(props, ext_props)
+        self._complete = True
+
+    def _needs_load(self):
+        # versioned subjects read their version along with the properties
+        return self._use_cache and self._cached is None and self._snapshots is None and self._ops is None
+
+    def _preload(self, props, ext_props):
+        """
+        Fills the cache with properties loaded along with other subjects (see SubjectSet)
+        """
+        with self._lock:
+            if self._cached is None:
+                self._cached = _PropertiesCache(props, ext_props)
+                self._complete = True
+
+    def _fetch(self, props):
+        """
+        Makes sure that the cache holds the given (property type, name) pairs, when they exist
+        """
+        if self._cached is None:
+            if not self._partial:
+                return self._load()
+            if self._ops is not None:
+                self._wait_writes()
+                self._version = self._storage.get_version()
+            self._cached = _PropertiesCache({}, {})
+            self._fetched = set()
+        if self._complete:
+            return
+        missing = [(k, prop) for k, prop in props if (k, prop) not in self._fetched]
+        if not missing:
+            return
+        self._wait_writes()
+        found = dict(zip((PropertyType.DEFAULT, PropertyType.EXTENDED), self._storage.load_props(
+            [(k == PropertyType.EXTENDED and SubjectExtProperty or SubjectProperty)(prop) for k, prop in missing]
+        )))
+        for k, prop in missing:
+            # properties changed without cache since the cache was created are already there
+            values = self._cached.values(k)
+            if prop in found[k] and prop not in values:
+                values[prop] = found[k][prop]
+            self._fetched.add((k, prop))
+
+    def prefetch(self, props=(), ext_props=()):
+        """
+        With partial loading, reads the given properties (if not already cached) in a single storage access
+        """
+        if not self._use_cache:
+            return
+        with self._lock:
+            self._fetch([(PropertyType.DEFAULT, prop) for prop in props] +
+                        [(PropertyType.EXTENDED, prop) for prop in ext_props])
 
     def _set(self, prop, value, extended, muted, use_cache):
         if isinstance(value, tuple):
             value = list(value)
 
-        if use_cache is None:
-            use_cache = self._use_cache
-        if use_cache:
-            if self._cached is None:
-                self._load()
-            kprops = extended and PropertyType.EXTENDED or PropertyType.DEFAULT
-            vals = extended and self._cached[kprops]["values"] or self._cached[kprops]["values"]
-            if prop in vals:
-                self._cached[kprops]["updated"].add(prop)
+        with self._lock:
+            if use_cache is None:
+                use_cache = self._use_cache
+            if use_cache:
+                kprops = extended and PropertyType.EXTENDED or PropertyType.DEFAULT
+                if self._ops is not None:
+                    self._ops.append((kprops, prop, False, value))
+                value, old_value = self._set_cached(kprops, prop, value)
             else:
-                self._cached[kprops]["created"].add(prop)
-            try:
-                old_value = vals[prop]
-            except KeyError:
-                old_value = None
-            if inspect.isfunction(value):
-                n_params = len(inspect.signature(value).parameters)
-                if n_params == 0:
-                    value = value()
-                elif n_params == 1:
-                    value = value(old_value)
+                klass, k = extended and (SubjectExtProperty, PropertyType.EXTENDED) or (SubjectProperty, PropertyType.DEFAULT)
+                self._wait_writes()
+                if isinstance(value, Increment):
+                    if hasattr(self._storage, "incr"):
+                        value, old_value = self._storage.incr(klass(prop), value.amount)
+                    else:
+                        value, old_value = self._storage.set(klass(prop, lambda v, _increment=value: _increment(v)))
                 else:
-                    raise ValueError("to many arguments for {}".format(prop))
-
-            vals[prop] = value
-        else:
-            klass, k = extended and (SubjectExtProperty, PropertyType.EXTENDED) or (SubjectProperty, PropertyType.DEFAULT)
-            value, old_value = self._storage.set(klass(prop, value))
-            # update cached
-            if self._cached:
-                self._cached[k]["values"][prop] = value
-                if prop in self._cached[k]["created"]:
-                    self._cached[k]["created"].remove(prop)
-                if prop in self._cached[k]["updated"]:
-                    self._cached[k]["updated"].remove(prop)
-                if prop in self._cached[k]["deleted"]:
-                    self._cached[k]["deleted"].remove(prop)
+                    value, old_value = self._storage.set(klass(prop, value))
+                self._discard_snapshot()
+                # update cached
+                if self._cached is not None:
+                    self._cached.values(k)[prop] = value
+                    self._cached.clean(k, prop)
 
         if not muted and value != old_value:
-            payload = {PayloadConst.PROPERTY_NAME: prop, PayloadConst.OLD_VALUE: old_value,
-                       PayloadConst.VALUE: value}
+            if self._deferred_events:
+                self._defer_event(prop, old_value, value, False)
+            else:
+                self._route_changed(prop, old_value, value)
 
-            from krules_core.providers import event_router_factory
-            from krules_core import event_types
-            event_router_factory().route(event_types.SUBJECT_PROPERTY_CHANGED, self, payload)
+        return value, old_value
 
+    def _set_cached(self, k, prop, value):
+        self._fetch(((k, prop),))
+        vals = self._cached.values(k)
+        state = self._cached.state(k, prop)
+        if state != _CREATED:
+            # a deleted property is still stored until the subject is
+            self._cached.mark(k, prop, _UPDATED if prop in vals or state == _DELETED else _CREATED)
+        try:
+            old_value = vals[prop]
+        except KeyError:
+            old_value = None
+        if inspect.isfunction(value):
+            n_params = len(inspect.signature(value).parameters)
+            if n_params == 0:
+                value = value()
+            elif n_params == 1:
+                value = value(old_value)
+            else:
+                raise ValueError("to many arguments for {}".format(prop))
+        elif isinstance(value, Increment):
+            value = value(old_value)
+
+        vals[prop] = value
         return value, old_value
 
     def set(self, prop, value, muted=False, use_cache=None):
@@ -105,30 +285,36 @@ class Subject(object):
     def set_ext(self, prop, value, use_cache=None):
         return self._set(prop, value, True, True, use_cache)
 
+    def incr(self, prop, amount=1, muted=False, use_cache=None):
+        """
+        Adds amount to a numeric property (missing properties count as 0), atomically when not cached
+        and the storage supports it. Returns the new and the old value as set does
+        """
+        return self._set(prop, Increment(amount), False, muted, use_cache)
+
+    def decr(self, prop, amount=1, muted=False, use_cache=None):
+        return self.incr(prop, -amount, muted, use_cache)
+
     def _get(self, prop, extended, use_cache):
         if use_cache is None:
             use_cache = self._use_cache
-        if use_cache:
-            if self._cached is None:
-                self._load()
-            if extended:
-                vals = self._cached[PropertyType.EXTENDED]["values"]
+        with self._lock:
+            if use_cache:
+                self._fetch(((extended and PropertyType.EXTENDED or PropertyType.DEFAULT, prop),))
+                vals = self._cached.values(extended and PropertyType.EXTENDED or PropertyType.DEFAULT)
+                if prop not in vals:
+                    raise AttributeError(prop)
+                return vals[prop]
             else:
-                vals = self._cached[PropertyType.DEFAULT]["values"]
-            if prop not in vals:
-                raise AttributeError(prop)
-            return vals[prop]
-        else:
-            klass, k = extended and (SubjectExtProperty, PropertyType.EXTENDED) or (SubjectProperty, PropertyType.DEFAULT)
-            val = self._storage.get(klass(prop))
-            # update cache if present
-            if self._cached is not None:
-                self._cached[k]["values"][prop] = val
-                # remove prop from inserts and ensure it is in updates (ignore deletes)
-                if prop in self._cached[k]["created"]:
-                    self._cached[k]["created"].remove(prop)
-                self._cached[k]["updated"].add(prop)
-            return val
+                klass, k = extended and (SubjectExtProperty, PropertyType.EXTENDED) or (SubjectProperty, PropertyType.DEFAULT)
+                self._wait_writes()
+                val = self._storage.get(klass(prop))
+                # update cache if present
+                if self._cached is not None:
+                    self._cached.values(k)[prop] = val
+                    # it is stored, so at most an update
+                    self._cached.mark(k, prop, _UPDATED)
+                return val
 
     def get(self, prop, use_cache=None):
         return self._get(prop, False, use_cache)
@@ -139,34 +325,74 @@ class Subject(object):
     def _delete(self, prop, extended, muted, use_cache):
         if use_cache is None:
             use_cache = self._use_cache
-        if use_cache:
-            if self._cached is None:
-                self._load()
-            k = extended and PropertyType.EXTENDED or PropertyType.DEFAULT
-            vals = self._cached[k]["values"]
-            if prop not in vals:
-                raise AttributeError(prop)
-            del vals[prop]
-            for _set in ("created", "updated"):
-                if prop in self._cached[k][_set]:
-                    self._cached[k][_set].remove(prop)
-            self._cached[k]["deleted"].add(prop)
-        else:
-            klass, k = extended and (SubjectExtProperty, PropertyType.EXTENDED) or (SubjectProperty, PropertyType.DEFAULT)
-            self._storage.delete(klass(prop))
-            if self._cached is not None:
-                if prop in self._cached[k]["values"]:
-                    del self._cached[k]["values"][prop]
-                for _set in ["created", "updated", "deleted"]:
-                    if prop in self._cached[k][_set]:
-                        self._cached[k][_set].remove(prop)
+        with self._lock:
+            if use_cache:
+                k = extended and PropertyType.EXTENDED or PropertyType.DEFAULT
+                old_value = self._delete_cached(k, prop)
+                if self._ops is not None:
+                    self._ops.append((k, prop, True, None))
+            else:
+                klass, k = extended and (SubjectExtProperty, PropertyType.EXTENDED) or (SubjectProperty, PropertyType.DEFAULT)
+                self._wait_writes()
+                self._storage.delete(klass(prop))
+                self._discard_snapshot()
+                old_value = None
+                if self._cached is not None:
+                    old_value = self._cached.values(k).pop(prop, None)
+                    self._cached.clean(k, prop)
 
         if not muted:
-            payload = {PayloadConst.PROPERTY_NAME: prop}
+            if self._deferred_events:
+                self._defer_event(prop, old_value, None, True)
+            else:
+                self._route_deleted(prop)
+
+    def _delete_cached(self, k, prop):
+        self._fetch(((k, prop),))
+        vals = self._cached.values(k)
+        if prop not in vals:
+            raise AttributeError(prop)
+        old_value = vals.pop(prop)
+        if self._cached.state(k, prop) == _CREATED:
+            # never stored
+            self._cached.clean(k, prop)
+        else:
+            self._cached.mark(k, prop, _DELETED)
+        return old_value
+
+    def _route_changed(self, prop, old_value, value):
+        from krules_core.providers import event_router_factory
+        from krules_core import event_types
+
+        router = event_router_factory()
+        _route_property_event(router, event_types.SUBJECT_PROPERTY_CHANGED, self, prop,
+                              lambda: {PayloadConst.PROPERTY_NAME: prop, PayloadConst.OLD_VALUE: old_value,
+                                       PayloadConst.VALUE: value})
+
+    def _route_deleted(self, prop):
+        from krules_core.providers import event_router_factory
+        from krules_core import event_types
+
+        router = event_router_factory()
+        _route_property_event(router, event_types.SUBJECT_PROPERTY_DELETED, self, prop,
+                              lambda: {PayloadConst.PROPERTY_NAME: prop})
+
+    def _defer_event(self, prop, old_value, value, deleted):
+        with self._lock:
+            pending = self._pending_events.get(prop)
+            if pending is None:
+                self._pending_events[prop] = [old_value, value, deleted]
+            else:
+                pending[1:] = value, deleted
 
-            from krules_core.providers import event_router_factory
-            from krules_core import event_types
-            event_router_factory().route(event_types.SUBJECT_PROPERTY_DELETED, self, payload)
+    def _route_pending_events(self):
+        with self._lock:
+            pending, self._pending_events = self._pending_events, {}
+        for prop, (old_value, value, deleted) in pending.items():
+            if deleted:
+                self._route_deleted(prop)
+            elif value != old_value:
+                self._route_changed(prop, old_value, value)
 
     def delete(self, prop, muted=False, use_cache=None):
         self._delete(prop, False, muted, use_cache)
@@ -180,72 +406,137 @@ class Subject(object):
         # and we get them from the storage.
         # This is because we need all the extended properties primarily when we route events to a subject
         # and we don't care about normal properties
-        if self._cached:
-            return self._cached[PropertyType.EXTENDED]["values"].copy()
+        if self._cached is not None and not self._complete:
+            self._load()
+        if self._cached is not None:
+            return self._cached.ext_props.copy()
+        self._wait_writes()
         return self._storage.get_ext_props()
 
     def event_info(self):
         return self._event_info.copy()
 
     def flush(self):
+        self._wait_writes()
         self._storage.flush()
+        self._discard_snapshot()
         return self
 
-    def store(self):
+    def _discard_snapshot(self):
+        if self._snapshots is not None:
+            self._snapshots.discard(str(self.name))
 
-        if not self._cached:
-            return
+    def store(self):
 
+        self._store()
+        # rules reacting to deferred events may change the subject again, each round is a cascade level
+        rounds = 0
+        while self._pending_events:
+            max_rounds = _max_store_rounds()
+            if rounds >= max_rounds:
+                from krules_core.route.cascade import CascadeLimitError
+                raise CascadeLimitError("loop detected: {} still changed after routing its deferred events {} times"
+                                        .format(self.name, max_rounds))
+            rounds += 1
+            self._route_pending_events()
+            self._store()
+
+    def _changes(self):
         inserts, updates, deletes = [], [], []
-        for _set, k1 in ((inserts, "created"), (updates, "updated"), (deletes, "deleted")):
-            for k2, klass in ((PropertyType.DEFAULT, SubjectProperty), (PropertyType.EXTENDED, SubjectExtProperty)):
-                for prop in self._cached[k2][k1]:
-                    try:
-                        _set.append(klass(prop, self._cached[k2]["values"][prop]))
-                    except KeyError as ex:
-                        if _set is deletes:
-                            _set.append(klass(prop))
-                        else:
-                            raise ex
-
-        self._storage.store(inserts=inserts, updates=updates, deletes=deletes)
+        changes = {_CREATED: inserts, _UPDATED: updates, _DELETED: deletes}
+        for (k, prop), state in (self._cached.dirty or {}).items():
+            klass = k == PropertyType.EXTENDED and SubjectExtProperty or SubjectProperty
+            if state == _DELETED:
+                deletes.append(klass(prop))
+            else:
+                changes[state].append(klass(prop, self._cached.values(k)[prop]))
+        return inserts, updates, deletes
+
+    def _replay(self):
+        """
+        Loads the subject again and applies the changes made through the cache on top of it
+        """
+        self._discard_snapshot()
         self._cached = None
+        self._complete = False
+        self._load()
+        for k, prop, deleted, value in self._ops:
+            if not deleted:
+                self._set_cached(k, prop, value)
+            elif prop in self._cached.values(k):
+                self._delete_cached(k, prop)
+
+    def _store_versioned(self):
+        retries = int(os.environ.get("SUBJECT_STORE_RETRIES", 10))
+        inserts, updates, deletes = self._changes()
+        while inserts or updates or deletes:
+            if self._storage.store_versioned(self._version, inserts=inserts, updates=updates, deletes=deletes):
+                break
+            if retries <= 0:
+                raise SubjectConflictError("subject {} changed concurrently".format(self.name))
+            retries -= 1
+            self._replay()
+            inserts, updates, deletes = self._changes()
+        self._ops = []
+        return inserts, updates, deletes
+
+    def _store(self):
+
+        written = None
+        with self._lock:
+            if self._cached is None:
+                return
+
+            inserts, updates, deletes = self._changes()
+            if self._ops is not None:
+                inserts, updates, deletes = self._store_versioned()
+            elif self._writes is None:
+                self._storage.store(inserts=inserts, updates=updates, deletes=deletes)
+            elif inserts or updates or deletes:
+                written = self._writes.submit(str(self.name), self._storage, inserts, updates, deletes,
+                                              callback=self._discard_snapshot)
+            if inserts or updates or deletes:
+                self._discard_snapshot()
+            self._cached = None
+            self._complete = False
+
+        if written is not None and self._writes.durability == StoreDurability.WRITTEN:
+            written.result()
 
     def __len__(self):
 
-        if self._cached is None or not self._use_cache:
+        if not self._complete or not self._use_cache:
             self._load()
-        return len(self._cached[PropertyType.DEFAULT]["values"])
+        return len(self._cached.props)
 
     def __iter__(self):
-        if self._cached is None or not self._use_cache:
+        if not self._complete or not self._use_cache:
             self._load()
-        return iter(self._cached[PropertyType.DEFAULT]["values"])
+        return iter(self._cached.props)
 
     def __contains__(self, item):
-        if self._cached is None or not self._use_cache:
+        if not self._use_cache:
             self._load()
-        return item in self._cached[PropertyType.DEFAULT]["values"]
-
-    def __getattribute__(self, item):
+        else:
+            self._fetch(((PropertyType.DEFAULT, item),))
+        return item in self._cached.props
+
+    def __getattr__(self, item):
+        # only called for names which are not Subject attributes, that are read at full speed.
+        # Property values are returned as they are, see incr/decr for counters
+        if item.startswith("_"):
+            raise AttributeError(item)
+        propname = item
+        is_ext = False
+        if item.startswith("m_"):
+            propname = item[2:]
+        elif item.startswith("ext_"):
+            propname = item[4:]
+            is_ext = True
         try:
-            return super().__getattribute__(item)
-        except AttributeError as ex:
-            propname = item
-            is_ext = False
-            is_mute = False
-            try:
-                if item.startswith("m_"):
-                    propname = item[2:]
-                    is_mute = True
-                elif item.startswith("ext_"):
-                    propname = item[4:]
-                    is_ext = True
-
-                value = self._get(propname, extended=is_ext, use_cache=self._use_cache)
-            except KeyError:
-                raise ex
-            return _SubjectPropertyProxy(self, propname, value, is_ext, is_mute, self._use_cache)
+            return self._get(propname, extended=is_ext, use_cache=self._use_cache)
+        except KeyError:
+            raise AttributeError(item)
 
     def __setattr__(self, item, value):
 
@@ -279,43 +570,3 @@ class Subject(object):
             is_ext = True
             propname = item[4:]
         return self._delete(propname, is_ext, is_mute, self._use_cache)
-
-
-class _SubjectPropertyProxy(wrapt.ObjectProxy):
-        """
-        This class wraps subject properties and it is ment primarily
-        to use in interactive mode.
-        I also provides convenience methods to dial with counters (incr/decr)
-        All operations are not cached and immediately effective
-        """
-
-        _subject = None
-        _prop = None
-        _extended = None
-        _muted = None
-        _use_cache = None
-
-        def __init__(self, subject, prop, value, extended, muted, use_cache):
-            super().__init__(value)
-            self._subject = subject
-            self._prop = prop
-            self._extended = extended
-            self._muted = muted
-            self._use_cache = use_cache
-
-        def __repr__(self):
-            return self.__class__.__repr__(self.__wrapped__)
-
-        def incr(self, amount=1):
-            if self._extended:
-                raise TypeError("not supported for extended properties")
-            return self._subject.set(self._prop, lambda v: v+amount, self._muted, self._use_cache)
-
-        def decr(self, amount=1):
-            if self._extended:
-                raise TypeError("not supported for extended properties")
-            return self._subject.set(self._prop, lambda v: v-amount, self._muted, self._use_cache)
-
-
-
-
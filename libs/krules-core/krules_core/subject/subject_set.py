@@ -0,0 +1,72 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+
+
+class SubjectSet(object):
+    """
+    Several subjects loaded together.
+
+    Subjects are obtained from subject_factory (so that they are shared within a subject scope) and
+    those whose cache is still empty are loaded with a single load_many call per backend, instead of one
+    load per subject. Storages batch together when they have the same class and the same batch_key()
+    (eg: connection and namespace), those without load_many or batch_key let their subjects load on
+    first access as usual.
+
+        for device in SubjectSet(site.get("devices")):
+            device.set("site_status", status)
+    """
+
+    def __init__(self, names, **kwargs):
+        from krules_core.providers import subject_factory
+
+        self._subjects = OrderedDict()
+        for name in names:
+            name = str(name)
+            if name not in self._subjects:
+                self._subjects[name] = subject_factory(name, **kwargs)
+        self.load()
+
+    def load(self):
+        """
+        Loads the subjects not yet cached
+        """
+        groups = OrderedDict()
+        for subject in self._subjects.values():
+            storage = subject._storage
+            if subject._needs_load() and hasattr(storage, "load_many") and hasattr(storage, "batch_key"):
+                groups.setdefault((type(storage), storage.batch_key()), []).append(subject)
+        for subjects in groups.values():
+            for subject in subjects:
+                subject._wait_writes()
+            loaded = subjects[0]._storage.load_many([subject.name for subject in subjects])
+            for subject in subjects:
+                subject._preload(*loaded[str(subject.name)])
+
+    def __len__(self):
+        return len(self._subjects)
+
+    def __iter__(self):
+        return iter(self._subjects.values())
+
+    def __contains__(self, name):
+        return str(name) in self._subjects
+
+    def __getitem__(self, name):
+        return self._subjects[str(name)]
+
+    def names(self):
+        return list(self._subjects)
+
+    def store(self):
+        for subject in self._subjects.values():
+            subject.store()
@@ -0,0 +1,211 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Write-behind persistence of the subjects.
+
+Unless the durability (SUBJECTS_STORE_DURABILITY environment variable) is "sync", the default,
+Subject.store() hands the changes to a queue written to the storage by a pool of worker threads
+(SUBJECTS_STORE_WORKERS, default 4):
+
+    "sync"      the caller writes the changes itself, store() returns when they are written
+    "written"   store() returns when the changes are written (the subjects of a request are
+                written concurrently)
+    "queued"    store() returns immediately
+
+Writes for the same subject are applied one at a time, in order, and changes queued while a previous
+write is in progress are coalesced into a single write. Subjects wait for their pending writes
+before reading from the storage again. Queued changes are written when the process exits.
+"""
+
+import atexit
+import logging
+import os
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+
+logger = logging.getLogger("__core__")
+
+
+class StoreDurability(object):
+
+    SYNC = "sync"
+    WRITTEN = "written"
+    QUEUED = "queued"
+
+
+_INSERT, _UPDATE, _DELETE = range(3)
+
+
+def _merge(old, new):
+    """
+    Operation equivalent to old followed by new on the same property, None if there is none
+    """
+    if old == new or new == _DELETE:
+        return new
+    if old == _INSERT and new == _UPDATE:
+        return _INSERT
+    # a deleted property inserted again
+    return None
+
+
+class _Batch(object):
+    """
+    Changes of a subject written at once
+    """
+
+    __slots__ = ("storage", "changes", "callbacks", "future")
+
+    def __init__(self, storage):
+        self.storage = storage
+        # (property type, name) -> (operation, property)
+        self.changes = OrderedDict()
+        self.callbacks = []
+        self.future = Future()
+
+    def merge(self, changes):
+        for key, (op, _) in changes.items():
+            if key in self.changes and _merge(self.changes[key][0], op) is None:
+                return False
+        for key, (op, prop) in changes.items():
+            if key in self.changes:
+                op = _merge(self.changes[key][0], op)
+            self.changes[key] = (op, prop)
+        return True
+
+    def write(self):
+        ops = ([], [], [])
+        for op, prop in self.changes.values():
+            ops[op].append(prop)
+        self.storage.store(inserts=ops[_INSERT], updates=ops[_UPDATE], deletes=ops[_DELETE])
+
+
+class WriteBehindQueue(object):
+
+    def __init__(self, workers=4, durability=StoreDurability.SYNC):
+        self.durability = durability
+        self.workers = workers
+        self._cond = threading.Condition()
+        # subject name -> batches to write, the first one may be being written
+        self._pending = {}
+        # names with batches to write and no write in progress, in order of arrival
+        self._ready = deque()
+        self._writing = set()
+        self._threads = []
+        self._closed = False
+
+    @classmethod
+    def from_env(cls):
+        queue = cls(
+            workers=int(os.environ.get("SUBJECTS_STORE_WORKERS", 4)),
+            durability=os.environ.get("SUBJECTS_STORE_DURABILITY", StoreDurability.SYNC).lower(),
+        )
+        if queue.enabled:
+            atexit.register(queue.close)
+        return queue
+
+    @property
+    def enabled(self):
+        return self.durability != StoreDurability.SYNC
+
+    def _start(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name="subjects-write-behind", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, name, storage, inserts=(), updates=(), deletes=(), callback=None):
+        """
+        Queues the changes of a subject. Returns a future completed when they are written,
+        callback is called (with no arguments) once they are
+        """
+        changes = OrderedDict()
+        for op, props in ((_INSERT, inserts), (_UPDATE, updates), (_DELETE, deletes)):
+            for prop in props:
+                changes[(prop.type, prop.name)] = (op, prop)
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("write-behind queue closed")
+            self._start()
+            batches = self._pending.setdefault(name, deque())
+            batch = batches and batches[-1] or None
+            if batch is None or name in self._writing and len(batches) == 1 or not batch.merge(changes):
+                batch = _Batch(storage)
+                batch.merge(changes)
+                batches.append(batch)
+                if len(batches) == 1:
+                    self._ready.append(name)
+                    self._cond.notify()
+            if callback is not None:
+                batch.callbacks.append(callback)
+            return batch.future
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._ready and not self._closed:
+                    self._cond.wait()
+                if not self._ready:
+                    return
+                name = self._ready.popleft()
+                self._writing.add(name)
+                batch = self._pending[name][0]
+
+            error = None
+            try:
+                batch.write()
+            except Exception as ex:
+                logger.error("failed writing subject {}".format(name), exc_info=True)
+                error = ex
+
+            with self._cond:
+                self._writing.discard(name)
+                batches = self._pending[name]
+                batches.popleft()
+                if batches:
+                    self._ready.append(name)
+                else:
+                    del self._pending[name]
+                self._cond.notify_all()
+
+            for callback in batch.callbacks:
+                callback()
+            if error is None:
+                batch.future.set_result(None)
+            else:
+                batch.future.set_exception(error)
+
+    def wait(self, name, timeout=None):
+        """
+        Waits until the queued changes of a subject are written
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: name not in self._pending, timeout)
+
+    def flush(self, timeout=None):
+        """
+        Waits until all the queued changes are written, returns False on timeout
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def close(self, timeout=None):
+        """
+        Writes the queued changes and stops the workers
+        """
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
@@ -20,6 +20,7 @@ import sqlite3
 import logging
 logger = logging.getLogger(__name__)
 
+from krules_core.codec import decode
 from krules_core.subject import PropertyType, SubjectExtProperty, SubjectProperty
 
 
@@ -43,6 +44,8 @@ class SQLLiteSubjectStorage(object):
         c.execute(create_subjects_table_sql)
         c = self._conn.cursor()
         c.execute("CREATE INDEX IF NOT EXISTS idx_subjects ON subjects(subject)")
+        c = self._conn.cursor()
+        c.execute("CREATE TABLE IF NOT EXISTS versions (subject TEXT PRIMARY KEY, version INTEGER NOT NULL)")
         self._close_connection()
 
     def __str__(self):
@@ -72,6 +75,19 @@ class SQLLiteSubjectStorage(object):
         if self._dbfile != ":memory:":
             self._conn.close()
 
+    def _bump_version_sql(self):
+        return "INSERT OR IGNORE INTO versions (subject, version) VALUES ('{0}', 0);\n" \
+               "UPDATE versions SET version = version + 1 WHERE subject = '{0}';\n".format(self._subject)
+
+    def get_version(self):
+        """
+        Changes on every write to the subject
+        """
+        conn = self._get_connection()
+        res = conn.execute("SELECT version FROM versions WHERE subject = ?", (self._subject,)).fetchall()
+        self._close_connection()
+        return res and res[0][0] or 0
+
     def load(self):
 
         select_props_sql = """
@@ -89,7 +105,56 @@ class SQLLiteSubjectStorage(object):
         }
         rows = c.fetchall()
         for row in rows:
-            res[row[1]][row[0]] = json.loads(row[2])
+            res[row[1]][row[0]] = decode(row[2])
+
+        self._close_connection()
+
+        return res[PropertyType.DEFAULT], res[PropertyType.EXTENDED]
+
+    def batch_key(self):
+        return self._dbfile
+
+    def load_many(self, names):
+        """
+        Same as load for several subjects, in a single query.
+        Returns a dictionary mapping each name to its properties and extended properties
+        """
+        names = [str(name) for name in names]
+        res = {name: ({}, {}) for name in names}
+        if not names:
+            return res
+
+        conn = self._get_connection()
+        rows = conn.execute(
+            "SELECT subject, property, proptype, propvalue FROM subjects WHERE subject IN ({})".format(
+                ", ".join("?" * len(names))), names).fetchall()
+        for subject, prop, proptype, value in rows:
+            res[subject][1 if proptype == PropertyType.EXTENDED else 0][prop] = decode(value)
+
+        self._close_connection()
+
+        return res
+
+    def load_props(self, props):
+        """
+        Same as load, restricted to the given properties (missing ones are not returned)
+        """
+        res = {
+            PropertyType.DEFAULT: {},
+            PropertyType.EXTENDED: {}
+        }
+        wanted = set((prop.type, prop.name) for prop in props)
+        if not wanted:
+            return res[PropertyType.DEFAULT], res[PropertyType.EXTENDED]
+
+        names = list(set(name for _, name in wanted))
+        conn = self._get_connection()
+        rows = conn.execute(
+            "SELECT property, proptype, propvalue FROM subjects WHERE subject = ? AND property IN ({})".format(
+                ", ".join("?" * len(names))), [self._subject] + names).fetchall()
+        for row in rows:
+            if (row[1], row[0]) in wanted:
+                res[row[1]][row[0]] = decode(row[2])
 
         self._close_connection()
 
@@ -126,12 +191,49 @@ class SQLLiteSubjectStorage(object):
                 self._subject, prop.name, prop.type
             )
 
+        if sql_script:
+            sql_script += self._bump_version_sql()
+
         # TODO: when fails shoud a failback function should be called
         #   checking at least each insert property if needs update instead
         conn.executescript(sql_script)
 
         self._close_connection()
 
+    def store_versioned(self, version, inserts=[], updates=[], deletes=[]):
+        """
+        Same as store, provided that the subject version is still the given one.
+        Returns False, without writing, otherwise
+        """
+        conn = self._get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+
+        try:
+            res = conn.execute("SELECT version FROM versions WHERE subject = ?", (self._subject,)).fetchall()
+            if (res and res[0][0] or 0) != version:
+                conn.execute("ROLLBACK")
+                self._close_connection()
+                return False
+            for prop in inserts:
+                conn.execute("INSERT INTO subjects (subject, property, proptype, propvalue) VALUES (?, ?, ?, ?)",
+                             (self._subject, prop.name, prop.type, prop.json_value()))
+            for prop in updates:
+                conn.execute("UPDATE subjects SET propvalue=? WHERE subject=? and property=? and proptype=?",
+                             (prop.json_value(), self._subject, prop.name, prop.type))
+            for prop in deletes:
+                conn.execute("DELETE FROM subjects WHERE subject=? and property=? and proptype=?",
+                             (self._subject, prop.name, prop.type))
+            conn.execute("INSERT OR IGNORE INTO versions (subject, version) VALUES (?, 0)", (self._subject,))
+            conn.execute("UPDATE versions SET version = version + 1 WHERE subject = ?", (self._subject,))
+        except Exception as ex:
+            conn.execute("ROLLBACK")
+            self._close_connection()
+            raise ex
+
+        conn.execute("COMMIT")
+        self._close_connection()
+        return True
+
     def set(self, prop, old_value_default=None):
         """
         Set value for property, works both in update and insert
@@ -150,7 +252,7 @@ class SQLLiteSubjectStorage(object):
 
         try:
             if len(res):
-                old_value = json.loads(res[0][0])
+                old_value = decode(res[0][0])
 
                 conn.execute("UPDATE subjects SET propvalue=? WHERE subject=? and property=? and proptype=?",
                           (prop.json_value(old_value), self._subject, prop.name, prop.type))
@@ -159,6 +261,8 @@ class SQLLiteSubjectStorage(object):
                               "VALUES ('{}', '{}', '{}', '{}');\n".format(
                     self._subject, prop.name, prop.type, prop.json_value(old_value_default))
                 )
+            conn.execute("INSERT OR IGNORE INTO versions (subject, version) VALUES (?, 0)", (self._subject,))
+            conn.execute("UPDATE versions SET version = version + 1 WHERE subject = ?", (self._subject,))
         except Exception as ex:
             conn.execute("ROLLBACK")
             self._close_connection()
@@ -170,6 +274,40 @@ class SQLLiteSubjectStorage(object):
         new_value = prop.get_value(old_value)
         return new_value, old_value
 
+    def incr(self, prop, amount=1):
+        """
+        Adds amount to a numeric property (a missing one counts as 0).
+        Returns new and old value
+        """
+        conn = self._get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+
+        try:
+            res = conn.execute("SELECT propvalue FROM subjects WHERE subject=? and property=? and proptype=?",
+                               (self._subject, prop.name, prop.type)).fetchall()
+            old_value = None
+            if len(res):
+                old_value = decode(res[0][0])
+                if isinstance(old_value, bool) or not isinstance(old_value, (int, float)):
+                    raise TypeError("{} is not a number".format(prop.name))
+                conn.execute("UPDATE subjects SET propvalue = propvalue + ? "
+                             "WHERE subject=? and property=? and proptype=?",
+                             (amount, self._subject, prop.name, prop.type))
+            else:
+                conn.execute("INSERT INTO subjects (subject, property, proptype, propvalue) VALUES (?, ?, ?, ?)",
+                             (self._subject, prop.name, prop.type, json.dumps(amount)))
+            conn.execute("INSERT OR IGNORE INTO versions (subject, version) VALUES (?, 0)", (self._subject,))
+            conn.execute("UPDATE versions SET version = version + 1 WHERE subject = ?", (self._subject,))
+        except Exception as ex:
+            conn.execute("ROLLBACK")
+            self._close_connection()
+            raise ex
+
+        conn.execute("COMMIT")
+        self._close_connection()
+
+        return (old_value or 0) + amount, old_value
+
     def get(self, prop):
         """
         Get a single property
@@ -182,7 +320,7 @@ class SQLLiteSubjectStorage(object):
             self._close_connection()
             raise AttributeError(prop.name)
         self._close_connection()
-        return json.loads(res[0][0])
+        return decode(res[0][0])
 
     # def incr(self, prop, amount=1):
     #     """
@@ -206,6 +344,7 @@ class SQLLiteSubjectStorage(object):
 
         conn.execute("DELETE FROM subjects WHERE subject = ? AND property = ? AND proptype = ?",
                      (self._subject, prop.name, prop.type))
+        conn.executescript(self._bump_version_sql())
 
         conn.commit()
 
@@ -220,7 +359,7 @@ class SQLLiteSubjectStorage(object):
         #res = [SubjectExtProperty(pname, json.loads(pvalue)) for pname, pvalue in props]
         self._close_connection()
 
-        return dict((k, json.loads(v)) for k, v in props)
+        return dict((k, decode(v)) for k, v in props)
 
 
     ## WE DON?T NEED IT
@@ -247,6 +386,7 @@ class SQLLiteSubjectStorage(object):
         conn = self._get_connection()
 
         conn.execute("DELETE FROM subjects WHERE subject = '{}';".format(self._subject))
+        conn.executescript(self._bump_version_sql())
 
         conn.commit()
 
@@ -221,6 +221,36 @@ def test_ext_props(storage_subject1, storage_subject2):
     assert "p3" in props and props["p3"] == 3
     assert "p4" in props and props["p4"] == 4
 
+
+def test_incr(storage_subject1):
+    if not hasattr(storage_subject1, "incr"):
+        pytest.skip("optional operation")
+    storage_subject1.flush()
+
+    assert storage_subject1.incr(SubjectProperty("cnt"), 2) == (2, None)
+    assert storage_subject1.incr(SubjectProperty("cnt"), -5) == (-3, 2)
+    assert storage_subject1.incr(SubjectProperty("cnt"), 0.5) == (-2.5, -3)
+    assert storage_subject1.get(SubjectProperty("cnt")) == -2.5
+    storage_subject1.set(SubjectProperty("label", "a"))
+    with pytest.raises(TypeError):
+        storage_subject1.incr(SubjectProperty("label"))
+    assert storage_subject1.get(SubjectProperty("label")) == "a"
+
+
+def test_store_versioned(storage_subject1):
+    if not hasattr(storage_subject1, "store_versioned"):
+        pytest.skip("optional operation")
+    storage_subject1.flush()
+
+    version = storage_subject1.get_version()
+    assert storage_subject1.store_versioned(version, inserts=[SubjectProperty("p1", 1), SubjectProperty("p2", 2)])
+    # stale version
+    assert not storage_subject1.store_versioned(version, updates=[SubjectProperty("p1", 10)])
+    version = storage_subject1.get_version()
+    assert storage_subject1.store_versioned(version, updates=[SubjectProperty("p1", 10)],
+                                            deletes=[SubjectProperty("p2")])
+    assert storage_subject1.load() == ({"p1": 10}, {})
+
 # def test_get_all_properties(storage_subject1):
 #
 #     storage_subject1.flush()
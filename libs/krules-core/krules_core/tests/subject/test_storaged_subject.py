@@ -65,13 +65,13 @@ def test_factory():
     assert test_subject.name == "test-subject"
 
 
-@pytest.fixture
-def subject():
+@pytest.fixture(params=[False, True], ids=["full_load", "partial_load"])
+def subject(request):
     from krules_core.providers import subject_factory
 
     global counter
     counter += 1
-    return subject_factory('test-subject-{0}'.format(counter)).flush()
+    return subject_factory('test-subject-{0}'.format(counter), partial_load=request.param).flush()
 
 @pytest.fixture
 def subject_no_cache():
@@ -82,6 +82,39 @@ def subject_no_cache():
     return subject_factory('test-subject-{0}'.format(counter), use_cache_default=False).flush()
 
 
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    """
+    Function making subjects use an on file sqlite storage, until the end of the test. Keyword arguments
+    map storage methods to hooks called with the storage and the method arguments before the method
+    (eg: to record the calls), dbfile is a file name or a function of the subject name
+    """
+    from krules_core.providers import subject_storage_factory
+    from krules_core.tests.subject.sqlite_storage import SQLLiteSubjectStorage
+
+    def _hooked(method, hook):
+        def _method(self, *args, **kwargs):
+            hook(self, *args, **kwargs)
+            return method(self, *args, **kwargs)
+        return _method
+
+    overrides = []
+
+    def _use(dbfile="subjects.sqlite", **hooks):
+        storage_class = type("_Storage", (SQLLiteSubjectStorage,), {
+            name: _hooked(getattr(SQLLiteSubjectStorage, name), hook) for name, hook in hooks.items()
+        })
+        dbfile_of = callable(dbfile) and dbfile or (lambda name: dbfile)
+        subject_storage_factory.override(providers.Factory(
+            lambda name, **kwargs: storage_class(name, str(tmp_path / dbfile_of(name)))))
+        overrides.append(storage_class)
+        return storage_class
+
+    yield _use
+    for _ in overrides:
+        subject_storage_factory.reset_last_overriding()
+
+
 def test_set_get_del(subject):
     from krules_core.providers import subject_factory, subject_storage_factory
 
@@ -396,18 +429,16 @@ def test_property_proxy(subject_no_cache):
 
     assert subject_no_cache.foo == 4
 
-    subject_no_cache.foo.incr()
+    # plain values
+    assert type(subject_no_cache.foo) is int and type(subject_no_cache.ext_foo) is int
+    subject_no_cache.incr("foo")
     assert len(_test_events) == 3
     assert subject_no_cache.foo == 5
-    subject_no_cache.m_foo.incr(2)
+    subject_no_cache.incr("foo", 2, muted=True)
     assert len(_test_events) == 3
     assert subject_no_cache.foo == 7
-    subject_no_cache.foo.decr()
+    subject_no_cache.decr("foo")
     assert subject_no_cache.foo == 6
-    with pytest.raises(TypeError):
-        subject_no_cache.ext_foo.incr()
-    with pytest.raises(TypeError):
-        subject_no_cache.ext_foo.decr()
 
     del subject_no_cache.foo
     assert len(_test_events) == 5
@@ -446,3 +477,234 @@ def test_reading(subject):
     assert subject.listvalue == listvalue
 
 
+
+
+def test_deferred_events():
+    from krules_core.providers import subject_factory
+    from krules_core import event_types
+
+    global _test_events, counter
+    counter += 1
+    subject = subject_factory('test-subject-{0}'.format(counter), deferred_events=True).flush()
+    subject.set("counter", 0)
+    subject.store()
+    _test_events = []
+
+    for _ in range(10):
+        subject.incr("counter")
+    subject.set("status", "running")
+    subject.set("status", "done")
+    subject.set("unchanged", 1)
+    subject.set("unchanged", None)
+    subject.set("removed", 1)
+    subject.delete("removed")
+    assert _test_events == []
+
+    subject.store()
+    assert [(event_type, payload) for event_type, _, payload in _test_events] == [
+        (event_types.SUBJECT_PROPERTY_CHANGED,
+         {PayloadConst.PROPERTY_NAME: "counter", PayloadConst.OLD_VALUE: 0, PayloadConst.VALUE: 10}),
+        (event_types.SUBJECT_PROPERTY_CHANGED,
+         {PayloadConst.PROPERTY_NAME: "status", PayloadConst.OLD_VALUE: None, PayloadConst.VALUE: "done"}),
+        (event_types.SUBJECT_PROPERTY_DELETED, {PayloadConst.PROPERTY_NAME: "removed"}),
+    ]
+
+
+
+def test_deferred_events_loop():
+    from krules_core.providers import subject_factory, event_router_factory
+    from krules_core.route.cascade import CascadeLimitError
+
+    class LoopingRouter(Router):
+        max_cascade_depth = 5
+
+        def route(self, type, subject, payload):
+            super().route(type, subject, payload)
+            # a rule changing the subject it reacts to
+            subject.set("counter", payload[PayloadConst.VALUE] + 1)
+
+    global _test_events, counter
+    counter += 1
+    subject = subject_factory('test-subject-{0}'.format(counter), deferred_events=True).flush()
+    _test_events = []
+    event_router_factory.override(providers.Object(LoopingRouter()))
+    try:
+        subject.set("counter", 0)
+        with pytest.raises(CascadeLimitError):
+            subject.store()
+        assert [payload[PayloadConst.VALUE] for _, _, payload in _test_events] == [0, 1, 2, 3, 4]
+        assert subject.get("counter", use_cache=False) == 5
+    finally:
+        event_router_factory.reset_last_overriding()
+
+
+def test_partial_load(sqlite_storage):
+    from krules_core.providers import subject_factory
+    from krules_core.core import Rule
+    from krules_core.base_functions import Callable
+
+    calls = []
+    sqlite_storage(load=lambda storage: calls.append("load"),
+                   load_props=lambda storage, props: calls.append(sorted((prop.type, prop.name) for prop in props)))
+    subject = subject_factory("test-partial", partial_load=True)
+    for i in range(10):
+        subject.set("p{}".format(i), i, muted=True)
+    subject.set_ext("e", "ext")
+    subject.store()
+    assert "load" not in calls
+
+    subject = subject_factory("test-partial", partial_load=True)
+    calls.clear()
+    subject.prefetch(["p1", "p2", "missing"], ["e"])
+    assert calls == [[(PropertyType.EXTENDED, "e"), (PropertyType.DEFAULT, "missing"),
+                      (PropertyType.DEFAULT, "p1"), (PropertyType.DEFAULT, "p2")]]
+    assert subject.get("p1") == 1 and subject.get_ext("e") == "ext"
+    with pytest.raises(AttributeError):
+        subject.get("missing")
+    assert "p2" in subject and "missing" not in subject
+    assert len(calls) == 1
+    subject.set("p1", 100, muted=True)
+    subject.set("new", 1, muted=True)
+    subject.delete("p2", muted=True)
+    subject.get("p3")
+    assert len(calls) == 3  # p1 and p2 were already there
+
+    # a full load keeps the local changes
+    assert len(subject) == 10
+    assert calls[-1] == "load"
+    assert sorted(subject) == sorted(["new", "p0", "p1"] + ["p{}".format(i) for i in range(3, 10)])
+    subject.store()
+
+    subject = subject_factory("test-partial", partial_load=True)
+    assert (subject.get("p1"), subject.get("new"), "p2" in subject) == (100, 1, False)
+
+    # rules prefetch the declared properties
+    rule = Rule("test-partial-prefetch")
+    rule.set_prefetch(["p3", "p4", "ext_e"])
+    rule.set_processing([Callable(lambda self: self.subject.get("p3") + self.subject.get("p4"))])
+    subject = subject_factory("test-partial", partial_load=True)
+    calls.clear()
+    rule._process("test-event", subject, {})
+    assert calls == [[(PropertyType.EXTENDED, "e"), (PropertyType.DEFAULT, "p3"), (PropertyType.DEFAULT, "p4")]]
+
+
+def test_subject_set(sqlite_storage):
+    from krules_core.providers import subject_factory
+    from krules_core.subject.scope import subject_scope
+    from krules_core.subject.subject_set import SubjectSet
+
+    calls = []
+    hooks = dict(load=lambda storage: calls.append(storage._subject),
+                 load_many=lambda storage, names: calls.append(list(names)))
+    sqlite_storage(**hooks)
+    for i in range(5):
+        subject = subject_factory("device-{}".format(i))
+        subject.set("n", i, muted=True)
+        subject.set_ext("site", "site-1")
+        subject.store()
+    calls.clear()
+
+    names = ["device-{}".format(i) for i in range(6)]
+    with subject_scope():
+        subject_factory("device-0").get("n")
+        devices = SubjectSet(names + ["device-1"])
+        assert calls == ["device-0", names[1:]]
+        assert len(devices) == 6 and devices.names() == names
+        assert devices["device-0"] is subject_factory("device-0")
+        assert [device.get("n") for device in list(devices)[:5]] == list(range(5))
+        assert "n" not in devices["device-5"]
+        assert devices["device-4"].get_ext("site") == "site-1"
+        assert len(calls) == 2
+
+        for device in devices:
+            device.set("n", lambda n: (n or 0) + 10, muted=True)
+        devices.store()
+
+    assert [device.get("n") for device in SubjectSet(names)] == [10, 11, 12, 13, 14, 10]
+    assert len(calls) == 3
+
+    # same storage class, different backends
+    sqlite_storage(lambda name: name.startswith("other-") and "other.sqlite" or "subjects.sqlite", **hooks)
+    other = subject_factory("other-0")
+    other.set("n", 100, muted=True)
+    other.store()
+    calls.clear()
+    devices = SubjectSet(["device-0", "other-0", "device-1"])
+    assert calls == [["device-0", "device-1"], ["other-0"]]
+    assert [device.get("n") for device in devices] == [10, 100, 11]
+
+
+def test_increment(sqlite_storage):
+    from krules_core.providers import subject_factory, subject_storage_factory
+    from krules_core.subject import Increment
+
+    calls = []
+    sqlite_storage(set=lambda storage, prop, *args: calls.append("set"),
+                   incr=lambda storage, prop, *args: calls.append("incr"))
+    subject = subject_factory("test-increment", use_cache_default=False)
+    assert subject.set("cnt", Increment(3), muted=True) == (3, None)
+    subject.set("cnt", 10, muted=True)
+    assert subject.incr("cnt", muted=True) == (11, 10)
+    assert subject.decr("cnt", 5, muted=True) == (6, 11)
+    assert calls == ["incr", "set", "incr", "incr"]
+
+    # cached
+    subject = subject_factory("test-increment")
+    assert subject.set("cnt", Increment(2), muted=True) == (8, 6)
+    assert subject.set("new_cnt", Increment(), muted=True) == (1, None)
+    subject.store()
+    assert subject_factory("test-increment").get("cnt") == 8
+
+    # storages without native increments get a function
+    class _PlainStorage(object):
+
+        def set(self, prop, old_value_default=None):
+            return prop.get_value(8), 8
+
+    subject_storage_factory.override(providers.Factory(lambda name, **kwargs: _PlainStorage()))
+    try:
+        subject = subject_factory("test-increment", use_cache_default=False)
+        assert subject.set("cnt", Increment(-8), muted=True) == (0, 8)
+    finally:
+        subject_storage_factory.reset_last_overriding()
+
+
+def test_versioned_store(sqlite_storage, monkeypatch):
+    from krules_core.subject import Increment
+    from krules_core.subject.storaged_subject import Subject, SubjectConflictError
+
+    sqlite_storage()
+    Subject("test-versioned").set("cnt", 0, muted=True)
+    Subject("test-versioned").store()
+
+    # two replicas processing events for the same subject concurrently
+    replica1, replica2 = Subject("test-versioned", versioned=True), Subject("test-versioned", versioned=True)
+    replica1.set("cnt", Increment(), muted=True)
+    replica1.set("log", lambda log: (log or []) + ["r1"], muted=True)
+    replica2.set("cnt", Increment(5), muted=True)
+    replica2.set("log", lambda log: (log or []) + ["r2"], muted=True)
+    replica2.set("tmp", 1, muted=True)
+    replica2.delete("tmp", muted=True)
+    replica1.store()
+    # conflict, the changes are applied again on top of the ones stored by replica1
+    replica2.store()
+    subject = Subject("test-versioned")
+    assert subject.get("cnt") == 6
+    assert subject.get("log") == ["r1", "r2"]
+    assert "tmp" not in subject
+
+    # unversioned subjects lose updates
+    replica1, replica2 = Subject("test-versioned"), Subject("test-versioned")
+    replica1.set("cnt", Increment(), muted=True)
+    replica2.set("cnt", Increment(), muted=True)
+    replica1.store()
+    replica2.store()
+    assert Subject("test-versioned").get("cnt") == 7
+
+    monkeypatch.setenv("SUBJECT_STORE_RETRIES", "0")
+    replica1, replica2 = Subject("test-versioned", versioned=True), Subject("test-versioned", versioned=True)
+    replica1.set("cnt", 1, muted=True)
+    replica2.set("cnt", 2, muted=True)
+    replica1.store()
+    with pytest.raises(SubjectConflictError):
+        replica2.store()
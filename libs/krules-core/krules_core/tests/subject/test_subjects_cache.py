@@ -0,0 +1,83 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from dependency_injector import providers
+
+from krules_core.providers import subject_storage_factory, subjects_cache_factory, subject_factory
+from krules_core.subject import SubjectProperty
+from krules_core.subject.cache import SubjectsCache
+from krules_core.tests.subject.sqlite_storage import SQLLiteSubjectStorage
+
+
+class _CountingStorage(SQLLiteSubjectStorage):
+
+    loads = 0
+    versions = 0
+
+    def load(self):
+        _CountingStorage.loads += 1
+        return super().load()
+
+    def get_version(self):
+        _CountingStorage.versions += 1
+        return super().get_version()
+
+
+def test_subjects_cache(tmp_path):
+    dbfile = str(tmp_path / "subjects.sqlite")
+    now = [0.]
+    cache = SubjectsCache(max_size=2, ttl=60., trust=5., clock=lambda: now[0])
+    subject_storage_factory.override(providers.Factory(lambda name, **kwargs: _CountingStorage(name, dbfile)))
+    subjects_cache_factory.override(providers.Object(cache))
+    try:
+        subject = subject_factory("test-cached")
+        subject.set("config", {"level": 1}, muted=True)
+        subject.store()
+        assert _CountingStorage.loads == 1
+
+        # the first load after storing is a miss, then the snapshot is trusted: no storage access at all
+        subject = subject_factory("test-cached")
+        assert subject.get("config") == {"level": 1}
+        subject.get("config")["level"] = 2  # callers get their own copy
+        assert subject_factory("test-cached").get("config") == {"level": 1}
+        assert (_CountingStorage.loads, _CountingStorage.versions) == (2, 2)
+        assert (cache.hits, cache.misses) == (1, 2)
+
+        # past the trust window the version is checked
+        now[0] = 10.
+        assert subject_factory("test-cached").get("config") == {"level": 1}
+        assert (_CountingStorage.loads, _CountingStorage.versions) == (2, 3)
+
+        # written elsewhere (another process sharing the storage)
+        _CountingStorage("test-cached", dbfile).store(updates=[SubjectProperty("config", {"level": 3})])
+        now[0] = 20.
+        assert subject_factory("test-cached").get("config") == {"level": 3}
+        assert _CountingStorage.loads == 3
+
+        # written by this process
+        subject = subject_factory("test-cached")
+        subject.set("config", {"level": 4}, muted=True)
+        subject.store()
+        assert len(cache) == 0
+        assert subject_factory("test-cached").get("config") == {"level": 4}
+
+        # LRU eviction and TTL
+        subject_factory("test-cached-2").get_ext_props()
+        list(subject_factory("test-cached-2"))
+        list(subject_factory("test-cached-3"))
+        assert len(cache) == 2
+        now[0] = 100.
+        loads = _CountingStorage.loads
+        list(subject_factory("test-cached-3"))
+        assert _CountingStorage.loads == loads + 1
+    finally:
+        subject_storage_factory.reset_last_overriding()
+        subjects_cache_factory.reset_last_overriding()
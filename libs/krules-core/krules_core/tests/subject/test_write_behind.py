@@ -0,0 +1,140 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+import pytest
+from dependency_injector import providers
+
+from krules_core.providers import subject_storage_factory, subjects_write_behind_factory
+from krules_core.subject import SubjectProperty
+from krules_core.subject.storaged_subject import Subject
+from krules_core.subject.write_behind import WriteBehindQueue, StoreDurability
+
+
+class _SlowStorage(object):
+    """
+    Dict based storage whose writes wait to be released
+    """
+
+    data = {}
+    stores = []
+    release = threading.Event()
+    fail = False
+
+    def __init__(self, name):
+        self._subject = name
+
+    def load(self):
+        return dict(self.data.get(self._subject, {})), {}
+
+    def store(self, inserts=(), updates=(), deletes=()):
+        assert self.release.wait(5)
+        if self.fail:
+            raise ConnectionError("storage down")
+        props = self.data.setdefault(self._subject, {})
+        for prop in list(inserts) + list(updates):
+            props[prop.name] = prop.get_value()
+        for prop in deletes:
+            props.pop(prop.name, None)
+        self.stores.append((self._subject, [p.name for p in inserts], [p.name for p in updates],
+                            [p.name for p in deletes]))
+
+
+def _queue(durability):
+    _SlowStorage.data, _SlowStorage.stores, _SlowStorage.fail = {}, [], False
+    _SlowStorage.release.clear()
+    return WriteBehindQueue(workers=2, durability=durability)
+
+
+@pytest.fixture
+def queue(request):
+    queue = _queue(getattr(request, "param", StoreDurability.QUEUED))
+    subject_storage_factory.override(providers.Factory(lambda name, **kwargs: _SlowStorage(name)))
+    subjects_write_behind_factory.override(providers.Object(queue))
+    yield queue
+    _SlowStorage.release.set()
+    queue.close(timeout=5)
+    subjects_write_behind_factory.reset_last_overriding()
+    subject_storage_factory.reset_last_overriding()
+
+
+def test_coalesce(queue):
+
+    storage = _SlowStorage("test-wb")
+    first = queue.submit("test-wb", storage, inserts=[SubjectProperty("a", 1), SubjectProperty("c", 1)])
+    # the first write is in progress, the following changes wait for it and are merged
+    while not queue._writing:
+        time.sleep(.001)
+    second = queue.submit("test-wb", storage, inserts=[SubjectProperty("b", 1)])
+    assert queue.submit("test-wb", storage, updates=[SubjectProperty("b", 2), SubjectProperty("a", 2)]) is second
+    assert queue.submit("test-wb", storage, deletes=[SubjectProperty("c")]) is second
+    # a deleted property inserted again can not be merged
+    third = queue.submit("test-wb", storage, inserts=[SubjectProperty("c", 3)])
+    assert third is not second
+    other = queue.submit("test-wb-2", _SlowStorage("test-wb-2"), inserts=[SubjectProperty("a", 1)])
+
+    _SlowStorage.release.set()
+    assert queue.flush(timeout=5)
+    for future in (first, second, third, other):
+        assert future.done() and future.exception() is None
+
+    assert [s for s in _SlowStorage.stores if s[0] == "test-wb"] == [
+        ("test-wb", ["a", "c"], [], []),
+        ("test-wb", ["b"], ["a"], ["c"]),
+        ("test-wb", ["c"], [], []),
+    ]
+    assert _SlowStorage.data == {"test-wb": {"a": 2, "b": 2, "c": 3}, "test-wb-2": {"a": 1}}
+
+
+def test_read_after_write(queue):
+
+    subject = Subject("test-wb")
+    subject.set("a", 1, muted=True)
+    subject.set("b", 1, muted=True)
+    subject.store()
+    # the ack did not wait for the storage
+    assert _SlowStorage.stores == []
+
+    threading.Timer(.05, _SlowStorage.release.set).start()
+    # loading waits for the pending writes
+    assert Subject("test-wb").get("a") == 1
+    assert _SlowStorage.stores == [("test-wb", ["a", "b"], [], [])]
+
+
+def test_close(queue):
+
+    for n in range(10):
+        subject = Subject("test-wb-{}".format(n))
+        subject.set("n", n, muted=True)
+        subject.store()
+    _SlowStorage.release.set()
+    queue.close(timeout=5)
+    assert len(_SlowStorage.stores) == 10
+    assert _SlowStorage.data["test-wb-9"] == {"n": 9}
+    with pytest.raises(RuntimeError):
+        queue.submit("test-wb", _SlowStorage("test-wb"), inserts=[SubjectProperty("a", 1)])
+
+
+@pytest.mark.parametrize("queue", [StoreDurability.WRITTEN], indirect=True)
+def test_written(queue):
+
+    _SlowStorage.release.set()
+    subject = Subject("test-wb")
+    subject.set("a", 1, muted=True)
+    subject.store()
+    assert _SlowStorage.data == {"test-wb": {"a": 1}}
+
+    _SlowStorage.fail = True
+    subject.set("a", 2, muted=True)
+    with pytest.raises(ConnectionError):
+        subject.store()
@@ -0,0 +1,63 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import pytest
+from dependency_injector import providers
+
+from krules_core.codec import get_codec, encode, decode, json_codec
+from krules_core.providers import codec_factory
+from krules_core.subject import SubjectProperty
+
+VALUE = {"temp": 21.5, "readings": [1, 2, 3], "status": "ok", "tags": None, "nested": {"à": True}}
+
+
+@pytest.fixture(params=["json", "orjson", "msgpack"])
+def codec(request):
+    if request.param != "json":
+        pytest.importorskip(request.param)
+    codec = get_codec(request.param)
+    codec_factory.override(providers.Object(codec))
+    yield codec
+    codec_factory.reset_last_overriding()
+
+
+def test_roundtrip(codec):
+
+    data = encode(VALUE)
+    assert decode(data) == VALUE
+    assert codec.tag is None and isinstance(data, str) or data.startswith(codec.tag)
+    assert decode(SubjectProperty("p", lambda v: v + 1).encoded_value(1)) == 2
+    # text storages and events always get JSON
+    assert json.loads(SubjectProperty("p", VALUE).json_value()) == VALUE
+    assert json.loads(json_codec().dumps({"f": test_roundtrip}, default=lambda obj: obj.__name__)) == \
+        {"f": "test_roundtrip"}
+
+
+def test_readable_across_codecs(codec):
+
+    # written before switching codec (or by another process)
+    assert decode(json.dumps(VALUE)) == VALUE
+    assert decode(json.dumps(VALUE).encode("utf-8")) == VALUE
+    try:
+        msgpack = get_codec("msgpack")
+    except ImportError:
+        return
+    assert decode(msgpack.tag + msgpack.dumps(VALUE)) == VALUE
+
+
+def test_unknown():
+
+    with pytest.raises(ValueError):
+        get_codec("pickle")
+    with pytest.raises(ValueError):
+        decode(b"\xc1\x7f...")
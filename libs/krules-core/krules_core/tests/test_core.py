@@ -9,11 +9,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+
 import pytest
 from rx import subject as rx_subject
 
 import dependency_injector.providers as providers
-from krules_core.base_functions import Callable
+from krules_core.base_functions import Callable, RuleFunctionBase
 
 from krules_core.route.dispatcher import BaseDispatcher
 
@@ -124,3 +126,203 @@ def test_dispatch(subject, router):
         subject.name == subject.name and
         payload.get("data") == 1
     )
+
+
+def test_execution_plan(subject, router):
+    instances = []
+
+    RuleFactory.create('test-rule-plan',
+                       subscribe_to="test-plan-type",
+                       data={
+                           RuleConst.PROCESSING: [
+                               Callable(
+                                   lambda self: instances.append(self)
+                               ),
+                           ],
+                       })
+
+    router.route("test-plan-type", subject, {})
+    router.route("test-plan-type", subject, {})
+
+    # the function class is resolved once, each event gets its own instance
+    assert len(instances) == 2
+    assert instances[0] is not instances[1]
+    assert type(instances[0]) is type(instances[1])
+    assert instances[0].router is router
+
+
+def test_rule_procevents_level(subject, router):
+    from krules_core import ProcEventsLevel
+
+    proc_events = []
+    proc_events_rx_factory().subscribe(lambda x: proc_events.append(x))
+
+    RuleFactory.create('test-procevents-disabled',
+                       subscribe_to="test-procevents-level",
+                       data={},
+                       procevents_level=ProcEventsLevel.DISABLED)
+    RuleFactory.create('test-procevents-by-type',
+                       subscribe_to=["test-procevents-level", "test-procevents-level-full"],
+                       data={
+                           RuleConst.PROCESSING: [
+                               Callable(lambda self: self.payload.update({"processed": True})),
+                           ],
+                       },
+                       procevents_level={
+                           "test-procevents-level-full": ProcEventsLevel.FULL,
+                           "*": ProcEventsLevel.LIGHT,
+                       })
+
+    router.route("test-procevents-level", subject, {})
+    router.route("test-procevents-level-full", subject, {})
+
+    assert [x[RuleConst.RULENAME] for x in proc_events] == ['test-procevents-by-type'] * 2
+    light, full = proc_events
+    assert RuleConst.PAYLOAD_DIFFS not in light[RuleConst.PROCESSING][0]
+    assert full[RuleConst.PROCESSING][0][RuleConst.PAYLOAD_DIFFS][0]["path"] == "/processed"
+
+
+def test_procevent_payload_is_input(subject, router):
+    from krules_core import ProcEventsLevel
+
+    proc_events = []
+    proc_events_rx_factory().subscribe(lambda x: proc_events.append(x))
+
+    RuleFactory.create('test-procevent-payload',
+                       subscribe_to="test-procevent-payload",
+                       data={
+                           RuleConst.PROCESSING: [
+                               Callable(lambda self: self.payload["nested"].update({"value": "changed"})),
+                           ],
+                       },
+                       procevents_level=ProcEventsLevel.LIGHT)
+
+    payload = {"nested": {"value": "orig"}}
+    router.route("test-procevent-payload", subject, payload)
+
+    assert payload["nested"]["value"] == "changed"
+    assert [x[RuleConst.PAYLOAD] for x in proc_events
+            if x[RuleConst.RULENAME] == 'test-procevent-payload'] == [{"nested": {"value": "orig"}}]
+
+
+
+def test_procevent_error_is_formatted(subject, router):
+    import gc
+    import logging
+    import weakref
+    from krules_core import ProcEventsLevel
+
+    class _Error(Exception):
+        pass
+
+    errors = []
+
+    def _fail(self):
+        error = _Error("failed")
+        errors.append(weakref.ref(error))
+        raise error
+
+    RuleFactory.create('test-procevent-error',
+                       subscribe_to="test-procevent-error",
+                       data={RuleConst.PROCESSING: [Callable(_fail)]},
+                       procevents_level=ProcEventsLevel.LIGHT)
+    # the error is logged, when enabled, formatting the record
+    logging.disable(logging.ERROR)
+    try:
+        router.route("test-procevent-error", subject, {})
+    finally:
+        logging.disable(logging.NOTSET)
+    gc.collect()
+
+    # the record is kept to be replayed, the exception is not
+    assert errors[0]() is None
+    replayed = []
+    proc_events_rx_factory().subscribe(replayed.append)
+    record, = [x for x in replayed if x[RuleConst.RULENAME] == 'test-procevent-error']
+    step, = record[RuleConst.PROCESSING]
+    assert step[RuleConst.EXCEPTION].endswith("._Error")
+    assert "failed" in step[RuleConst.EXC_INFO][-1]
+
+def test_async_rule(subject, router):
+    processed = []
+
+    class WaitFor(RuleFunctionBase):
+
+        async def execute(self, event):
+            await event.wait()
+            self.payload["done"] = True
+
+    RuleFactory.create('test-async-rule',
+                       subscribe_to="test-async-type",
+                       data={
+                           RuleConst.PROCESSING: [
+                               WaitFor(lambda payload: payload["event"]),
+                               Callable(lambda self: processed.append(self.payload["n"])),
+                           ],
+                       })
+    assert RuleFactory.create('test-sync-rule', subscribe_to="test-sync-type", data={}).is_async is False
+
+    async def _route_all():
+        events = [asyncio.Event() for _ in range(3)]
+        routes = asyncio.gather(*[
+            router.route_async("test-async-type", subject, {"n": n, "event": events[n]}) for n in range(3)
+        ])
+        await asyncio.sleep(0)
+        # all of them are waiting at the same time
+        assert processed == []
+        for event in reversed(events):
+            event.set()
+        await routes
+
+    asyncio.run(_route_all())
+    assert processed == [2, 1, 0]
+
+    # sync API
+    event = asyncio.Event()
+    event.set()
+    payload = {"n": 3, "event": event}
+    router.route("test-async-type", subject, payload)
+    assert payload["done"] and processed[-1] == 3
+
+
+def test_sync_route_in_running_loop(subject, router):
+    from krules_core import ProcEventsLevel
+
+    processed = []
+
+    class Yield(RuleFunctionBase):
+
+        async def execute(self):
+            await asyncio.sleep(0)
+            processed.append(self.payload["n"])
+
+    class Fail(RuleFunctionBase):
+
+        async def execute(self):
+            await asyncio.sleep(0)
+            raise ValueError("failed")
+
+    RuleFactory.create('test-sync-route-in-loop',
+                       subscribe_to="test-sync-route-in-loop",
+                       data={
+                           RuleConst.PROCESSING: [Yield()],
+                       })
+    RuleFactory.create('test-sync-route-in-loop-error',
+                       subscribe_to="test-sync-route-in-loop-error",
+                       data={
+                           RuleConst.PROCESSING: [Fail()],
+                       },
+                       procevents_level=ProcEventsLevel.LIGHT)
+
+    async def _main():
+        # the sync API completes the rule before returning, even from inside a running loop
+        router.route("test-sync-route-in-loop", subject, {"n": 1})
+        assert processed == [1]
+        router.route("test-sync-route-in-loop-error", subject, {})
+
+    errors = []
+    proc_events_rx_factory().subscribe(lambda x: errors.append((x[RuleConst.RULENAME], x[RuleConst.GOT_ERRORS])))
+    asyncio.run(_main())
+    assert processed == [1]
+    # errors are reported as for any other rule
+    assert ('test-sync-route-in-loop-error', True) in errors
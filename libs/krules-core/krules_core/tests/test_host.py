@@ -0,0 +1,62 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from dependency_injector import providers
+
+from krules_core import RuleConst, ProcEventsLevel
+from krules_core.base_functions import Callable, Route
+from krules_core.providers import event_router_factory, event_dispatcher_factory
+from krules_core.route.dispatcher import BaseDispatcher
+from krules_core.route.host import HostRouter, LocalDispatcher
+
+
+def test_hosted_rulesets():
+    processed = []
+    dispatched = []
+
+    class _Dispatcher(BaseDispatcher):
+
+        def dispatch(self, event_type, subject, payload, **extra):
+            dispatched.append(event_type)
+
+    def _record(self):
+        processed.append((self.rule_name, self.router.name, event_router_factory() is self.router))
+
+    def _rule(name, subscribe_to, processing):
+        return {
+            RuleConst.RULENAME: name,
+            RuleConst.SUBSCRIBE_TO: subscribe_to,
+            RuleConst.RULEDATA: {RuleConst.PROCESSING: processing},
+            "procevents_level": ProcEventsLevel.DISABLED,
+        }
+
+    host = HostRouter()
+    event_router_factory.override(providers.Callable(host.get_router))
+    event_dispatcher_factory.override(providers.Object(LocalDispatcher(host, _Dispatcher())))
+    try:
+        host.add_ruleset("ruleset-a", [
+            _rule("a-on-input", "input", [Callable(_record), Route("a-output")]),
+        ])
+        host.add_ruleset("ruleset-b", [
+            _rule("b-on-a-output", "a-output", [Callable(_record), Route("b-output")]),
+        ])
+
+        assert event_router_factory() is host
+        assert host.has_handlers("a-output") and not host.has_handlers("b-output")
+        assert not host.namespaces["ruleset-a"].has_handlers("a-output")
+
+        host.route("input", "test-hosted-subject", {})
+
+        assert processed == [("a-on-input", "ruleset-a", True), ("b-on-a-output", "ruleset-b", True)]
+        # a-output went straight to ruleset-b, b-output has no local subscribers
+        assert dispatched == ["b-output"]
+    finally:
+        event_router_factory.reset_override()
+        event_dispatcher_factory.reset_override()
@@ -0,0 +1,63 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import pytest
+from dependency_injector import providers
+from rx import subject as rx_subject
+
+from krules_core import RuleConst
+from krules_core.base_functions import Filter, Callable
+from krules_core.core import RuleFactory
+from krules_core.metrics import RulesMetrics, RuleResult
+from krules_core.providers import event_router_factory, proc_events_rx_factory, metrics_factory
+
+
+@pytest.fixture
+def metrics():
+    event_router_factory().unregister_all()
+    proc_events_rx_factory.override(providers.Singleton(rx_subject.ReplaySubject))
+    metrics = RulesMetrics(enabled=True, buckets=(.1, 1.))
+    metrics_factory.override(providers.Object(metrics))
+    yield metrics
+    metrics_factory.reset_override()
+    event_router_factory().unregister_all()
+
+
+def test_rules_metrics(metrics):
+    def _fail(self):
+        raise Exception("failed")
+
+    RuleFactory.create('test-metrics',
+                       subscribe_to="test-metrics-type",
+                       data={
+                           RuleConst.FILTERS: [Filter(lambda payload: payload["pass"])],
+                           RuleConst.PROCESSING: [Callable(lambda self: None)],
+                       })
+    RuleFactory.create('test-metrics-error',
+                       subscribe_to="test-metrics-type",
+                       data={RuleConst.PROCESSING: [Callable(_fail)]})
+
+    router = event_router_factory()
+    router.route("test-metrics-type", "test-subject", {"pass": True})
+    router.route("test-metrics-type", "test-subject", {"pass": False})
+    metrics.disable()
+    router.route("test-metrics-type", "test-subject", {"pass": True})
+
+    assert metrics.get_rule_results('test-metrics') == {RuleResult.PASSED: 1, RuleResult.FILTERED: 1}
+    assert metrics.get_rule_results('test-metrics-error') == {RuleResult.ERROR: 2}
+    assert metrics.get_rule_histogram('test-metrics').count == 2
+    assert metrics.get_function_histogram(RuleConst.FILTERS, "Filter").count == 2
+    assert metrics.get_function_histogram(RuleConst.PROCESSING, "_CallableRuleFunction").count == 1
+
+    text = metrics.render()
+    assert '# TYPE krules_rule_duration_seconds histogram' in text
+    assert 'krules_rule_duration_seconds_bucket{rule="test-metrics",le="+Inf"} 2' in text
+    assert 'krules_rule_results_total{rule="test-metrics-error",result="error"} 2' in text
+    assert 'krules_function_duration_seconds_count{section="filters",function="Filter"} 2' in text
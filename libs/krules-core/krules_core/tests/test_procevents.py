@@ -0,0 +1,99 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from datetime import datetime, timedelta
+
+import pytest
+from rx.scheduler import ImmediateScheduler
+
+from krules_core.procevents import BoundedReplaySubject, DropPolicy, LazyRecord, lazy
+
+
+class _Clock(ImmediateScheduler):
+
+    def __init__(self):
+        super().__init__()
+        self._now = datetime(2020, 1, 1)
+
+    @property
+    def now(self):
+        return self._now
+
+    def advance(self, seconds):
+        self._now += timedelta(seconds=seconds)
+
+
+def _replayed(rx):
+    received = []
+    rx.subscribe(lambda x: received.append(x)).dispose()
+    return received
+
+
+def test_lazy_record():
+    calls = []
+    record = LazyRecord({"name": "rule", "payload": lazy(lambda: calls.append(1) or {"k": 1})})
+
+    assert record["name"] == "rule"
+    assert calls == []
+    assert record.to_dict() == {"name": "rule", "payload": {"k": 1}}
+    assert record["payload"] == {"k": 1}
+    assert calls == [1]
+
+
+def test_bounded_drop_oldest():
+    rx = BoundedReplaySubject(buffer_size=3)
+    live = []
+    rx.subscribe(lambda x: live.append(x))
+    for i in range(5):
+        rx.on_next(i)
+
+    assert live == [0, 1, 2, 3, 4]
+    assert _replayed(rx) == [2, 3, 4]
+    assert rx.dropped == 2
+
+
+def test_bounded_drop_newest():
+    rx = BoundedReplaySubject(buffer_size=3, policy=DropPolicy.DROP_NEWEST)
+    for i in range(5):
+        rx.on_next(i)
+
+    assert _replayed(rx) == [0, 1, 2]
+    assert rx.dropped == 2
+
+    with pytest.raises(ValueError):
+        BoundedReplaySubject(policy="block")
+
+
+def test_bounded_window():
+    clock = _Clock()
+    rx = BoundedReplaySubject(window=timedelta(seconds=10), scheduler=clock)
+    rx.on_next(0)
+    clock.advance(5)
+    rx.on_next(1)
+    clock.advance(6)
+    rx.on_next(2)
+
+    assert _replayed(rx) == [1, 2]
+    assert rx.expired == 1
+    assert rx.dropped == 0
+
+
+def test_bounded_from_env(monkeypatch):
+    monkeypatch.setenv("PROCEVENTS_BUFFER_SIZE", "2")
+    monkeypatch.setenv("PROCEVENTS_DROP_POLICY", DropPolicy.DROP_NEWEST)
+    rx = BoundedReplaySubject.from_env()
+    assert rx.buffer_size == 2
+    assert rx.policy == DropPolicy.DROP_NEWEST
+
+    monkeypatch.setenv("PROCEVENTS_BUFFER_SIZE", "0")
+    monkeypatch.setenv("PROCEVENTS_BUFFER_WINDOW", "30")
+    rx = BoundedReplaySubject.from_env()
+    assert rx.window == timedelta(seconds=30)
+    assert len(_replayed(rx)) == 0
@@ -2,13 +2,22 @@
 from rx import subject as rx_subject
 
 from dependency_injector import providers
-from krules_core.providers import event_router_factory, proc_events_rx_factory
+from krules_core.providers import event_router_factory, proc_events_rx_factory, subject_storage_factory, \
+    subject_factory, configs_factory, event_dispatcher_factory
+from krules_core.route.dispatcher import BaseDispatcher
+from krules_core.subject.empty_storage import EmptySubjectStorage
+from krules_core.subject import PayloadConst
 
 from krules_core.core import RuleFactory
-from krules_core import RuleConst
+from krules_core import RuleConst, ProcEventsLevel, ConfigKeyConst, event_types
+from krules_core.base_functions import Callable, Filter, OnSubjectPropertyChanged, SubjectNameMatch, PayloadMatchOne
+from krules_core.route.router import EventRouter
+from krules_core.route.cascade import CascadeLimitError
 
 from datetime import datetime
+import contextvars
 import logging
+import threading
 
 def _assert(expr, msg="test failed"):
     assert expr, msg
@@ -43,3 +52,296 @@ def test_router():
     logging.getLogger().debug("######### {}".format(end_time-start_time))
 
     assert router.unregister_all() == 1, "Expected 1 element"
+
+
+def test_fanout():
+    request_id = contextvars.ContextVar("request_id")
+    router = EventRouter(fanout_workers=4)
+    event_router_factory.override(providers.Object(router))
+    try:
+        barrier = threading.Barrier(3, timeout=5)
+        seen = []
+
+        def _independent(self):
+            barrier.wait()  # it would time out if they did not run concurrently
+            seen.append((self.rule_name, request_id.get(), threading.current_thread().name))
+
+        for n in range(3):
+            RuleFactory.create('test-fanout-independent-{}'.format(n),
+                               subscribe_to="test-fanout",
+                               data={RuleConst.PROCESSING: [Callable(_independent)]},
+                               independent=True)
+        for n in range(2):
+            RuleFactory.create('test-fanout-ordered-{}'.format(n),
+                               subscribe_to="test-fanout",
+                               data={RuleConst.PROCESSING: [Callable(lambda self: seen.append(self.rule_name))]})
+
+        request_id.set("req-1")
+        router.route("test-fanout", "test-subject", {})
+
+        # all rules completed before returning
+        assert [x for x in seen if isinstance(x, str)] == ['test-fanout-ordered-0', 'test-fanout-ordered-1']
+        independent = [x for x in seen if isinstance(x, tuple)]
+        assert len(independent) == 3
+        for _, _request_id, thread_name in independent:
+            assert _request_id == "req-1"
+            assert thread_name.startswith("krules-fanout")
+    finally:
+        event_router_factory.reset_override()
+
+
+def test_route_many():
+    calls = []
+
+    class _CountingStorage(EmptySubjectStorage):
+
+        def __init__(self, name):
+            self.name = name
+
+        def load(self):
+            calls.append(("load", self.name))
+            return {}, {}
+
+        def store(self, inserts=[], updates=[], deletes=[]):
+            calls.append(("store", self.name, sorted(p.name for p in inserts)))
+
+    subject_storage_factory.override(providers.Factory(lambda name, **kwargs: _CountingStorage(name)))
+    router = event_router_factory()
+    router.unregister_all()
+    try:
+        RuleFactory.create('test-route-many',
+                           subscribe_to="test-route-many",
+                           data={RuleConst.PROCESSING: [
+                               Callable(lambda self: self.subject.set("p{}".format(self.payload["n"]), True, muted=True))
+                           ]})
+
+        results = router.route_many([
+            ("test-route-many", "test-batch-a", {"n": 1}),
+            ("test-route-many", "test-batch-b", {"n": 2}),
+            ("test-route-many", "test-batch-a", {"n": 3}),
+        ])
+
+        assert len(results) == 3
+        assert calls == [
+            ("load", "test-batch-a"),
+            ("load", "test-batch-b"),
+            ("store", "test-batch-a", ["p1", "p3"]),
+            ("store", "test-batch-b", ["p2"]),
+        ]
+    finally:
+        subject_storage_factory.reset_override()
+        router.unregister_all()
+
+
+def test_static_filters_index():
+    router = event_router_factory()
+    router.unregister_all()
+    processed = []
+
+    def _create(name, filters, procevents_level=ProcEventsLevel.DISABLED):
+        RuleFactory.create(name,
+                           subscribe_to=event_types.SUBJECT_PROPERTY_CHANGED,
+                           data={
+                               RuleConst.FILTERS: filters,
+                               RuleConst.PROCESSING: [Callable(lambda self: processed.append(self.rule_name))],
+                           },
+                           procevents_level=procevents_level)
+
+    _create("on-a", [OnSubjectPropertyChanged("a")])
+    _create("on-b-for-users", [OnSubjectPropertyChanged("b"), SubjectNameMatch(r"^user\|")])
+    # not guarded, PayloadMatchOne reads what SubjectNameMatch writes
+    _create("on-user-1", [SubjectNameMatch(r"^user\|(?P<id>.+)"), PayloadMatchOne("$.subject_match.id", "1")])
+    _create("on-a-admin", [OnSubjectPropertyChanged("a"), PayloadMatchOne("$.value", "admin")])
+    _create("on-any", [Filter(True), OnSubjectPropertyChanged("b")])
+    _create("on-b-traced", [OnSubjectPropertyChanged("b")], procevents_level=ProcEventsLevel.LIGHT)
+
+    def _candidates(prop):
+        payload = {PayloadConst.PROPERTY_NAME: prop, PayloadConst.VALUE: 1, PayloadConst.OLD_VALUE: None}
+        return [rule.name for rule, _ in router._get_entries(event_types.SUBJECT_PROPERTY_CHANGED,
+                                                             router._get_rules(event_types.SUBJECT_PROPERTY_CHANGED),
+                                                             payload)]
+
+    assert _candidates("a") == ["on-a", "on-user-1", "on-a-admin", "on-any", "on-b-traced"]
+    assert _candidates("b") == ["on-b-for-users", "on-user-1", "on-any", "on-b-traced"]
+    assert _candidates("c") == ["on-user-1", "on-any", "on-b-traced"]
+
+    for subject, prop, value in (("user|1", "a", "admin"), ("user|1", "b", 1), ("device|1", "b", 1),
+                                 ("device|1", "a", 0)):
+        processed.clear()
+        router.route(event_types.SUBJECT_PROPERTY_CHANGED, subject,
+                     {PayloadConst.PROPERTY_NAME: prop, PayloadConst.VALUE: value, PayloadConst.OLD_VALUE: None})
+        expected = {
+            ("user|1", "a"): ["on-a", "on-user-1", "on-a-admin"],
+            ("user|1", "b"): ["on-b-for-users", "on-user-1", "on-any", "on-b-traced"],
+            ("device|1", "b"): ["on-any", "on-b-traced"],
+            ("device|1", "a"): ["on-a"],
+        }[(subject, prop)]
+        assert processed == expected
+
+    router.unregister_all()
+
+
+def test_routing_table():
+    router = event_router_factory()
+    router.unregister_all()
+    processed = []
+
+    for name, subscribe_to in (("exact", "mutate-pod"), ("any", "*"), ("prefix", "mutate-*"),
+                               ("longer-prefix", "mutate-p*"), ("glob", "*-pod")):
+        RuleFactory.create(name,
+                           subscribe_to=subscribe_to,
+                           data={RuleConst.PROCESSING: [
+                               Callable(lambda self: processed.append(self.rule_name))
+                           ]})
+
+    for _ in range(3):
+        processed.clear()
+        router.route("mutate-pod", "test-subject", {})
+        # wildcard rules are merged once, they do not pile up at each event
+        assert processed == ["exact", "longer-prefix", "prefix", "glob", "any"]
+
+    processed.clear()
+    router.route("mutate-service", "test-subject", {})
+    assert processed == ["prefix", "any"]
+
+    router.unregister("*")
+    assert router._get_rules("validate-service") is None
+
+    router.unregister_all()
+
+
+def test_published_properties():
+    router = event_router_factory()
+    router.unregister_all()
+    processed = []
+    dispatched = []
+
+    class _Dispatcher(BaseDispatcher):
+
+        def dispatch(self, event_type, subject, payload, **extra):
+            dispatched.append((event_type, payload[PayloadConst.PROPERTY_NAME]))
+
+    event_dispatcher_factory.override(providers.Singleton(_Dispatcher))
+    configs_factory.override(providers.Singleton(lambda: {ConfigKeyConst.PUBLISHED_SUBJECT_PROPERTIES: ["public-*"]}))
+    try:
+        RuleFactory.create('test-published-properties',
+                           subscribe_to=event_types.SUBJECT_PROPERTY_CHANGED,
+                           data={
+                               RuleConst.FILTERS: [OnSubjectPropertyChanged("watched")],
+                               RuleConst.PROCESSING: [Callable(
+                                   lambda self: processed.append(self.payload[PayloadConst.PROPERTY_NAME])
+                               )],
+                           },
+                           procevents_level=ProcEventsLevel.DISABLED)
+        assert router.has_handlers(event_types.SUBJECT_PROPERTY_CHANGED)
+        assert router.has_handlers(event_types.SUBJECT_PROPERTY_CHANGED, "watched")
+        assert not router.has_handlers(event_types.SUBJECT_PROPERTY_CHANGED, "internal")
+        assert not router.has_handlers(event_types.SUBJECT_PROPERTY_DELETED, "watched")
+
+        subject = subject_factory("test-published-properties")
+        subject.watched = 1
+        subject.internal = 1
+        assert dispatched == []
+        # published, dispatched although the event type has local handlers
+        subject.set("public-state", 1)
+        assert dispatched == [(event_types.SUBJECT_PROPERTY_CHANGED, "public-state")]
+        subject.delete("public-state")
+        assert dispatched[1:] == [(event_types.SUBJECT_PROPERTY_DELETED, "public-state")]
+        subject.delete("internal")
+
+        assert processed == ["watched"]
+        assert len(dispatched) == 2
+    finally:
+        configs_factory.reset_override()
+        event_dispatcher_factory.reset_override()
+        router.unregister_all()
+
+
+def test_queued_events():
+    router = EventRouter(queued_events=True, max_cascade_depth=2000, max_event_repeats=5)
+    event_router_factory.override(providers.Object(router))
+    errors = []
+    stats = []
+    try:
+        def _next(self):
+            value = self.payload[PayloadConst.VALUE]
+            if value < 1500:
+                # far beyond the recursion limit if routed recursively
+                self.subject.set("n", value + 1)
+            stats.append(router.current_request().max_depth)
+
+        def _flip(self):
+            try:
+                self.subject.set("flag", not self.payload[PayloadConst.VALUE])
+            except CascadeLimitError as ex:
+                errors.append(ex)
+
+        for name, prop, func in (("test-queued-chain", "n", _next), ("test-queued-loop", "flag", _flip)):
+            RuleFactory.create(name,
+                               subscribe_to=event_types.SUBJECT_PROPERTY_CHANGED,
+                               data={
+                                   RuleConst.FILTERS: [OnSubjectPropertyChanged(prop)],
+                                   RuleConst.PROCESSING: [Callable(func)],
+                               },
+                               procevents_level=ProcEventsLevel.DISABLED)
+
+        subject = subject_factory("test-queued-events")
+        router.route(event_types.SUBJECT_PROPERTY_CHANGED, subject,
+                     {PayloadConst.PROPERTY_NAME: "n", PayloadConst.VALUE: 0, PayloadConst.OLD_VALUE: None})
+        assert subject.get("n") == 1500
+        assert stats[-1] == 1500
+        assert router.current_request() is None
+
+        subject.set("flag", True)
+        assert len(errors) == 1
+    finally:
+        event_router_factory.reset_override()
+
+
+def test_subject_scope():
+    from krules_core.subject.scope import subject_scope
+    from krules_core.subject.storaged_subject import Subject
+
+    router = EventRouter()
+    event_router_factory.override(providers.Object(router))
+    seen = []
+    try:
+        def _lookup(self):
+            seen.append((subject_factory(self.subject.name), subject_factory("test-scope-other")))
+
+        for name in ("test-scope-first", "test-scope-second"):
+            RuleFactory.create(name,
+                               subscribe_to="test-scope-event",
+                               data={RuleConst.PROCESSING: [Callable(_lookup)]},
+                               procevents_level=ProcEventsLevel.DISABLED)
+
+        subject = subject_factory("test-scope-subject")
+        router.route("test-scope-event", subject, {})
+        (same, other), (same_again, other_again) = seen
+        assert same is subject and same_again is subject
+        assert other is other_again
+        # outside of the routed event
+        assert subject_factory("test-scope-other") is not other
+
+        with subject_scope() as scope:
+            router.route("test-scope-event", "test-scope-subject", {})
+            assert seen[2][0] is seen[3][0] is subject_factory("test-scope-subject")
+            assert [s.name for s in scope] == ["test-scope-subject", "test-scope-other"]
+
+        with subject_scope() as scope:
+            subject = subject_factory("test-scope-args", use_cache_default=False)
+            assert subject_factory("test-scope-args") is subject
+            assert subject_factory("test-scope-args", use_cache_default=False, event_data={}) is subject
+            # different arguments, not the scoped instance
+            cached = subject_factory("test-scope-args", use_cache_default=True)
+            assert cached is not subject and cached._use_cache
+            # per call metadata
+            assert subject_factory("test-scope-args", event_info={"id": 1}) is subject
+            assert subject_factory("test-scope-args", deferred_events=None) is subject
+            # registered as an instance, as the router does
+            other = scope.add(Subject("test-scope-other", use_cache_default=False))
+            assert subject_factory("test-scope-other", event_info={"id": 1}, use_cache_default=False) is other
+            assert subject_factory("test-scope-other", deferred_events=False) is other
+            assert subject_factory("test-scope-other", use_cache_default=True) is not other
+    finally:
+        event_router_factory.reset_override()
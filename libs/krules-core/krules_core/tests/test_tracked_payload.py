@@ -0,0 +1,114 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import copy
+import json
+
+import jsonpatch
+
+from krules_core.tracked_payload import PayloadTracker
+
+
+def test_patches_follow_changes():
+    payload = {
+        "k1": "val1",
+        "k2": {"k2a": 1, "k2b": {"a": 1, "b": 2}},
+        "k3": [1, {"x": 1}],
+        "a/b": 0,
+    }
+    initial = copy.deepcopy(payload)
+    tracker = PayloadTracker(payload)
+    tracked = tracker.payload
+
+    tracked["k1"] = 0
+    tracked["k2"]["k2b"].update({"b": 3, "c": 4})
+    tracked.setdefault("k4", []).append("new")
+    tracked["k3"][1]["x"] = 2
+    tracked["k3"].insert(0, 0)
+    del tracked["a/b"]
+    tracked.pop("k2")["k2a"] = "not tracked anymore"
+
+    patches = tracker.pop_patches()
+    assert {"op": "replace", "path": "/k1", "value": 0} in patches
+    assert {"op": "add", "path": "/k2/k2b/c", "value": 4} in patches
+    assert {"op": "add", "path": "/k4/0", "value": "new"} in patches
+    assert {"op": "remove", "path": "/a~1b"} in patches
+    assert tracker.pop_patches() == []
+
+    # changes are applied to the original payload too
+    assert payload == tracked
+    assert payload == jsonpatch.apply_patch(initial, patches)
+    assert json.loads(json.dumps(tracked)) == payload
+    assert type(copy.deepcopy(tracked)) is dict
+
+
+def test_tracked_values_are_copied():
+    tracker = PayloadTracker({})
+    value = {"a": 1}
+    tracker.payload["k"] = value
+    value["a"] = 2
+
+    patch, = tracker.pop_patches()
+    assert patch["value"] == {"a": 1}
+    assert tracker.payload["k"]["a"] == 2
+
+
+def test_nested_items_are_wrapped_once():
+    tracker = PayloadTracker({"d": {"l": [{"x": 1}, [1]]}})
+    tracked = tracker.payload
+
+    assert tracked["d"] is tracked["d"]
+    assert tracked["d"]["l"][0] is tracked["d"]["l"][0]
+    assert tracked["d"]["l"][-1] is tracked["d"]["l"][1]
+
+    tracked["d"]["l"][0]["x"] = 2
+    tracked["d"]["l"][0]["y"] = 3
+    tracked["d"]["l"].insert(0, {"x": 0})
+    # moved, wrapped again with its new path
+    tracked["d"]["l"][1]["x"] = 4
+    assert tracker.pop_patches() == [
+        {"op": "replace", "path": "/d/l/0/x", "value": 2},
+        {"op": "add", "path": "/d/l/0/y", "value": 3},
+        {"op": "add", "path": "/d/l/0", "value": {"x": 0}},
+        {"op": "replace", "path": "/d/l/1/x", "value": 4},
+    ]
+    assert tracked == {"d": {"l": [{"x": 0}, {"x": 4, "y": 3}, [1]]}}
+
+
+def test_paths_follow_moved_items():
+    payload = {"l": [{"a": 1}, {"b": 2}, {"c": [{"d": 3}]}]}
+    initial = copy.deepcopy(payload)
+    tracker = PayloadTracker(payload)
+    tracked = tracker.payload
+
+    item = tracked["l"][1]
+    nested = tracked["l"][2]["c"][0]
+    tracked["l"].insert(0, {"z": 0})
+    item["x"] = 1
+    nested["e"] = 4
+    removed = tracked["l"][1]
+    tracked["l"].pop(1)
+    item["y"] = 2
+    nested["f"] = 5
+    # not in the payload anymore
+    removed["w"] = 0
+    tracked["l"].sort(key=len)
+    item["not tracked"] = True
+
+    patches = tracker.pop_patches()
+    assert {"op": "add", "path": "/l/2/x", "value": 1} in patches
+    assert {"op": "add", "path": "/l/3/c/0/e", "value": 4} in patches
+    assert {"op": "add", "path": "/l/1/y", "value": 2} in patches
+    assert {"op": "add", "path": "/l/2/c/0/f", "value": 5} in patches
+    assert not [patch for patch in patches if patch["path"].endswith("/w")]
+    assert jsonpatch.apply_patch(initial, patches) == {
+        "l": [{"z": 0}, {"c": [{"d": 3, "e": 4, "f": 5}]}, {"b": 2, "x": 1, "y": 2}]
+    }
+    assert payload["l"][2] == {"b": 2, "x": 1, "y": 2, "not tracked": True}
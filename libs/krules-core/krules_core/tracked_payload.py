@@ -0,0 +1,310 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Payload wrappers recording each change as a JSON patch operation (RFC 6902) while it happens.
+
+Wrappers are dict/list subclasses holding a shallow copy of the wrapped object, every change is applied
+both to the copy and to the wrapped object (so the original payload is always up to date) and recorded
+in the tracker. Nested dictionaries and lists are wrapped on access and know their parent, so that their
+path follows the items moving in the lists holding them. Changes to items removed from the payload (or
+replaced) through a wrapper obtained before are applied but not recorded.
+"""
+import copy
+
+
+def _escape(key):
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def _unwrap(value):
+    if isinstance(value, (TrackedDict, TrackedList)):
+        return value._target
+    return value
+
+
+def _path(node):
+    """
+    Current path of a wrapper, None once detached from the payload
+    """
+    keys = []
+    while node._parent is not None:
+        keys.append(node._key)
+        node = node._parent
+    if node._key is None:
+        return None
+    return "".join("/{}".format(_escape(key)) for key in reversed(keys))
+
+
+def _detach(child):
+    if child is not None:
+        child._parent = child._key = None
+
+
+class PayloadTracker(object):
+    """
+    Keeps the patch operations applied to a payload through its tracked version
+    """
+
+    def __init__(self, payload, copy_value=copy.deepcopy):
+        self._patches = []
+        self._copy_value = copy_value
+        self.payload = TrackedDict(payload, self, None, "")
+
+    def record(self, op, path, value=None):
+        if op == "remove":
+            self._patches.append({"op": op, "path": path})
+        else:
+            self._patches.append({"op": op, "path": path, "value": self._copy_value(value)})
+
+    def pop_patches(self):
+        """
+        Returns the operations recorded since the last call
+        """
+        patches, self._patches = self._patches, []
+        return patches
+
+
+def _wrap(value, tracker, parent, key):
+    if isinstance(value, (TrackedDict, TrackedList)) and value._tracker is tracker:
+        return value
+    if isinstance(value, dict):
+        return TrackedDict(value, tracker, parent, key)
+    if isinstance(value, list):
+        return TrackedList(value, tracker, parent, key)
+    return value
+
+
+class _Tracked(object):
+    # the root has no parent and "" as key, detached wrappers have neither
+
+    __slots__ = ()
+
+    def _replace_child(self, key, value):
+        child = self._children.get(key)
+        if child is not None and child._target is not value:
+            _detach(self._children.pop(key))
+
+    def _record(self, op, key=None, value=None):
+        path = _path(self)
+        if path is None:
+            return
+        if key is not None:
+            path = "{}/{}".format(path, _escape(key))
+        self._tracker.record(op, path, value)
+
+
+class TrackedDict(_Tracked, dict):
+
+    __slots__ = ("_target", "_tracker", "_parent", "_key", "_children")
+
+    def __init__(self, target, tracker, parent, key):
+        super().__init__(target)
+        self._target = target
+        self._tracker = tracker
+        self._parent = parent
+        self._key = key
+        self._children = {}
+
+    def __reduce_ex__(self, protocol):
+        # copies and pickles are plain dictionaries
+        return dict, (dict(self),)
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if not isinstance(value, (dict, list)):
+            return value
+        child = self._children.get(key)
+        if child is None or child._target is not value:
+            child = _wrap(value, self._tracker, self, key)
+            self._children[key] = child
+        return child
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+    def __setitem__(self, key, value):
+        value = _unwrap(value)
+        op = key in self and "replace" or "add"
+        super().__setitem__(key, value)
+        self._target[key] = value
+        self._replace_child(key, value)
+        self._record(op, key, value)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        del self._target[key]
+        _detach(self._children.pop(key, None))
+        self._record("remove", key)
+
+    def pop(self, key, *default):
+        if key not in self:
+            return super().pop(key, *default)
+        value = super().__getitem__(key)
+        del self[key]
+        return value
+
+    def popitem(self):
+        key = next(reversed(self.keys()))
+        return key, self.pop(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        for key in list(self.keys()):
+            del self[key]
+
+
+class TrackedList(_Tracked, list):
+
+    __slots__ = ("_target", "_tracker", "_parent", "_key", "_children")
+
+    def __init__(self, target, tracker, parent, key):
+        super().__init__(target)
+        self._target = target
+        self._tracker = tracker
+        self._parent = parent
+        self._key = key
+        # index -> wrapper, kept in line with the items when they move
+        self._children = {}
+
+    def __reduce_ex__(self, protocol):
+        return list, (list.copy(self),)
+
+    def _index(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("list index out of range")
+        return index
+
+    def _shift(self, index, delta):
+        children = {}
+        for i, child in self._children.items():
+            if i >= index:
+                i = child._key = i + delta
+            children[i] = child
+        self._children = children
+
+    def _replaced(self):
+        # operations involving more items are recorded as a replacement of the whole list
+        self._target[:] = list.copy(self)
+        for child in self._children.values():
+            _detach(child)
+        self._children = {}
+        self._record("replace", value=list.copy(self))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return super().__getitem__(index)
+        index = self._index(index)
+        value = super().__getitem__(index)
+        if not isinstance(value, (dict, list)):
+            return value
+        child = self._children.get(index)
+        if child is None or child._target is not value:
+            child = _wrap(value, self._tracker, self, index)
+            self._children[index] = child
+        return child
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            super().__setitem__(index, [_unwrap(v) for v in value])
+            self._replaced()
+            return
+        index = self._index(index)
+        value = _unwrap(value)
+        super().__setitem__(index, value)
+        self._target[index] = value
+        self._replace_child(index, value)
+        self._record("replace", index, value)
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            super().__delitem__(index)
+            self._replaced()
+            return
+        index = self._index(index)
+        super().__delitem__(index)
+        del self._target[index]
+        _detach(self._children.pop(index, None))
+        self._shift(index + 1, -1)
+        self._record("remove", index)
+
+    def insert(self, index, value):
+        value = _unwrap(value)
+        if index < 0:
+            index = max(index + len(self), 0)
+        index = min(index, len(self))
+        super().insert(index, value)
+        self._target.insert(index, value)
+        self._shift(index, 1)
+        self._record("add", index, value)
+
+    def append(self, value):
+        self.insert(len(self), value)
+
+    def extend(self, values):
+        for value in list(values):
+            self.append(value)
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __imul__(self, n):
+        super().__imul__(n)
+        self._replaced()
+        return self
+
+    def pop(self, index=-1):
+        index = self._index(index)
+        value = super().__getitem__(index)
+        del self[index]
+        return value
+
+    def remove(self, value):
+        del self[self.index(value)]
+
+    def clear(self):
+        super().clear()
+        self._replaced()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._replaced()
+
+    def reverse(self):
+        super().reverse()
+        self._replaced()
@@ -13,10 +13,10 @@ import logging
 import uuid
 from datetime import datetime
 import pytz
-import json
 import inspect
 
 
+from krules_core.codec import json_codec
 from krules_core.subject import PayloadConst
 
 from krules_core.providers import subject_factory
@@ -31,13 +31,10 @@ from cloudevents.sdk.event import v1
 import requests
 
 
-class _JSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if inspect.isfunction(obj):
-            return obj.__name__
-        elif isinstance(obj, object):
-            return str(type(obj))
-        return json.JSONEncoder.default(self, obj)
+def _json_default(obj):
+    if inspect.isfunction(obj):
+        return obj.__name__
+    return str(type(obj))
 
 
 class CloudEventsDispatcher(BaseDispatcher):
@@ -75,7 +72,7 @@ class CloudEventsDispatcher(BaseDispatcher):
 
         m = marshaller.NewHTTPMarshaller([binary.NewBinaryHTTPCloudEventConverter()])
 
-        headers, body = m.ToRequest(event, converters.TypeBinary, lambda x: json.dumps(x, cls=_JSONEncoder))
+        headers, body = m.ToRequest(event, converters.TypeBinary, lambda x: json_codec().dumps(x, default=_json_default))
 
         if "ce-datacontenttype" in headers:
             del headers["ce-datacontenttype"]
@@ -1,3 +1,4 @@
+import functools
 import importlib
 import os
 import socket
@@ -8,7 +9,9 @@ from dependency_injector import providers
 from rx import subject
 
 from krules_core import RuleConst
+from krules_core.codec import get_codec
 from krules_core.event_types import format_event_type
+from krules_core.procevents import LazyRecord
 from krules_core.exceptions_dumpers import ExceptionDumperBase, RequestsHTTPErrorDumper
 from krules_core.providers import (
     configs_factory,
@@ -17,8 +20,10 @@ from krules_core.providers import (
     event_router_factory,
     event_dispatcher_factory,
     exceptions_dumpers_factory,
+    codec_factory,
 )
 from krules_core.route.router import DispatchPolicyConst, EventRouter
+from krules_core.route.host import HostRouter, LocalDispatcher
 from krules_core.utils import load_rules_from_rulesdata, get_source
 
 config_base_path = os.environ.get("KRULES_CONFIG_BASE_PATH", "/krules/config")
@@ -53,24 +58,52 @@ def publish_proc_events_errors(result, debug=False):
     publish_proc_events_filtered(result, "got_errors=true", lambda x: x is not None, debug)
 
 
-def publish_proc_events_filtered(result, jp_expr, expt_value, debug=False):
-    if jp_expr is not None:
-        if not isinstance(jp_expr, list):
-            jp_expr = [jp_expr]
-        for expr in jp_expr:
+@functools.lru_cache(maxsize=None)
+def _parse_proc_events_expr(expr):
+    return jp.parse(f"$[?({expr})]")
+
+
+def proc_events_filter(jp_expr, expt_value):
+    """
+    Compile the given jsonpath expressions (ANDed) into a predicate to be applied to procevents.
+    Procevents are lazy records, the predicate only reads the fields involved in the expressions
+    """
+    if jp_expr is None:
+        return lambda result: True
+    if not isinstance(jp_expr, list):
+        jp_expr = [jp_expr]
+    parsed = [_parse_proc_events_expr(expr) for expr in jp_expr]
+
+    def _match(result):
+        for expr in parsed:
+            matches = expr.find([result])
+            match = matches[0].value if matches else None
             if callable(expt_value):
-                _pass = expt_value(jp.match1(f"$[?({expr})]", [result]))
+                _pass = expt_value(match)
             else:
-                _pass = (jp.match1(f"$[?({expr})]", [result]) == expt_value)
+                _pass = (match == expt_value)
             if not _pass:
-                return
+                return False
+        return True
 
-    data = result
+    return _match
+
+
+def publish_proc_events_filtered(result, jp_expr, expt_value, debug=False):
+    if not proc_events_filter(jp_expr, expt_value)(result):
+        return
+    publish_proc_event(result, debug)
+
+
+def publish_proc_event(result, debug=False):
+
+    # only accepted procevents are copied
+    data = result.to_dict() if isinstance(result, LazyRecord) else result
 
     event_info = data["event_info"]
     result_subject = subject_factory(data[RuleConst.RULENAME], event_info=event_info)
 
-    if debug and result["type"] != RULE_PROC_EVENT:
+    if debug and data["type"] != RULE_PROC_EVENT:
         dispatch_policy = DispatchPolicyConst.NEVER
     else:
         dispatch_policy = DispatchPolicyConst.DIRECT
@@ -93,23 +126,48 @@ def init():
         providers.Singleton(lambda: krules_settings)
     )
 
-    event_router_factory.override(
-        providers.Singleton(lambda: EventRouter())
-    )
+    # serialization of subject properties and events: json (default), orjson or msgpack
+    codec = os.environ.get("KRULES_CODEC")
+    if codec:
+        codec_factory.override(
+            providers.Object(get_codec(codec.lower()))
+        )
+
+    # host mode: several rulesets (comma separated module names) in the same process
+    rulesets = [name.strip() for name in os.environ.get("KRULES_RULESETS", "").split(",") if name.strip()]
+    host = None
+    if rulesets:
+        host = HostRouter()
+        event_router_factory.override(
+            providers.Callable(host.get_router)
+        )
+    else:
+        event_router_factory.override(
+            providers.Singleton(lambda: EventRouter())
+        )
 
     exceptions_dumpers = exceptions_dumpers_factory()
     exceptions_dumpers.set(ExceptionDumperBase)
     exceptions_dumpers.set(RequestsHTTPErrorDumper)
 
     from krules_cloudevents.route.dispatcher import CloudEventsDispatcher
-    event_dispatcher_factory.override(
-        providers.Singleton(lambda: CloudEventsDispatcher
-            (
-                _get_dispatch_url,
-                get_source()
+    if host is not None:
+        event_dispatcher_factory.override(
+            providers.Singleton(lambda: LocalDispatcher(
+                host,
+                CloudEventsDispatcher(_get_dispatch_url, get_source()),
+                forward_delivered=os.environ.get("KRULES_HOST_FORWARD_DELIVERED", "0").lower() in ("1", "true", "yes")
+            ))
+        )
+    else:
+        event_dispatcher_factory.override(
+            providers.Singleton(lambda: CloudEventsDispatcher
+                (
+                    _get_dispatch_url,
+                    get_source()
+                )
             )
         )
-    )
 
     try:
         import env
@@ -126,20 +184,24 @@ def init():
         if not ex.name == "__init__":
             raise ex
 
-    try:
-        m_rules = importlib.import_module("ruleset")
-        load_rules_from_rulesdata(m_rules.rulesdata)
-    except ModuleNotFoundError as ex:
-        if ex.name == "ruleset":
-            logger.warning("No rules defined!")
-        else:
-            raise ex
+    if host is not None:
+        for name in rulesets:
+            host.add_ruleset(name, importlib.import_module(name).rulesdata)
+    else:
+        try:
+            m_rules = importlib.import_module("ruleset")
+            load_rules_from_rulesdata(m_rules.rulesdata)
+        except ModuleNotFoundError as ex:
+            if ex.name == "ruleset":
+                logger.warning("No rules defined!")
+            else:
+                raise ex
 
     proc_events_filters = os.environ.get("PUBLISH_PROCEVENTS_MATCHING")
     if proc_events_filters:
+        proc_events_match = proc_events_filter(proc_events_filters.split(";"), lambda match: match is not None)
         proc_events_rx_factory().subscribe(
-            on_next=lambda x: publish_proc_events_filtered(x, proc_events_filters.split(";"),
-                                                           lambda match: match is not None)
+            on_next=lambda x: proc_events_match(x) and publish_proc_event(x)
         )
     else:
         proc_events_rx_factory().subscribe(
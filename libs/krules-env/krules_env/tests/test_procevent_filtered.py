@@ -81,3 +81,15 @@ def test_filtered(router, subject):
 
     assert "check-even-value" in subscribed_rules
     assert "check-odd-value" not in subscribed_rules
+
+
+def test_filter_reads_only_matched_fields():
+    from krules_env import proc_events_filter
+    from krules_core.procevents import LazyRecord, lazy
+
+    def _not_needed():
+        raise AssertionError("materialized")
+
+    match_errors = proc_events_filter(["got_errors=true"], lambda match: match is not None)
+    assert not match_errors(LazyRecord({"got_errors": False, "payload": lazy(_not_needed)}))
+    assert match_errors(LazyRecord({"got_errors": True, "payload": lazy(_not_needed)}))
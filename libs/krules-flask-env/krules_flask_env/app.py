@@ -4,11 +4,13 @@ import sys
 
 import json_logging
 from dependency_injector import providers
-from flask import Flask, g
+from flask import Flask, g, Response
 from krules_core.providers import (
     subject_factory,
-    event_router_factory
+    event_router_factory,
+    metrics_factory
 )
+from krules_core.subject.scope import subject_scope
 from krules_env import init
 
 
@@ -19,7 +21,9 @@ def g_wrap(current, *args, **kwargs):
     if event_info is None and len(g.subjects) > 0:
         event_info = g.subjects[0].event_info()
     subject = current(*args, event_info=event_info, **kwargs)
-    g.subjects.append(subject)
+    # inside the request subject scope the same instance is returned again for the same name
+    if not any(s is subject for s in g.subjects):
+        g.subjects.append(subject)
     return subject
 
 
@@ -36,7 +40,12 @@ class KRulesApp(Flask):
             instance_path=None,
             instance_relative_config=False,
             root_path=None,
+            metrics_path=None,
     ):
+        """
+        Rules metrics (see krules_core.metrics) are served in the Prometheus text format on metrics_path
+        (default from RULES_METRICS_PATH environment variable, eg: "/metrics"), not served when not set
+        """
         super().__init__(
             import_name,
             static_url_path,
@@ -84,15 +93,25 @@ class KRulesApp(Flask):
         subject_factory.override(providers.Factory(lambda *args, **kw: g_wrap(subject_factory.cls, *args, **kw)))
         self.router = event_router_factory()
 
+        if metrics_path is None:
+            metrics_path = os.environ.get("RULES_METRICS_PATH")
+        if metrics_path:
+            self.add_url_rule(metrics_path, "krules_metrics", self._metrics, methods=["GET"])
+
+    @staticmethod
+    def _metrics():
+        return Response(metrics_factory().render(), mimetype="text/plain; version=0.0.4")
+
     def _wrap_function(self, view_func):
 
         exec(
             """def wrapper(view_func):
                     def wrapped_%s():
                         g.subjects = []
-                        resp = view_func()
-                        for sub in g.subjects:
-                            sub.store()
+                        with subject_scope():
+                            resp = view_func()
+                            for sub in g.subjects:
+                                sub.store()
                         return resp
                     return  wrapped_%s""" % (view_func.__name__, view_func.__name__))
 
@@ -15,7 +15,7 @@ from bson import ObjectId
 
 import logging
 
-from pymongo import errors, WriteConcern, ReadPreference, MongoClient
+from pymongo import errors, WriteConcern, ReadPreference, MongoClient, ReturnDocument
 from pymongo.read_concern import ReadConcern
 
 logger = logging.getLogger(__name__)
@@ -69,6 +69,8 @@ class SubjectsMongoStorage(object):
         self._collection = collection
         self._db = db
         self._client = client
+        # client arguments may not be hashable
+        self._client_config = repr((tuple(client_args), sorted(client_kwargs.items())))
 
     def _get_collection(self):
         return self._client[self._db][self._collection]
@@ -82,6 +84,37 @@ class SubjectsMongoStorage(object):
     def is_persistent(self):
         return True
 
+    def batch_key(self):
+        """
+        Storages with the same key read from the same database and collection (see load_many)
+        """
+        return self._client_config, self._db, self._collection
+
+    def load_many(self, names):
+        """
+        Same as load for several subjects (sharing this storage configuration), in a single query.
+        Returns a dictionary mapping each name to its properties and extended properties
+        """
+        names = [str(name) for name in names]
+        res = {name: ({}, {}) for name in names}
+        docs = self._get_collection().find(
+            {"name": {"$in": names}},
+            projection={"_id": False, "_lock": False, "_event_info": False, "_version": False}
+        )
+        for doc in docs:
+            name = doc.pop("name")
+            props = dict(zip((PropertyType.DEFAULT, PropertyType.EXTENDED), res[name]))
+            for k, v in doc.items():
+                props[k[0]][k[1:]] = v
+        return res
+
+    def get_version(self):
+        """
+        Changes on every write to the subject (a new ObjectId each time, None when there is no document)
+        """
+        doc = self._get_collection().find_one({"name": self._subject}, projection={"_id": False, "_version": True})
+        return doc and doc.get("_version") or None
+
     def load(self):
         res = {
             PropertyType.DEFAULT: {},
@@ -90,7 +123,7 @@ class SubjectsMongoStorage(object):
 
         doc = self._get_collection().find_one(
             {"name": self._subject},
-            projection={"_id": False, "_lock": False, "name": False, "_event_info": False}
+            projection={"_id": False, "_lock": False, "name": False, "_event_info": False, "_version": False}
         )
         if doc is None:
             doc = {}
@@ -99,6 +132,27 @@ class SubjectsMongoStorage(object):
             res[k[0]][k[1:]] = v
         return res[PropertyType.DEFAULT], res[PropertyType.EXTENDED]
 
+    def load_props(self, props):
+        """
+        Same as load, restricted to the given properties (missing ones are not returned)
+        """
+        res = {
+            PropertyType.DEFAULT: {},
+            PropertyType.EXTENDED: {}
+        }
+        projection = {f"{prop.type}{prop.name}": True for prop in props}
+        if not projection:
+            return res[PropertyType.DEFAULT], res[PropertyType.EXTENDED]
+        projection["_id"] = False
+
+        doc = self._get_collection().find_one({"name": self._subject}, projection=projection)
+        if doc is None:
+            doc = {}
+
+        for k, v in doc.items():
+            res[k[0]][k[1:]] = v
+        return res[PropertyType.DEFAULT], res[PropertyType.EXTENDED]
+
     def store(self, inserts=[], updates=[], deletes=[]):
 
         if len(inserts) + len(updates) + len(deletes) == 0:
@@ -111,9 +165,8 @@ class SubjectsMongoStorage(object):
         for prop in deletes:
             hunset[f"{prop.type}{prop.name}"] = 1
 
-        hupdate = {}
-        if len(hset):
-            hupdate.update({"$set": hset})
+        hset["_version"] = ObjectId()
+        hupdate = {"$set": hset}
         if len(hunset):
             hupdate.update({"$unset": hunset})
 
@@ -123,6 +176,31 @@ class SubjectsMongoStorage(object):
             upsert=True
         )
 
+    def store_versioned(self, version, inserts=[], updates=[], deletes=[]):
+        """
+        Same as store, provided that the subject version (see get_version) is still the given one.
+        Returns False, without writing, otherwise
+        """
+        hset = {}
+        for prop in tuple(inserts) + tuple(updates):
+            hset[f"{prop.type}{prop.name}"] = prop.get_value()
+        hset["_version"] = ObjectId()
+        hupdate = {"$set": hset}
+        if len(deletes):
+            hupdate["$unset"] = {f"{prop.type}{prop.name}": 1 for prop in deletes}
+
+        # without a version (no document yet, or one written before versioning) a concurrently inserted
+        # document makes the upsert violate the unique index on name
+        try:
+            res = self._get_collection().update_one(
+                {"name": self._subject, "_version": version is None and {"$exists": False} or version},
+                hupdate,
+                upsert=True
+            )
+        except errors.DuplicateKeyError:
+            return False
+        return res.matched_count == 1 or res.upserted_id is not None
+
     def set(self, prop, old_value_default=None):
 
         pname = f"{prop.type}{prop.name}"
@@ -190,7 +268,7 @@ class SubjectsMongoStorage(object):
 
             session.client[self._db][self._collection].update_one(
                 {"name": self._subject},
-                {"$set": {pname: values[0]}},
+                {"$set": {pname: values[0], "_version": ObjectId()}},
                 upsert=True,
 
             )
@@ -210,6 +288,28 @@ class SubjectsMongoStorage(object):
 
         return values[0], values[1]
 
+    def incr(self, prop, amount=1):
+        """
+        Adds amount to a numeric property (a missing one counts as 0) with a single atomic update.
+        Returns new and old value
+        """
+        pname = f"{prop.type}{prop.name}"
+        try:
+            doc = self._get_collection().find_one_and_update(
+                {"name": self._subject},
+                {"$inc": {pname: amount}, "$set": {"_version": ObjectId()}},
+                projection={"_id": False, pname: True},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except errors.OperationFailure as ex:
+            # "Cannot apply $inc to a value of non-numeric type" (TypeMismatch)
+            if ex.code == 14 or "Cannot apply $inc" in str(ex):
+                raise TypeError("{} is not a number".format(prop.name)) from ex
+            raise
+        old_value = doc.get(pname) if doc is not None else None
+        return (old_value or 0) + amount, old_value
+
     def get(self, prop):
         """
         Get a single property
@@ -233,6 +333,8 @@ class SubjectsMongoStorage(object):
             {"name": self._subject},
             {"$unset": {
                 pname: ""
+            }, "$set": {
+                "_version": ObjectId()
             }}
         )
 
@@ -241,7 +343,7 @@ class SubjectsMongoStorage(object):
         props = {}
         res = self._get_collection().find_one(
             {"name": self._subject},
-            projection={"_id": False, "_lock": False, "name": False, "_event_info": False}
+            projection={"_id": False, "_lock": False, "name": False, "_event_info": False, "_version": False}
         )
         if res is not None:
             for pname, pvalue in res.items():
@@ -0,0 +1,131 @@
+# Copyright 2019 The KRules Authors
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#     http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Process wide registry of redis connection pools.
+
+A storage is created for each subject of each event, instead of opening their own connections storages
+borrow them from the pool shared by all the storages with the same url and key prefix. Pools are created on
+first use with at most REDIS_MAX_CONNECTIONS connections (default: no limit) and connections idle for more
+than REDIS_HEALTH_CHECK_INTERVAL seconds (default 30, 0 disables) are checked before being used. With a
+limit, REDIS_POOL_TIMEOUT (seconds) makes callers wait for a free connection instead of failing.
+A forked process starts with no pools, connections are never shared with the parent.
+"""
+
+import os
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+import redis
+
+
+def _redact(url):
+    parts = urlsplit(url)
+    if parts.password is None:
+        return url
+    return urlunsplit(parts._replace(netloc="{}:***@{}".format(parts.username or "", parts.netloc.rpartition("@")[2])))
+
+
+def _float_env(name):
+    value = os.environ.get(name)
+    return value and float(value) or None
+
+
+class RedisPools(object):
+
+    def __init__(self, max_connections=None, health_check_interval=30, timeout=None):
+        self.max_connections = max_connections
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self._reset()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_connections=int(os.environ.get("REDIS_MAX_CONNECTIONS", 0)) or None,
+            health_check_interval=int(os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", 30)),
+            timeout=_float_env("REDIS_POOL_TIMEOUT"),
+        )
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        # (url, key prefix) -> client
+        self._clients = {}
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # forked, the pools (and the lock, possibly held by a thread of the parent) belong to the parent
+            self._reset()
+
+    def _create_pool(self, url):
+        kwargs = {"health_check_interval": self.health_check_interval}
+        if self.max_connections is None:
+            return redis.ConnectionPool.from_url(url, **kwargs)
+        kwargs["max_connections"] = self.max_connections
+        if self.timeout is not None:
+            return redis.BlockingConnectionPool.from_url(url, timeout=self.timeout, **kwargs)
+        return redis.ConnectionPool.from_url(url, **kwargs)
+
+    def get_client(self, url, key_prefix=""):
+        """
+        Client borrowing its connections from the pool of url and key_prefix
+        """
+        self._check_pid()
+        key = (url, key_prefix)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._clients[key] = redis.Redis(connection_pool=self._create_pool(url))
+        return client
+
+    def stats(self):
+        """
+        Yields url (password redacted), key prefix, connections in use and idle connections for each pool
+        """
+        self._check_pid()
+        with self._lock:
+            clients = list(self._clients.items())
+        for (url, key_prefix), client in clients:
+            pool = client.connection_pool
+            if isinstance(pool, redis.BlockingConnectionPool):
+                idle = len([conn for conn in list(pool.pool.queue) if conn is not None])
+                in_use = len(pool._connections) - idle
+            else:
+                idle = len(pool._available_connections)
+                in_use = len(pool._in_use_connections)
+            yield _redact(url), key_prefix, in_use, idle
+
+    def render(self):
+        """
+        Prometheus text exposition format (version 0.0.4)
+        """
+        lines = [
+            "# HELP krules_redis_pool_connections Connections of the redis pools by state",
+            "# TYPE krules_redis_pool_connections gauge",
+        ]
+        for url, key_prefix, in_use, idle in self.stats():
+            for state, count in (("in_use", in_use), ("idle", idle)):
+                lines.append('krules_redis_pool_connections{{url="{}",key_prefix="{}",state="{}"}} {}'.format(
+                    url, key_prefix, state, count))
+        return "\n".join(lines) + "\n"
+
+    def disconnect(self):
+        self._check_pid()
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            client.connection_pool.disconnect()
+
+
+pools = RedisPools.from_env()
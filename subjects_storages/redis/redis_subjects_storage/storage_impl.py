@@ -9,20 +9,49 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
 import redis
 
 import logging
 logger = logging.getLogger(__name__)
 
+from krules_core.codec import current_codec, decode
 from krules_core.subject import PropertyType
 
+from .pools import pools as default_pools
+
+# KEYS: subject hash, version; ARGV: field, amount. Integers stay integers when both the stored value
+# and the amount are, floats stay floats. Nothing is written, version included, if the value is not a number
+_INCR_SCRIPT = """
+local old = redis.call("HGET", KEYS[1], ARGV[1])
+if old and not tonumber(old) then
+    return redis.error_reply("not a number")
+end
+local new
+if (not old or string.match(old, "^-?%d+$")) and string.match(ARGV[2], "^-?%d+$") then
+    new = redis.call("HINCRBY", KEYS[1], ARGV[1], ARGV[2])
+    new = redis.call("HGET", KEYS[1], ARGV[1])
+else
+    new = redis.call("HINCRBYFLOAT", KEYS[1], ARGV[1], ARGV[2])
+    if not string.find(new, "[%.eEn]") then
+        new = new .. ".0"
+        redis.call("HSET", KEYS[1], ARGV[1], new)
+    end
+end
+redis.call("INCR", KEYS[2])
+return {old, new}
+"""
+
 
 class SubjectsRedisStorage(object):
 
-    def __init__(self, subject, url, key_prefix=""):
+    def __init__(self, subject, url, key_prefix="", pools=None):
+        """
+        Connections are borrowed from the pool of url and key_prefix in pools
+        (default: the process wide one, see redis_subjects_storage.pools)
+        """
         self._subject = str(subject)
-        self._conn = redis.Redis.from_url(url)
+        self._conn = (pools or default_pools).get_client(url, key_prefix)
+        self._url = url
         self._key_prefix = key_prefix
 
     def __str__(self):
@@ -34,15 +63,62 @@ class SubjectsRedisStorage(object):
     def is_persistent(self):
         return True
 
-    def load(self):
+    def _version_key(self):
+        # kept apart from the subject hash, so that it survives flush
+        return f"v:{self._key_prefix}{self._subject}"
+
+    def get_version(self):
+        """
+        Changes on every write to the subject
+        """
+        return int(self._conn.get(self._version_key()) or 0)
+
+    @staticmethod
+    def _parse(hset):
         res = {
             PropertyType.DEFAULT: {},
             PropertyType.EXTENDED: {}
         }
-        hset = self._conn.hgetall(f"s:{self._key_prefix}{self._subject}")
         for k, v in hset.items():
             k = k.decode("utf-8")
-            res[k[0]][k[1:]] = json.loads(v)
+            res[k[0]][k[1:]] = decode(v)
+        return res[PropertyType.DEFAULT], res[PropertyType.EXTENDED]
+
+    def load(self):
+        return self._parse(self._conn.hgetall(f"s:{self._key_prefix}{self._subject}"))
+
+    def batch_key(self):
+        """
+        Storages with the same key read from the same backend and namespace (see load_many)
+        """
+        return self._url, self._key_prefix
+
+    def load_many(self, names):
+        """
+        Same as load for several subjects (sharing this storage configuration), in a single round trip.
+        Returns a dictionary mapping each name to its properties and extended properties
+        """
+        names = [str(name) for name in names]
+        with self._conn.pipeline(transaction=False) as pipe:
+            for name in names:
+                pipe.hgetall(f"s:{self._key_prefix}{name}")
+            hsets = pipe.execute()
+        return {name: self._parse(hset) for name, hset in zip(names, hsets)}
+
+    def load_props(self, props):
+        """
+        Same as load, restricted to the given properties (missing ones are not returned)
+        """
+        res = {
+            PropertyType.DEFAULT: {},
+            PropertyType.EXTENDED: {}
+        }
+        props = list(props)
+        if props:
+            values = self._conn.hmget(f"s:{self._key_prefix}{self._subject}", [f"{p.type}{p.name}" for p in props])
+            for prop, value in zip(props, values):
+                if value is not None:
+                    res[prop.type][prop.name] = decode(value)
         return res[PropertyType.DEFAULT], res[PropertyType.EXTENDED]
 
     def store(self, inserts=[], updates=[], deletes=[]):
@@ -53,13 +129,40 @@ class SubjectsRedisStorage(object):
         skey = f"s:{self._key_prefix}{self._subject}"
         hset = {}
         for prop in tuple(inserts)+tuple(updates):
-            hset[f"{prop.type}{prop.name}"] = prop.json_value()
+            hset[f"{prop.type}{prop.name}"] = prop.encoded_value()
         with self._conn.pipeline() as pipe:
             pipe.hmset(skey, hset)
             for pkey in [f"{el.type}{el.name}" for el in deletes]:
                 pipe.hdel(skey, pkey)
+            pipe.incr(self._version_key())
             pipe.execute()
 
+    def store_versioned(self, version, inserts=[], updates=[], deletes=[]):
+        """
+        Same as store, provided that the subject version is still the given one.
+        Returns False, without writing, otherwise
+        """
+        skey = f"s:{self._key_prefix}{self._subject}"
+        vkey = self._version_key()
+        hset = {}
+        for prop in tuple(inserts)+tuple(updates):
+            hset[f"{prop.type}{prop.name}"] = prop.encoded_value()
+        try:
+            with self._conn.pipeline() as pipe:
+                pipe.watch(vkey)
+                if int(pipe.get(vkey) or 0) != version:
+                    return False
+                pipe.multi()
+                if hset:
+                    pipe.hset(skey, mapping=hset)
+                for pkey in [f"{el.type}{el.name}" for el in deletes]:
+                    pipe.hdel(skey, pkey)
+                pipe.incr(vkey)
+                pipe.execute()
+        except redis.WatchError:
+            return False
+        return True
+
 
     def set(self, prop, old_value_default=None):
         """
@@ -78,28 +181,46 @@ class SubjectsRedisStorage(object):
                         if old_value is None:
                             old_value = old_value_default
                         else:
-                            old_value = json.loads(old_value)
-                        new_value = prop.json_value(old_value)
+                            old_value = decode(old_value)
+                        new_value = prop.encoded_value(old_value)
                         pipe.hset(skey, pname, new_value)
+                        pipe.incr(self._version_key())
                         pipe.execute()
                         break
                 except redis.WatchError:
                     continue
-            new_value = json.loads(new_value)
+            new_value = decode(new_value)
         else:
             with self._conn.pipeline() as pipe:
                 pipe.hget(skey, pname)
-                pipe.hset(skey, pname, prop.json_value())
-                old_value, _ = pipe.execute()
+                pipe.hset(skey, pname, prop.encoded_value())
+                pipe.incr(self._version_key())
+                old_value, _, _ = pipe.execute()
                 if old_value is None:
                     old_value = old_value_default
                 else:
-                    old_value = json.loads(old_value)
+                    old_value = decode(old_value)
 
                 new_value = prop.get_value()
 
         return new_value, old_value
 
+    def incr(self, prop, amount=1):
+        """
+        Adds amount to a numeric property (a missing one counts as 0) without reading it first.
+        Returns new and old value
+        """
+        if current_codec().tag is not None:
+            # binary encoded values can not be incremented by redis
+            return self.set(type(prop)(prop.name, lambda value: (value or 0) + amount))
+        skey = f"s:{self._key_prefix}{self._subject}"
+        pname = f"{prop.type}{prop.name}"
+        try:
+            old_value, new_value = self._conn.eval(_INCR_SCRIPT, 2, skey, self._version_key(), pname, repr(amount))
+        except redis.ResponseError as ex:
+            raise TypeError("{} is not a number".format(prop.name)) from ex
+        return decode(new_value), None if old_value is None else decode(old_value)
+
     def get(self, prop):
         """
         Get a single property
@@ -113,7 +234,7 @@ class SubjectsRedisStorage(object):
             exists, value = pipe.execute()
         if not exists:
             raise AttributeError(prop.name)
-        return json.loads(value)
+        return decode(value)
 
     def delete(self, prop):
         """
@@ -121,19 +242,25 @@ class SubjectsRedisStorage(object):
         """
         skey = f"s:{self._key_prefix}{self._subject}"
         pname = f"{prop.type}{prop.name}"
-        self._conn.hdel(skey, pname)
+        with self._conn.pipeline() as pipe:
+            pipe.hdel(skey, pname)
+            pipe.incr(self._version_key())
+            pipe.execute()
 
     def get_ext_props(self):
 
         props = {}
         skey = f"s:{self._key_prefix}{self._subject}"
         for pname, pval in self._conn.hscan_iter(skey, f"{PropertyType.EXTENDED}*"):
-            props[pname[1:].decode("utf-8")] = json.loads(pval)
+            props[pname[1:].decode("utf-8")] = decode(pval)
         return props
 
     def flush(self):
         skey = f"s:{self._key_prefix}{self._subject}"
-        self._conn.delete(skey)
+        with self._conn.pipeline() as pipe:
+            pipe.delete(skey)
+            pipe.incr(self._version_key())
+            pipe.execute()
         return self
 
 
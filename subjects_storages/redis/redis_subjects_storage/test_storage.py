@@ -260,5 +260,68 @@ def test_ret_values(storage_subject1):
     assert new_val == vp1+1
 
 
+def test_incr(storage_subject1):
 
-
+    storage_subject1.flush()
+    version = storage_subject1.get_version()
+
+    assert storage_subject1.incr(SubjectProperty("cnt"), 3) == (3, None)
+    new_val, old_val = storage_subject1.incr(SubjectProperty("cnt"))
+    assert (new_val, old_val) == (4, 3) and type(new_val) is int and type(old_val) is int
+    assert storage_subject1.incr(SubjectProperty("cnt"), 0.5) == (4.5, 4)
+    storage_subject1.set(SubjectProperty("fcnt", 3.0))
+    new_val, old_val = storage_subject1.incr(SubjectProperty("fcnt"))
+    assert (new_val, old_val) == (4.0, 3.0) and type(new_val) is float and type(old_val) is float
+    assert storage_subject1.get(SubjectProperty("fcnt")) == 4.0
+    assert storage_subject1.get_version() == version + 4
+
+    storage_subject1.set(SubjectProperty("name", "abc"))
+    with pytest.raises(TypeError):
+        storage_subject1.incr(SubjectProperty("name"))
+    # nothing written
+    assert storage_subject1.get_version() == version + 5
+    assert storage_subject1.get(SubjectProperty("name")) == "abc"
+
+
+def test_pools():
+    from redis_subjects_storage.pools import RedisPools
+
+    pools = RedisPools(max_connections=2)
+    url = "redis://:secret@localhost/0"
+    storage1 = storage_impl.SubjectsRedisStorage("subject1", url, "myapp", pools=pools)
+    storage2 = storage_impl.SubjectsRedisStorage("subject2", url, "myapp", pools=pools)
+    storage3 = storage_impl.SubjectsRedisStorage("subject1", url, "otherapp", pools=pools)
+    assert storage1._conn is storage2._conn
+    assert storage1._conn is not storage3._conn
+    assert storage1._conn.connection_pool.max_connections == 2
+
+    assert sorted(pools.stats()) == [
+        ("redis://:***@localhost/0", "myapp", 0, 0),
+        ("redis://:***@localhost/0", "otherapp", 0, 0),
+    ]
+    assert 'key_prefix="myapp",state="idle"} 0' in pools.render()
+
+    # a forked process does not reuse the pools of the parent
+    pools._pid = -1
+    assert storage_impl.SubjectsRedisStorage("subject1", url, "myapp", pools=pools)._conn is not storage1._conn
+
+
+
+def test_pools_by_url():
+    from redis_subjects_storage.pools import RedisPools
+
+    pools = RedisPools()
+    client = pools.get_client("redis://localhost/0")
+    assert pools.get_client("redis://localhost/0") is client
+    others = [pools.get_client(url) for url in ("redis://localhost/1", "redis://otherhost/0")]
+    assert len({id(c.connection_pool) for c in [client] + others}) == 3
+    assert [c.connection_pool.connection_kwargs["db"] for c in [client] + others] == [0, 1, 0]
+
+    disconnected = []
+    for c in [client] + others:
+        c.connection_pool.disconnect = lambda _pool=c.connection_pool: disconnected.append(_pool)
+    pools.disconnect()
+    assert disconnected == [c.connection_pool for c in [client] + others]
+    assert list(pools.stats()) == []
+    # pools are created again on the next use
+    assert pools.get_client("redis://localhost/0") is not client